@@ -15,7 +15,7 @@ import openravepy
 from openravepy import *
 from numpy import *
 from optparse import OptionParser
-import os, sys, operator
+import os, sys, operator, json
 import scipy
 import shutil
 import pysvn
@@ -339,15 +339,52 @@ Degenerate configurations can frequently occur when the robot axes align, this p
     with open(os.path.join(outputdir,'index.rst'),'w') as f:
         f.write(text)
 
+class BenchmarkOptions:
+    def __init__(self,runoptions):
+        self.__dict__.update(runoptions)
+
+def loadbenchmark(filename):
+    """converts the json records of test/ikfastbenchmark.py into the statistics written by test/test_ikfast.py. The last record of every job is used."""
+    runoptions = None
+    records = dict()
+    with open(filename,'r') as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            record = json.loads(line)
+            if record['type'] == 'options':
+                runoptions = record
+            elif record['type'] == 'job':
+                records[record['key']] = record
+    allstats = []
+    for key,record in sorted(records.iteritems()):
+        stat = [record['robotfilename'],record['manipname'],record['iktype'],record['freeindices'],[record.get('description',key)]]
+        if record['status'] in ('success','failed'):
+            sourcecode = None
+            if os.path.exists(record['sourcefilename']):
+                with open(record['sourcefilename'],'r') as fsource:
+                    sourcecode = fsource.read()
+            latency = record['latency'] if record['latency'] is not None else {}
+            stat += [record['sourcefilename'] if sourcecode is not None else None,latency.get('mean'),latency.get('max'),record['successrate'],record['wrongrate'],sourcecode]
+        else:
+            stat += [None,None,None,None,None,None]
+        allstats.append(stat)
+    return allstats,BenchmarkOptions(runoptions)
+
 if __name__ == "__main__":
     parser = OptionParser(description='Builds the ik database')
     parser.add_option('--outdir','--outputdir',action="store",type='string',dest='outputdir',default='ikfast',
                       help='Output directory to write all interfaces reStructuredText files inside the folder (default=%default).')
     parser.add_option('--ikfaststats',action="store",type='string',dest='ikfaststats',default='ikfaststats.pp',
                       help='The python pickled file containing ikfast statistics.')
+    parser.add_option('--ikbenchmark',action="store",type='string',dest='ikbenchmark',default=None,
+                      help='If set, the results file of test/ikfastbenchmark.py to use instead of the pickled ikfast statistics.')
     (options,args) = parser.parse_args()
 
-    if not os.path.exists(options.ikfaststats):
+    if options.ikbenchmark is not None:
+        if not os.path.exists(options.ikbenchmark):
+            sys.exit(1)
+    elif not os.path.exists(options.ikfaststats):
         sys.exit(1)
 
     try:
@@ -360,8 +397,11 @@ if __name__ == "__main__":
         os.makedirs(imagedir)
     except OSError:
         pass
-    with open(options.ikfaststats,'r') as f:
-        allstats,buildoptions = pickle.load(f)
+    if options.ikbenchmark is not None:
+        allstats,buildoptions = loadbenchmark(options.ikbenchmark)
+    else:
+        with open(options.ikfaststats,'r') as f:
+            allstats,buildoptions = pickle.load(f)
     env=Environment()
     try:
         env.SetViewer('qtcoin',False)
@@ -39,11 +39,6 @@ import time
 import logging
 log = logging.getLogger('openravepy.databases')
 
-try:
-    import h5py
-except ImportError:
-    pass
-    
 class DatabaseGenerator(metaclass.AutoReloader):
     """The base class defining the structure of the openrave database generators.
     """
@@ -269,16 +264,13 @@ class DatabaseGenerator(metaclass.AutoReloader):
             if destroyenv and env is not None:
                 env.Destroy()
 
-import inversekinematics
-import grasping
-import convexdecomposition
-import linkstatistics
-import kinematicreachability
-import inversereachability
-    
+# the database modules are imported when first used, see lazyimport
+from ..lazyimport import InstallLazySubmodules
+_submodules = ['inversekinematics', 'grasping', 'convexdecomposition', 'linkstatistics', 'kinematicreachability', 'inversereachability']
 # python 2.5 raises 'import *' not allowed with 'from .'
 from sys import version_info
 if version_info[0:3]>=(2,6,0):
-    import visibilitymodel
+    _submodules.append('visibilitymodel')
 else:
     log.warn('some openravepy.datbases cannot be used python versions < 2.6')
+InstallLazySubmodules(__name__, _submodules)
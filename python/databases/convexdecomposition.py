@@ -84,11 +84,22 @@ import os.path
 from os import makedirs
 from optparse import OptionParser
 from itertools import izip
+import hashlib
 
 try:
     from cStringIO import StringIO
 except:
     from StringIO import StringIO
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
     
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
@@ -106,8 +117,115 @@ class ConvexDecompositionError(Exception):
     def __str__(self):
         return unicode(self).encode('utf-8')
 
+def _ComputePaddedConvexDecompositionHulls(args):
+    """process pool worker, returns the (vertices,indices,planes) hulls of one geometry"""
+    vertices, indices, padding, convexparams = args
+    orghulls = ConvexDecompositionModel.ComputePaddedConvexDecomposition(vertices, indices, padding, convexparams)
+    return [(hull[0],hull[1],ConvexDecompositionModel.ComputeHullPlanes(hull)) for hull in orghulls]
+
+class PackedConvexHulls(object):
+    """Point containment query structure for the convex hulls of a :class:`ConvexDecompositionModel`.
+
+    All hull planes of a link are packed into one contiguous array in the link coordinate system, with offsets delimiting each hull. Each link also keeps a bounding sphere and an axis-aligned bounding box for culling points before testing the planes. The structure is built once and the link poses can be updated with :meth:`SetLinkTransformations` before every query.
+    """
+    def __init__(self,cdmodel):
+        """
+        :param cdmodel: a loaded :class:`ConvexDecompositionModel`
+        """
+        self.links = [] # for every link with geometry: (ilink, planes, hulloffsets, spheres, cylinders, aabbmin, aabbmax, spherecenter, sphereradius)
+        with cdmodel.env:
+            robot = cdmodel.robot
+            for ilink,link in enumerate(robot.GetLinks()):
+                allplanes = []
+                hulloffsets = []
+                spheres = [] # center,radius
+                cylinders = [] # Tinv,radius,halfheight, openrave cylinders are along the z axis of the geometry
+                boundpoints = []
+                numplanes = 0
+                for ig,geom in enumerate(link.GetGeometries()):
+                    Tgeom = geom.GetTransform()
+                    Tgeominv = linalg.inv(Tgeom)
+                    cdhulls = [cdhull for ig2,cdhull in cdmodel.linkgeometry[ilink] if ig2==ig]
+                    if len(cdhulls) > 0:
+                        for hull in cdhulls[0]:
+                            if len(hull[2]) == 0:
+                                continue
+                            hulloffsets.append(numplanes)
+                            allplanes.append(dot(hull[2],Tgeominv))
+                            numplanes += len(hull[2])
+                            boundpoints.append(transformPoints(Tgeom,hull[0]))
+                    elif geom.GetType() == KinBody.Link.GeomType.Box:
+                        extents = geom.GetBoxExtents()
+                        boxplanes = c_[r_[eye(3),-eye(3)],-r_[extents,extents]]
+                        hulloffsets.append(numplanes)
+                        allplanes.append(dot(boxplanes,Tgeominv))
+                        numplanes += len(boxplanes)
+                        boundpoints.append(transformPoints(Tgeom,ComputeBoxMesh(extents)[0]))
+                    elif geom.GetType() == KinBody.Link.GeomType.Sphere:
+                        radius = geom.GetSphereRadius()
+                        spheres.append((Tgeom[0:3,3],radius))
+                        boundpoints.append(ComputeBoxMesh([radius,radius,radius])[0]+Tgeom[0:3,3])
+                    elif geom.GetType() == KinBody.Link.GeomType.Cylinder:
+                        radius = geom.GetCylinderRadius()
+                        halfheight = 0.5*geom.GetCylinderHeight()
+                        cylinders.append((Tgeominv,radius,halfheight))
+                        boundpoints.append(transformPoints(Tgeom,ComputeBoxMesh([radius,radius,halfheight])[0]))
+                if len(boundpoints) == 0:
+                    continue
+                boundpoints = numpy.concatenate(boundpoints)
+                aabbmin = numpy.min(boundpoints,0)
+                aabbmax = numpy.max(boundpoints,0)
+                spherecenter = 0.5*(aabbmin+aabbmax)
+                sphereradius = sqrt(numpy.max(sum((boundpoints-spherecenter)**2,1)))
+                planes = numpy.ascontiguousarray(numpy.concatenate(allplanes)) if len(allplanes) > 0 else zeros((0,4))
+                self.links.append((ilink,planes,array(hulloffsets,int),spheres,cylinders,aabbmin,aabbmax,spherecenter,sphereradius))
+            self.SetLinkTransformations(robot.GetLinkTransformations())
+        
+    def SetLinkTransformations(self,transforms):
+        """sets the link poses used by the queries, usually robot.GetLinkTransformations()"""
+        self.linktransforms = [transforms[ilink] for ilink,planes,hulloffsets,spheres,cylinders,aabbmin,aabbmax,spherecenter,sphereradius in self.links]
+        
+    def testPointsInside(self,points,transforms=None,chunksize=65536):
+        """returns a boolean array the same length as points (Nx3) that specifies whether the point is inside any hull or geometry.
+
+        :param transforms: if not None, calls SetLinkTransformations first
+        :param chunksize: maximum number of points tested against the planes of a link at once, bounds the memory used
+        """
+        if transforms is not None:
+            self.SetLinkTransformations(transforms)
+        points = numpy.asarray(points,float64)
+        inside = zeros(len(points),bool)
+        for (ilink,planes,hulloffsets,spheres,cylinders,aabbmin,aabbmax,spherecenter,sphereradius),T in izip(self.links,self.linktransforms):
+            # broad phase with the bounding sphere in world coordinates, then the aabb in link coordinates
+            leftinds = flatnonzero(~inside)
+            worldcenter = dot(T[0:3,0:3],spherecenter)+T[0:3,3]
+            leftinds = leftinds[sum((points[leftinds]-worldcenter)**2,1) <= sphereradius**2]
+            if len(leftinds) == 0:
+                continue
+            localpoints = dot(points[leftinds]-T[0:3,3],T[0:3,0:3])
+            inaabb = numpy.all(logical_and(localpoints >= aabbmin, localpoints <= aabbmax),1)
+            leftinds = leftinds[inaabb]
+            localpoints = localpoints[inaabb]
+            if len(leftinds) == 0:
+                continue
+            linkinside = zeros(len(leftinds),bool)
+            if len(planes) > 0:
+                for ichunk in range(0,len(localpoints),chunksize):
+                    chunkpoints = localpoints[ichunk:(ichunk+chunksize)]
+                    # a point is inside a hull if the maximum signed distance over its planes is not positive
+                    dists = dot(chunkpoints,planes[:,0:3].T)+planes[:,3]
+                    linkinside[ichunk:(ichunk+chunksize)] = numpy.any(numpy.maximum.reduceat(dists,hulloffsets,axis=1)<=0,1)
+            for center,radius in spheres:
+                linkinside |= sum((localpoints-center)**2,1) <= radius**2
+            for Tinv,radius,halfheight in cylinders:
+                geompoints = dot(localpoints,Tinv[0:3,0:3].T)+Tinv[0:3,3]
+                linkinside |= logical_and(abs(geompoints[:,2]) <= halfheight, geompoints[:,0]**2+geompoints[:,1]**2 <= radius**2)
+            inside[leftinds[linkinside]] = True
+        return inside
+    
 class ConvexDecompositionModel(DatabaseGenerator):
     """Computes the convex decomposition of all of the robot's links"""
+    maxcachedgeometries = 5000 # maximum number of geometry hulls kept in the convexdecomposition.geometries cache, the least recently used are removed first
     def __init__(self,robot,padding=0.0):
         """
         :param padding: the desired padding
@@ -117,6 +235,7 @@ class ConvexDecompositionModel(DatabaseGenerator):
         self.convexparams = None
         self._padding = padding
         self._graspermodule = None # for convex hulls
+        self._packedhulls = None # (linkgeometry, PackedConvexHulls) for testPointsInside
         
     def clone(self,envother):
         clone = DatabaseGenerator.clone(self,envother)
@@ -151,6 +270,8 @@ class ConvexDecompositionModel(DatabaseGenerator):
         DatabaseGenerator.save(self,(self.linkgeometry,self.convexparams))
 
     def SaveHDF5(self):
+        """saves the hulls in a packed layout: all vertices, indices and planes are concatenated into one dataset each, and the geometries and hulls tables hold the offsets of every (link, geometry, hull)
+        """
         import h5py
         filename=self.getfilename(False)
         log.info(u'saving model to %s',filename)
@@ -159,6 +280,23 @@ class ConvexDecompositionModel(DatabaseGenerator):
         except OSError:
             pass
         
+        geometries = [] # ilink, igeometry
+        hulltable = [] # igeometryentry, vertexoffset, numvertices, indexoffset, numindices, planeoffset, numplanes
+        allvertices = []
+        allindices = []
+        allplanes = []
+        offsets = [0,0,0]
+        for ilink, linkgeometry in enumerate(self.linkgeometry):
+            for ig, geometryhulls in linkgeometry:
+                for hull in geometryhulls:
+                    counts = [len(hull[0]),len(hull[1]),len(hull[2])]
+                    hulltable.append([len(geometries),offsets[0],counts[0],offsets[1],counts[1],offsets[2],counts[2]])
+                    offsets = [offset+count for offset,count in izip(offsets,counts)]
+                    allvertices.append(reshape(hull[0],(-1,3)))
+                    allindices.append(reshape(hull[1],(-1,3)))
+                    allplanes.append(reshape(hull[2],(-1,4)))
+                geometries.append([ilink,ig])
+        
         f=h5py.File(filename,'w')
         try:
             f['version'] = self.getversion()
@@ -166,20 +304,12 @@ class ConvexDecompositionModel(DatabaseGenerator):
             for name,value in self.convexparams.iteritems():
                 gparams[name] = value
             f['padding'] = self._padding
-            glinkgeometry = f.create_group('linkgeometry')
-            for ilink, linkgeometry in enumerate(self.linkgeometry):
-                glink = glinkgeometry.create_group(str(ilink))
-                for ig, geometryhulls in linkgeometry:
-                    glinkhulls = glink.create_group(str(ig))
-                    glinkhulls['igeometry'] = ig
-                    ghulls = glinkhulls.create_group('hulls')
-                    for j, hull in enumerate(geometryhulls):
-                        ghull = ghulls.create_group(str(j))
-                        for name,values in izip(['vertices','indices','planes'],hull):
-                            if len(values) == 0:
-                                ghull.create_dataset(name,[],dtype=values.dtype)
-                            else:
-                                ghull[name] = values
+            f['numlinks'] = len(self.linkgeometry)
+            f.create_dataset('geometries',data=array(geometries,int32).reshape(-1,2))
+            f.create_dataset('hulls',data=array(hulltable,int64).reshape(-1,7))
+            f.create_dataset('vertices',data=numpy.concatenate(allvertices).astype(float64) if len(allvertices) > 0 else zeros((0,3),float64))
+            f.create_dataset('indices',data=numpy.concatenate(allindices).astype(int32) if len(allindices) > 0 else zeros((0,3),int32))
+            f.create_dataset('planes',data=numpy.concatenate(allplanes).astype(float64) if len(allplanes) > 0 else zeros((0,4),float64))
         finally:
             f.close()
 
@@ -195,7 +325,10 @@ class ConvexDecompositionModel(DatabaseGenerator):
         except e:
             return False
 
-    def LoadHDF5(self):
+    def LoadHDF5(self,usememmap=False):
+        """
+        :param usememmap: if True, the packed vertices, indices and planes are memory-mapped from the file instead of read into memory
+        """
         import h5py
         filename = self.getfilename(True)
         if len(filename) == 0:
@@ -214,24 +347,11 @@ class ConvexDecompositionModel(DatabaseGenerator):
             for name,value in gparams.iteritems():
                 self.convexparams[name] = value.value
             self._padding = f['padding'].value
-            glinkgeometry = f['linkgeometry']
-            self.linkgeometry = []
-            for ilink, glink in glinkgeometry.iteritems():
-                linkgeometry = []
-                for ig, glinkhulls in glink.iteritems():
-                    ghulls = glinkhulls['hulls']
-                    geometryhulls = []
-                    for j, ghull in ghulls.iteritems():
-                        if 'vertices' in ghull and len(ghull['vertices'].shape) == 2 and 'indices' in ghull and len(ghull['indices'].shape\
-) == 2 and 'planes' in ghull and len(ghull['planes'].shape) == 2:
-			    hull = [ghull['vertices'].value, ghull['indices'].value, ghull['planes'].value]
-                            geometryhulls.append(hull)
-                        else:
-                            log.warn('could not open link %s geometry %s hull %s: %r', ilink, ig, j, ghull)
-                    linkgeometry.append((int(ig),geometryhulls))
-                while len(self.linkgeometry) <= int(ilink):
-                    self.linkgeometry.append(None)
-                self.linkgeometry[int(ilink)] = linkgeometry
+            if 'linkgeometry' in f:
+                # layout with one group per link, geometry and hull
+                self._LoadHDF5Groups(f)
+            else:
+                self._LoadHDF5Packed(f,filename,usememmap)
             self._databasefile = f
             f = None
             return self.has()
@@ -243,6 +363,47 @@ class ConvexDecompositionModel(DatabaseGenerator):
             if f is not None:
                 f.close()
 
+    @staticmethod
+    def _ReadHDF5Array(dataset,filename,usememmap):
+        """reads the whole dataset with one call, or memory-maps it if possible"""
+        if usememmap and len(dataset) > 0:
+            offset = dataset.id.get_offset()
+            if offset is not None:
+                return numpy.memmap(filename,mode='r',dtype=dataset.dtype,offset=offset,shape=dataset.shape)
+        return dataset[...]
+    
+    def _LoadHDF5Packed(self,f,filename,usememmap=False):
+        geometries = f['geometries'][...]
+        hulltable = f['hulls'][...]
+        allvertices = self._ReadHDF5Array(f['vertices'],filename,usememmap)
+        allindices = self._ReadHDF5Array(f['indices'],filename,usememmap)
+        allplanes = self._ReadHDF5Array(f['planes'],filename,usememmap)
+        geometryhulls = [[] for g in geometries]
+        for igeometry,voffset,nvertices,ioffset,nindices,poffset,nplanes in hulltable:
+            geometryhulls[igeometry].append([allvertices[voffset:(voffset+nvertices)], allindices[ioffset:(ioffset+nindices)], allplanes[poffset:(poffset+nplanes)]])
+        self.linkgeometry = [[] for ilink in range(f['numlinks'].value)]
+        for (ilink,ig),hulls in izip(geometries,geometryhulls):
+            self.linkgeometry[ilink].append((int(ig),hulls))
+    
+    def _LoadHDF5Groups(self,f):
+        glinkgeometry = f['linkgeometry']
+        self.linkgeometry = []
+        for ilink, glink in glinkgeometry.iteritems():
+            linkgeometry = []
+            for ig, glinkhulls in glink.iteritems():
+                ghulls = glinkhulls['hulls']
+                geometryhulls = []
+                for j, ghull in ghulls.iteritems():
+                    if 'vertices' in ghull and len(ghull['vertices'].shape) == 2 and 'indices' in ghull and len(ghull['indices'].shape) == 2 and 'planes' in ghull and len(ghull['planes'].shape) == 2:
+                        hull = [ghull['vertices'].value, ghull['indices'].value, ghull['planes'].value]
+                        geometryhulls.append(hull)
+                    else:
+                        log.warn('could not open link %s geometry %s hull %s: %r', ilink, ig, j, ghull)
+                linkgeometry.append((int(ig),geometryhulls))
+            while len(self.linkgeometry) <= int(ilink):
+                self.linkgeometry.append(None)
+            self.linkgeometry[int(ilink)] = linkgeometry
+
     def setrobot(self):
         with self.env:
             for link,linkcd in izip(self.robot.GetLinks(),self.linkgeometry):
@@ -256,15 +417,17 @@ class ConvexDecompositionModel(DatabaseGenerator):
     
     def autogenerate(self,options=None):
         if options is not None:
-            self.generate(padding=options.padding,skinWidth=options.skinWidth, decompositionDepth=options.decompositionDepth, maxHullVertices=options.maxHullVertices,concavityThresholdPercent=options.concavityThresholdPercent, mergeThresholdPercent=options.mergeThresholdPercent, volumeSplitThresholdPercent=options.volumeSplitThresholdPercent, useInitialIslandGeneration=options.useInitialIslandGeneration, useIslandGeneration=options.useIslandGeneration,convexHullLinks=options.convexHullLinks.split(','))
+            self.generate(padding=options.padding,skinWidth=options.skinWidth, decompositionDepth=options.decompositionDepth, maxHullVertices=options.maxHullVertices,concavityThresholdPercent=options.concavityThresholdPercent, mergeThresholdPercent=options.mergeThresholdPercent, volumeSplitThresholdPercent=options.volumeSplitThresholdPercent, useInitialIslandGeneration=options.useInitialIslandGeneration, useIslandGeneration=options.useIslandGeneration,convexHullLinks=options.convexHullLinks.split(','),numprocesses=options.numprocesses)
         else:
             self.generate()
         self.save()
-    def generate(self,padding=None,minTriangleConvexHullThresh=None,convexHullLinks=None,**kwargs):
+    def generate(self,padding=None,minTriangleConvexHullThresh=None,convexHullLinks=None,numprocesses=None,usecache=True,**kwargs):
         """
         :param padding: the padding in meters
         :param minTriangleConvexHullThresh: If not None, then describes the minimum number of triangles needed to use convex hull rather than convex decomposition. Although this might seem counter intuitive, the current convex decomposition module cannot handle really complex meshes and it takes a long time if it does handle them.
         :param convexHullLinks: a list of link names to compute convex hulls instead of decomposition
+        :param numprocesses: the number of processes decomposing the geometries in parallel. If None, uses the number of cpus
+        :param usecache: if True, the hulls of every geometry are loaded from/saved to a cache keyed on the hash of the collision mesh, padding, and convex decomposition parameters, so only modified geometries are recomputed
         """
         self.convexparams = kwargs
         if padding is None:
@@ -275,11 +438,13 @@ class ConvexDecompositionModel(DatabaseGenerator):
             convexHullLinks = []
         log.info(u'Generating Convex Decomposition: %r',self.convexparams)
         starttime = time.time()
-        self.linkgeometry = []
+        geometryhulls = {} # (ilink,igeom) -> cdhulls
+        jobs = [] # (ilink,igeom,linkname,geometryhash,vertices,indices) to decompose
         with self.env:
             links = self.robot.GetLinks()
+            numlinks = len(links)
+            geometrykeys = []
             for il,link in enumerate(links):
-                geomhulls = []
                 geometries = link.GetGeometries()
                 for ig,geom in enumerate(geometries):
                     if geom.GetType() == KinBody.Link.GeomType.Trimesh or padding > 0:
@@ -287,31 +452,142 @@ class ConvexDecompositionModel(DatabaseGenerator):
                         if len(trimesh.indices) == 0:
                             geom.InitCollisionMesh()
                             trimesh = geom.GetCollisionMesh()
-                        if link.GetName() in convexHullLinks or (minTriangleConvexHullThresh is not None and len(trimesh.indices) > minTriangleConvexHullThresh):
+                        computehull = link.GetName() in convexHullLinks or (minTriangleConvexHullThresh is not None and len(trimesh.indices) > minTriangleConvexHullThresh)
+                        geometrykeys.append((il,ig))
+                        geometryhash = self.ComputeGeometryHash(trimesh,padding,computehull)
+                        if usecache:
+                            cdhulls = self._LoadCachedGeometryHulls(geometryhash)
+                            if cdhulls is not None:
+                                log.info(u'using cached hulls for link %d/%d geom %d/%d',il,len(links), ig, len(geometries))
+                                geometryhulls[(il,ig)] = cdhulls
+                                continue
+                        if computehull:
+                            # the convex hull is computed by the grasper module, so it has to be done with the environment locked
                             log.info(u'computing hull for link %d/%d geom %d/%d: vertices=%d, indices=%d',il,len(links), ig, len(geometries), len(trimesh.vertices), len(trimesh.indices))
                             orghulls = [self.ComputePaddedConvexHullFromTriMesh(trimesh,padding)]
+                            geometryhulls[(il,ig)] = self._CheckHulls(link.GetName(),orghulls)
+                            if usecache:
+                                self._SaveCachedGeometryHulls(geometryhash,geometryhulls[(il,ig)])
                         else:
                             log.info(u'computing decomposition for link %d/%d geom %d/%d type %s',il,len(links), ig, len(geometries), geom.GetType())
-                            orghulls = self.ComputePaddedConvexDecompositionFromTriMesh(trimesh,padding)
-                        cdhulls = []
-                        for hull in orghulls:
-                            if any(isnan(hull[0])):
-                                raise ConvexDecompositionError(u'geom link %s has NaNs', link.GetName())
-                            cdhulls.append((hull[0],hull[1],self.ComputeHullPlanes(hull)))
-                        geomhulls.append((ig,cdhulls))
-                self.linkgeometry.append(geomhulls)
+                            jobs.append((il,ig,link.GetName(),geometryhash,array(trimesh.vertices),array(trimesh.indices)))
+        
+        # the decomposition only needs the copied mesh data, release the environment before forking so the processes do not inherit a locked mutex
+        if len(jobs) > 0:
+            jobargs = [(vertices,indices,padding,self.convexparams) for il,ig,linkname,geometryhash,vertices,indices in jobs]
+            if numprocesses is None:
+                numprocesses = multiprocessing.cpu_count() if multiprocessing is not None else 1
+            numprocesses = min(numprocesses,len(jobs))
+            if numprocesses > 1:
+                log.info(u'decomposing %d geometries with %d processes',len(jobs),numprocesses)
+                pool = multiprocessing.Pool(numprocesses)
+                try:
+                    allhulls = pool.map(_ComputePaddedConvexDecompositionHulls,jobargs)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                allhulls = [_ComputePaddedConvexDecompositionHulls(args) for args in jobargs]
+            for (il,ig,linkname,geometryhash,vertices,indices),cdhulls in izip(jobs,allhulls):
+                geometryhulls[(il,ig)] = self._CheckHulls(linkname,cdhulls)
+                if usecache:
+                    self._SaveCachedGeometryHulls(geometryhash,geometryhulls[(il,ig)])
+        if usecache:
+            self._EvictCachedGeometryHulls()
+        
+        self.linkgeometry = [[] for il in range(numlinks)]
+        for il,ig in geometrykeys:
+            self.linkgeometry[il].append((ig,geometryhulls[(il,ig)]))
         self._padding = padding
         log.info(u'all convex decomposition finished in %fs',time.time()-starttime)
 
+    @staticmethod
+    def _CheckHulls(linkname,hulls):
+        """returns hulls as a list of (vertices,indices,planes), computing the planes if necessary"""
+        cdhulls = []
+        for hull in hulls:
+            if any(isnan(hull[0])):
+                raise ConvexDecompositionError(u'geom link %s has NaNs'%linkname)
+            cdhulls.append((hull[0],hull[1],hull[2] if len(hull) > 2 else ConvexDecompositionModel.ComputeHullPlanes(hull)))
+        return cdhulls
+    
+    def ComputeGeometryHash(self,trimesh,padding,computehull=False):
+        """returns a hash identifying the hulls generated from a collision mesh with the current convex decomposition parameters"""
+        h = hashlib.md5()
+        h.update(numpy.ascontiguousarray(trimesh.vertices,float64).tostring())
+        h.update(numpy.ascontiguousarray(trimesh.indices,int32).tostring())
+        h.update('%r %r %d %r'%(self.getversion(),float(padding),computehull,sorted(self.convexparams.iteritems())))
+        return h.hexdigest()
+    
+    def _GetCachedGeometryHullsFilename(self,geometryhash,read=False):
+        return RaveFindDatabaseFile(os.path.join('convexdecomposition.geometries',geometryhash+'.pp'),read)
+    
+    def _LoadCachedGeometryHulls(self,geometryhash):
+        filename = self._GetCachedGeometryHullsFilename(geometryhash,True)
+        if len(filename) == 0:
+            return None
+        try:
+            with open(filename,'rb') as f:
+                cdhulls = pickle.load(f)
+        except Exception,e:
+            log.warn(u'failed to load cached hulls %s: %s',filename,e)
+            return None
+        try:
+            # the modification time orders the cache for eviction, so mark it as recently used
+            os.utime(filename,None)
+        except OSError:
+            pass
+        return cdhulls
+    
+    def _SaveCachedGeometryHulls(self,geometryhash,cdhulls):
+        filename = self._GetCachedGeometryHullsFilename(geometryhash,False)
+        try:
+            makedirs(os.path.split(filename)[0])
+        except OSError:
+            pass
+        try:
+            with open(filename,'wb') as f:
+                pickle.dump(cdhulls,f,pickle.HIGHEST_PROTOCOL)
+        except IOError,e:
+            log.warn(u'failed to save cached hulls %s: %s',filename,e)
+    
+    def _EvictCachedGeometryHulls(self,maxcached=None):
+        """removes the least recently used cached geometry hulls so that at most maxcached remain. If maxcached is None, uses maxcachedgeometries"""
+        if maxcached is None:
+            maxcached = self.maxcachedgeometries
+        cachedir = os.path.split(self._GetCachedGeometryHullsFilename('',False))[0]
+        try:
+            filenames = [os.path.join(cachedir,filename) for filename in os.listdir(cachedir) if filename.endswith('.pp')]
+        except OSError:
+            return
+        if len(filenames) <= maxcached:
+            return
+        times = []
+        for filename in filenames:
+            try:
+                times.append((os.path.getmtime(filename),filename))
+            except OSError:
+                pass # removed by another process
+        times.sort()
+        for mtime,filename in times[0:max(0,len(times)-maxcached)]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+    
     def ComputePaddedConvexDecompositionFromTriMesh(self, trimesh, padding=0.0):
-        if len(trimesh.indices) > 0:
-            orghulls = convexdecompositionpy.computeConvexDecomposition(trimesh.vertices,trimesh.indices,**self.convexparams)
+        return self.ComputePaddedConvexDecomposition(trimesh.vertices, trimesh.indices, padding, self.convexparams)
+    
+    @staticmethod
+    def ComputePaddedConvexDecomposition(vertices, indices, padding=0.0, convexparams=None):
+        if len(indices) > 0:
+            orghulls = convexdecompositionpy.computeConvexDecomposition(vertices,indices,**(convexparams or {}))
         else:
             orghulls = []
         if len(orghulls) > 0:
             # add in the padding
             if padding != 0:
-                orghulls = [self.PadMesh(hull[0],hull[1],padding) for hull in orghulls]
+                orghulls = [ConvexDecompositionModel.PadMesh(hull[0],hull[1],padding) for hull in orghulls]
         return orghulls
     
     def ComputePaddedConvexHullFromTriMesh(self, trimesh, padding=0.0):
@@ -341,6 +617,74 @@ class ConvexDecompositionModel(DatabaseGenerator):
             numtriangles = int(res[offset]); offset += 1
             return self.PadMesh(trimesh.vertices,reshape(array(res[offset:(offset+3*numtriangles)],int32),(numtriangles,3)), padding)
         
+    @staticmethod
+    def ComputeDuplicateVerticesMap(vertices, rtol=1e-05, atol=1e-08, dtype=int):
+        """returns an array mapping every vertex to the index of the vertex it is merged with.
+
+        Gives the same result as going through the vertices in order and merging all the following vertices that are isclose to a not yet merged vertex. Close vertices are at most one tolerance apart on each axis, so the vertices are hashed into cells of that size and only the vertices of the 27 neighboring cells are compared. Runs in O(V log V) unless many vertices fall in the same cell.
+        """
+        N = len(vertices)
+        vertices_map = arange(N, dtype=dtype)
+        if N <= 1:
+            return vertices_map
+        vertices = numpy.asarray(vertices, dtype=float64)
+        mins = numpy.min(vertices, axis=0)
+        extents = numpy.max(vertices, axis=0) - mins
+        # any cell larger than the tolerance works, make it a bit larger for round-off and so that the cell coordinates fit into one int64 key
+        cellsize = numpy.max([1.01*(atol + rtol*numpy.max(abs(vertices))), numpy.max(extents)/2.0**20])
+        if cellsize <= 0:
+            cellsize = 1.0
+        # pad by one cell so that the neighbors of the border cells do not wrap around
+        cells = numpy.floor((vertices - mins)/cellsize).astype(numpy.int64) + 1
+        dims = numpy.max(cells, axis=0) + 2
+        keys = (cells[:,0]*dims[1] + cells[:,1])*dims[2] + cells[:,2]
+        order = numpy.argsort(keys, kind='mergesort')
+        sortedkeys = keys[order]
+        newcell = r_[True, sortedkeys[1:] != sortedkeys[:-1]]
+        cellkeys = sortedkeys[newcell]
+        cellstarts = flatnonzero(newcell)
+        cellcounts = r_[cellstarts[1:], N] - cellstarts
+        vertexcells = empty(N, dtype=numpy.int64)
+        vertexcells[order] = numpy.cumsum(newcell) - 1
+        pairs0 = []
+        pairs1 = []
+        for dx in (-1,0,1):
+            for dy in (-1,0,1):
+                for dz in (-1,0,1):
+                    # look up the neighbor of every occupied cell, the keys are sorted so this is fast
+                    neighborkeys = cellkeys + (dx*dims[1] + dy)*dims[2] + dz
+                    neighbors = numpy.minimum(numpy.searchsorted(cellkeys, neighborkeys), len(cellkeys)-1)
+                    found = cellkeys[neighbors] == neighborkeys
+                    counts = where(found, cellcounts[neighbors], 0)[vertexcells]
+                    if numpy.sum(counts) == 0:
+                        continue
+                    lo = cellstarts[neighbors][vertexcells]
+                    first = repeat(arange(N), counts)
+                    # position of every candidate inside its neighbor cell range
+                    offsets = arange(len(first)) - repeat(numpy.cumsum(counts) - counts, counts)
+                    second = order[repeat(lo, counts) + offsets]
+                    valid = first < second
+                    pairs0.append(first[valid])
+                    pairs1.append(second[valid])
+        pairs0 = numpy.concatenate(pairs0)
+        pairs1 = numpy.concatenate(pairs1)
+        close = isclose(vertices[pairs0], vertices[pairs1], rtol, atol).all(axis=1)
+        pairs0 = pairs0[close]
+        pairs1 = pairs1[close]
+        if len(pairs0) == 0:
+            return vertices_map
+        pairorder = lexsort((pairs1, pairs0))
+        pairs0 = pairs0[pairorder]
+        pairs1 = pairs1[pairorder]
+        # a vertex can only be merged by a lower index vertex, so going through the pairs by their first index reproduces the sequential merge
+        starts = flatnonzero(r_[True, pairs0[1:] != pairs0[:-1]])
+        ends = r_[starts[1:], len(pairs0)]
+        for start, end in zip(starts, ends):
+            a = pairs0[start]
+            if vertices_map[a] == a:
+                vertices_map[pairs1[start:end]] = a
+        return vertices_map
+    
     @staticmethod
     def PadMesh(vertices, indices, padding, mergeDuplicated=True, rtol=1e-05, atol=1e-08, setNormalsAwayFromCenter=False):
         """pads a mesh by increasing towards the normal
@@ -352,13 +696,9 @@ class ConvexDecompositionModel(DatabaseGenerator):
         M = mean(vertices,0)
         
         # Merge duplicated vertices (+- epsilon)
-        indices_raveled = indices.ravel()
-        vertices_map = arange(len(vertices), dtype=indices.dtype)
-        for a in range(len(vertices) - 1):
-            if vertices_map[a] == a:
-                combine = a + 1 + flatnonzero(isclose(vertices[a], vertices[a+1:], rtol, atol).all(axis=1))
-                vertices_map[combine] = a
-        indices = vertices_map[indices.ravel()].reshape(-1, 3)
+        if mergeDuplicated:
+            vertices_map = ConvexDecompositionModel.ComputeDuplicateVerticesMap(vertices, rtol, atol, indices.dtype)
+            indices = vertices_map[indices.ravel()].reshape(-1, 3)
         
         vertices_0 = vertices[indices[:, 0]]
         facenormals = cross(vertices[indices[:, 1]] - vertices_0, vertices[indices[:, 2]] - vertices_0)
@@ -368,7 +708,6 @@ class ConvexDecompositionModel(DatabaseGenerator):
         facenormals[degenerate] = 0.0
         
         # make sure normals are facing outward
-        newindices = arange(3 * len(facenormals), dtype=int32).reshape(-1, 3)
         originaledges = empty((3 * len(facenormals), 5), dtype=int32)
         
         if setNormalsAwayFromCenter:
@@ -387,32 +726,38 @@ class ConvexDecompositionModel(DatabaseGenerator):
             originaledges_n[:, 3] = offsets + j1#where(swap, j1, j0)
             originaledges_n[:, 4] = swap
         
-        # find the connecting edges across the new faces
-        offset = 0
-        verticesofinterest = {}
-        for i,edge in enumerate(originaledges):
-            inds = flatnonzero(logical_and(edge[0]==originaledges[i+1:,0],edge[1]==originaledges[i+1:,1]))
-            if len(inds) > 0:
-                # add 2 triangles for the edge, and 2 for each vertex
-                cedge = originaledges[i+1+inds[0]]
-                if not edge[0] in verticesofinterest:
-                    verticesofinterest[edge[0]] = len(newvertices)+offset
-                    offset += 1
-                if not edge[1] in verticesofinterest:
-                    verticesofinterest[edge[1]] = len(newvertices)+offset
-                    offset += 1
-                newindices = r_[newindices,[[edge[2],cedge[3],edge[3]],[edge[3],cedge[3],cedge[2]]]]
-                if edge[4] == 0:
-                    newindices = r_[newindices, [[edge[3],cedge[2],verticesofinterest[edge[0]]],[cedge[3],edge[2],verticesofinterest[edge[1]]]]]
-                else:
-                    newindices = r_[newindices, [[cedge[3],edge[2],verticesofinterest[edge[0]]],[edge[3],cedge[2],verticesofinterest[edge[1]]]]]
-        if offset > 0:
-            newvertices = r_[newvertices,zeros((offset,3))]
+        # find the connecting edges across the new faces: sort the edges by their vertices, every edge is paired with the next edge sharing the same vertices
+        edgeorder = lexsort((arange(len(originaledges)), originaledges[:,1], originaledges[:,0]))
+        sortededges = originaledges[edgeorder]
+        samenext = flatnonzero(logical_and(sortededges[1:,0]==sortededges[:-1,0], sortededges[1:,1]==sortededges[:-1,1]))
+        # process the pairs in the order of their first edge
+        pairorder = argsort(edgeorder[samenext], kind='mergesort')
+        edges = originaledges[edgeorder[samenext[pairorder]]]
+        cedges = originaledges[edgeorder[samenext[pairorder]+1]]
+        
+        # the vertices of the shared edges get a new vertex, numbered by first appearance
+        edgevertices = edges[:,0:2].ravel()
+        uniquevertices, firstindices = unique(edgevertices, return_index=True)
+        verticesofinterest = uniquevertices[argsort(firstindices)]
+        newvertexindices = zeros(len(vertices), dtype=int32)
+        newvertexindices[verticesofinterest] = len(newvertices) + arange(len(verticesofinterest))
+        
+        # add 2 triangles for the edge, and 2 for each vertex
+        newtriangles = empty((len(edges), 4, 3), dtype=int32)
+        newtriangles[:,0] = c_[edges[:,2], cedges[:,3], edges[:,3]]
+        newtriangles[:,1] = c_[edges[:,3], cedges[:,3], cedges[:,2]]
+        swapped = (edges[:,4] != 0)[:,newaxis]
+        newtriangles[:,2] = where(swapped, c_[cedges[:,3], edges[:,2], newvertexindices[edges[:,0]]], c_[edges[:,3], cedges[:,2], newvertexindices[edges[:,0]]])
+        newtriangles[:,3] = where(swapped, c_[edges[:,3], cedges[:,2], newvertexindices[edges[:,1]]], c_[cedges[:,3], edges[:,2], newvertexindices[edges[:,1]]])
+        newindices = r_[arange(3 * len(facenormals), dtype=int32).reshape(-1, 3), newtriangles.reshape(-1, 3)]
+        
         # for every vertex, add a point representing the mean of surrounding extruded vertices
-        for originalvertex, newvertex in verticesofinterest.iteritems():
-            vertexindices = flatnonzero(indices==originalvertex)
-            assert(len(vertexindices) > 0)
-            newvertices[newvertex,:] = mean(newvertices[vertexindices],0)
+        if len(verticesofinterest) > 0:
+            flatindices = indices.ravel()
+            counts = bincount(flatindices, minlength=len(vertices))[verticesofinterest]
+            assert(all(counts > 0))
+            meanvertices = array([bincount(flatindices, weights=newvertices[:,k], minlength=len(vertices))[verticesofinterest] for k in range(3)]).T/counts[:,newaxis]
+            newvertices = r_[newvertices, meanvertices]
         assert(not any(isnan(newvertices)))
         
         # make sure all faces are facing outward
@@ -420,9 +765,7 @@ class ConvexDecompositionModel(DatabaseGenerator):
             newvertices_0 = newvertices[newindices[:, 0]]
             flip = inner1d(cross(newvertices[newindices[:, 1]] - newvertices_0,
                                  newvertices[newindices[:, 2]] - newvertices_0), newvertices_0 - M) < 0
-            for n, inds in enumerate(newindices):
-                if flip[n]:
-                    inds[1],inds[2] = inds[2],inds[1]
+            newindices[flip,1:3] = newindices[flip,2:0:-1]
         
         return newvertices,newindices
     
@@ -445,57 +788,60 @@ class ConvexDecompositionModel(DatabaseGenerator):
         planes = r_[planes[flatnonzero(meandist<-1e-7)],-planes[flatnonzero(meandist>1e-7)]]
         if len(planes) == 0:
             return planes
-        normalizedplanes = planes/transpose(tile(sqrt(sum(planes**2,1)),(4,1)))
-        # prune similar planes
+        normalizedplanes = planes/sqrt(sum(planes**2,1))[:,newaxis]
+        # prune similar planes: a plane is removed if any plane before it has dot(normalizedplanes[i],normalizedplanes[j]) >= thresh
         uniqueplanes = ones(len(planes),bool)
-        for i in range(len(normalizedplanes)-1):
-            uniqueplanes[i+1:] &= dot(normalizedplanes[i+1:,:],normalizedplanes[i])<thresh
+        i,j = ConvexDecompositionModel._FindSimilarUnitVectors(normalizedplanes,thresh)
+        uniqueplanes[j] = False
         return planes[uniqueplanes]
     
+    @staticmethod
+    def _FindSimilarUnitVectors(vectors,thresh,blocksize=1024):
+        """returns the index arrays i,j (i<j) of all pairs of unit vectors with dot(vectors[i],vectors[j]) >= thresh.
+
+        For unit vectors this is a euclidean distance of at most sqrt(2-2*thresh), so the candidates are found with a KD-tree in near-linear time if scipy is present, otherwise with blocks of dot products. The candidates are then checked with the exact dot product.
+        """
+        try:
+            from scipy.spatial import cKDTree
+            radius = sqrt(max(0.0,2.0-2.0*thresh))*(1+1e-7)+1e-12
+            pairs = cKDTree(vectors).query_pairs(radius)
+            if len(pairs) == 0:
+                return zeros(0,int),zeros(0,int)
+            pairs = array(list(pairs),int)
+            pairs.sort(axis=1)
+            i,j = pairs[:,0],pairs[:,1]
+            similar = inner1d(vectors[i],vectors[j]) >= thresh
+            return i[similar],j[similar]
+        except ImportError:
+            alli = []
+            allj = []
+            for start in range(0,len(vectors),blocksize):
+                dots = dot(vectors[start:(start+blocksize)],vectors[start:].T)
+                i,j = nonzero(dots >= thresh)
+                i += start
+                j += start
+                upper = i < j
+                alli.append(i[upper])
+                allj.append(j[upper])
+            return numpy.concatenate(alli),numpy.concatenate(allj)
+    
+    def GetPackedConvexHulls(self):
+        """returns a :class:`PackedConvexHulls` of the current decomposition for repeated point containment queries.
+
+        The structure is built once per decomposition and reused; update its pose with SetLinkTransformations.
+        """
+        if self._packedhulls is None or self._packedhulls[0] is not self.linkgeometry:
+            self._packedhulls = (self.linkgeometry,PackedConvexHulls(self))
+        return self._packedhulls[1]
+    
     def testPointsInside(self,points):
         """tests if a point is inside the convex mesh of the robot.
 
-        Returns an array the same length as points that specifies whether the point is in or not. This method is not meant to be optimized (use C++ for that).
+        Returns an array the same length as points that specifies whether the point is in or not. Uses the current robot pose, for repeated queries use :meth:`GetPackedConvexHulls` directly.
         """
         with self.env:
-            inside = zeros(len(points),bool)
-            leftinds = arange(len(points))
-            leftpoints = points[:]
-            for ilink,link in enumerate(self.robot.GetLinks()):
-                if len(leftinds) == 0:
-                    break
-                for ig,geom in enumerate(link.GetGeometries()):
-                    T = dot(link.GetTransform(),geom.GetTransform())
-                    localpoints = transformInversePoints(T,leftpoints)
-                    cdhulls = [cdhull for ig2,cdhull in self.linkgeometry[ilink] if ig2==ig]
-                    if len(cdhulls) > 0:
-                        for ihull,hull in enumerate(cdhulls[0]):
-                            insideinds = numpy.all(dot(localpoints,transpose(hull[2][:,0:3]))+tile(hull[2][:,3],(len(localpoints),1))<=0,1)
-                            inside[leftinds[flatnonzero(insideinds)]] = True
-                            outsideinds = flatnonzero(insideinds==0)
-                            if len(outsideinds) > 0:
-                                leftpoints = leftpoints[outsideinds]
-                                leftinds = leftinds[outsideinds]
-                                localpoints = localpoints[outsideinds]
-                            if len(leftinds) == 0:
-                                break
-                        continue
-                    elif geom.GetType() == KinBody.Link.GeomType.Box:
-                        insideinds = numpy.all(numpy.less_equal(abs(localpoints), geom.GetBoxExtents()) ,1)
-                    elif geom.GetType() == KinBody.Link.GeomType.Sphere:
-                        insideinds = numpy.less_equal(sum(localpoints**2,1), geom.GetSphereRadius()**2)
-                    elif geom.GetType() == KinBody.Link.GeomType.Cylinder:
-                        insideinds = numpy.less_equal(abs(localpoints[:,1]), 0.5*geom.GetCylinderHeight()) and numpy.less_equal(localpoint[:,0]**2+localpoint[:2]**2, geom.GetCylinderRadius()**2)
-                    else:
-                        continue
-                    inside[leftinds[flatnonzero(insideinds)]] = True
-                    outsideinds = flatnonzero(insideinds==0)
-                    if len(outsideinds) > 0:
-                        leftpoints = leftpoints[outsideinds]
-                        leftinds = leftinds[outsideinds]
-                    if len(leftinds) == 0:
-                        break
-        return inside
+            packedhulls = self.GetPackedConvexHulls()
+            return packedhulls.testPointsInside(points,self.robot.GetLinkTransformations())
 
     def GetGeometryInfosFromLink(self,ilink,preservetransform=False,color=None):
         """gets a list of geometries for the link
@@ -650,6 +996,8 @@ class ConvexDecompositionModel(DatabaseGenerator):
                           help='Whether or not to perform island generation at each split.  Currently disabled due to bug in RemoveTjunctions (default=%default).')
         parser.add_option('--convexHullLinks',action='store',type='str',dest='convexHullLinks',default='',
                           help='comma separated list of link names to compute convex hull for instead')
+        parser.add_option('--numprocesses',action='store',type='int',dest='numprocesses',default=None,
+                          help='number of processes decomposing the link geometries in parallel, by default uses the number of cpus')
         return parser
     @staticmethod
     def RunFromParser(Model=None,parser=None,args=None,**kwargs):
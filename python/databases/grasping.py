@@ -170,7 +170,7 @@ import numpy
 from .. import PlanningError
 from ..openravepy_ext import transformPoints
 from ..openravepy_int import RaveCreateModule, RaveCreateTrajectory, IkParameterization, IkParameterizationType, IkFilterOptions, RaveFindDatabaseFile, RaveDestroy, Environment, Robot, KinBody, DOFAffine, CollisionReport, RaveCreateCollisionChecker, quatRotateDirection, rotationMatrixFromQuat, Ray, poseFromMatrix
-from . import DatabaseGenerator
+from . import DatabaseGenerator, inversekinematics
 from ..misc import SpaceSamplerExtra
 from .. import interfaces
 from optparse import OptionParser
@@ -242,6 +242,7 @@ class GraspingModel(DatabaseGenerator):
         self.disableallbodies=True
         self.translationstepmult = None
         self.finestep = None
+        self.ikcache = None # if set to an inversekinematics.IkSolutionCache of self.manip, used for the ik checks of the valid grasps
         # only the indices used by the TaskManipulation plugin should start with an 'i'
         graspdof = {'igraspdir':3,'igrasppos':3,'igrasproll':1,'igraspstandoff':1,'igrasppreshape':len(self.manip.GetGripperIndices()),'igrasptrans':12,'imanipulatordirection':3,'forceclosure':1,'grasptrans_nocol':12,'performance':1,'vintersectplane':4, 'igraspfinalfingers':len(self.manip.GetGripperIndices()), 'ichuckingdirection':len(self.manip.GetGripperIndices()), 'graspikparam_nocol':8, 'approachdirectionmanip':3, 'igrasptranslationoffset':3 }
         if graspparametersdof is not None:
@@ -257,6 +258,8 @@ class GraspingModel(DatabaseGenerator):
         clone.basemanip = self.basemanip.clone(envother)
         clone.grasper = self.grasper.clone(envother)
         clone.target = clone.env.GetKinBody(self.target.GetName())
+        if self.ikcache is not None:
+            clone.ikcache = inversekinematics.IkSolutionCache(clone.manip,maxsize=self.ikcache.maxsize,resolution=self.ikcache.resolution)
         return clone
     def has(self):
         return len(self.grasps) > 0 and len(self.graspindices) > 0 and self.grasper is not None
@@ -504,9 +507,7 @@ class GraspingModel(DatabaseGenerator):
                 # find a non-colliding transform
                 self.setPreshape(grasp)
                 direction = self.getGlobalApproachDir(grasp)
-                Tgrasp_nocol = array(Tgrasp)
-                while self.manip.CheckEndEffectorCollision(Tgrasp_nocol):
-                    Tgrasp_nocol[0:3,3] -= direction*self.collision_escape_offset
+                Tgrasp_nocol = self._computeCollisionFreeGraspTransform(Tgrasp,direction)
                 Tlocalgrasp_nocol = dot(linalg.inv(self.target.GetTransform()),Tgrasp_nocol)
                 self.robot.SetDOFValues(finalconfig[0])
                 if self.env.GetViewer() is not None:
@@ -540,16 +541,33 @@ class GraspingModel(DatabaseGenerator):
         
         return producer, consumer, gatherer, totalgrasps
 
-    def _generateThreaded(self,preshapes=None,standoffs=None,rolls=None,approachrays=None, graspingnoise=None,forceclosure=True,forceclosurethreshold=1e-9,checkgraspfn=None,manipulatordirections=None,translationstepmult=None,finestep=None,friction=None,avoidlinks=None,plannername=None):
-        """Generates a grasp set by searching space and evaluating contact points.
+    def _generateThreaded(self,*args,**kwargs):
+        """Generates a grasp set using the threaded grasper, see :meth:`iterGenerateThreaded` for the parameters.
 
+        The whole grasp space is sent to the grasper in one call, paging would resend the rays and restart the grasper threads for every page.
+        """
+        kwargs['pagesize'] = 0
+        for grasp in self.iterGenerateThreaded(*args,**kwargs):
+            self.grasps.append(grasp)
+        self.grasps = array(self.grasps)
+        if len(self.grasps) > 0:
+            order = argsort(self.grasps[:,self.graspindices.get('performance')[0]])
+            self.grasps = self.grasps[order]
+
+    def iterGenerateThreaded(self,preshapes=None,standoffs=None,rolls=None,approachrays=None, graspingnoise=None,forceclosure=True,forceclosurethreshold=1e-9,checkgraspfn=None,manipulatordirections=None,translationstepmult=None,finestep=None,friction=None,avoidlinks=None,plannername=None,boxdelta=None,spheredelta=None,normalanglerange=None,pagesize=None):
+        """Searches the grasp space with the threaded grasper and yields each valid grasp as soon as it has been processed.
+
+        The grasper results are fetched in pages with :meth:`.Grasper.iterGraspThreadedPages`, and every page is post-processed before the next one is requested, so the first grasps are available long before the whole space is tested. The environment is only locked and the robot state only modified while a page is fetched and converted, the grasps of the page are yielded after the robot state is restored. The grasps are yielded in the order they are found, they are not stored in self.grasps.
         All grasp parameters have to be in the bodies's coordinate system (ie: approachrays).
         :param graspingnoise: A tuple of two values (randomoffset, number_of_tries)
-        :param checkgraspfn: If set, then will be used to validate the grasp. If its evaluation returns false, then grasp will not be added to set. Called by checkgraspfn(contacts,finalconfig,grasp,info)
+        :param checkgraspfn: If set, then will be used to validate the grasp. If its evaluation returns false, then grasp will not be yielded. Called by checkgraspfn(contacts,finalconfig,grasp,info)
+        :param pagesize: maximum number of grasper results to request at a time. If None, will use 4*numthreads. If 0, the whole grasp space is processed in one call before yielding, which is the fastest when all grasps are needed.
         """
         print 'Generating Grasp Set for %s:%s:%s'%(self.robot.GetName(),self.manip.GetName(),self.target.GetName())
         translate = True
         if approachrays is None:
+            if normalanglerange is None:
+                normalanglerange = 0
             if boxdelta is not None:
                 approachrays = self.computeBoxApproachRays(delta=boxdelta,normalanglerange=normalanglerange)
             elif spheredelta is not None:
@@ -581,60 +599,66 @@ class GraspingModel(DatabaseGenerator):
         self.finestep = finestep
         if isinstance(graspingnoise,float):
             graspingnoise = (graspingnoise,10)
-        with self.robot: # lock the environment and save the robot state
-            Ttarget = self.target.GetTransform()
-            Trobotorig = self.robot.GetTransform()
-            chuckingdirection = self.manip.GetChuckingDirection()
-            self.robot.SetActiveManipulator(self.manip)
-            self.robot.SetTransform(eye(4)) # have to reset transform in order to remove randomness
-            self.robot.SetActiveDOFs(self.manip.GetGripperIndices(),DOFAffine.X|DOFAffine.Y|DOFAffine.Z if translate else 0)
-            approachrays[:,3:6] = -approachrays[:,3:6]
-            self.nextid, self.resultgrasps = self.grasper.GraspThreaded(approachrays=approachrays, rolls=rolls, standoffs=standoffs, preshapes=preshapes, manipulatordirections=manipulatordirections, target=self.target, graspingnoise=graspingnoise, forceclosurethreshold=forceclosurethreshold,numthreads=numthreads,translationstepmult=self.translationstepmult,finestep=self.finestep)
-            print 'graspthreaded done, processing grasps %d'%len(self.resultgrasps)
-
-            for resultgrasp in self.resultgrasps:
-                grasp = zeros(self.totaldof)
-                grasp[self.graspindices.get('igrasppos')] = resultgrasp[0]
-                grasp[self.graspindices.get('igraspdir')] = resultgrasp[1]
-                grasp[self.graspindices.get('igrasproll')] = resultgrasp[2]
-                grasp[self.graspindices.get('igraspstandoff')] = resultgrasp[3]
-                grasp[self.graspindices.get('imanipulatordirection')] = resultgrasp[4]
-                mindist = resultgrasp[5]
-                volume = resultgrasp[6]
-                grasp[self.graspindices.get('igrasppreshape')] = resultgrasp[7]
-                grasp[self.graspindices.get('ichuckingdirection')] = chuckingdirection
-                Tfinal = resultgrasp[8]
-                finalshape = resultgrasp[9]
-                contacts = resultgrasp[10]
-
-                with self.robot:
-                    Tlocalgrasp = eye(4)
-                    self.robot.SetTransform(Tfinal)
-                    Tgrasp = self.manip.GetEndEffectorTransform()
-                    Tlocalgrasp = dot(linalg.inv(self.target.GetTransform()),Tgrasp)
-                    # find a non-colliding transform
-                    direction = self.getGlobalApproachDir(grasp)
-                    Tgrasp_nocol = array(Tgrasp)
-                    while self.manip.CheckEndEffectorCollision(Tgrasp_nocol):
-                        Tgrasp_nocol[0:3,3] -= direction*self.collision_escape_offset
-                    Tlocalgrasp_nocol = dot(linalg.inv(self.target.GetTransform()),Tgrasp_nocol)
-                    self.robot.SetDOFValues(finalshape)
-
-                    grasp[self.graspindices.get('igrasptrans')] = reshape(transpose(Tlocalgrasp[0:3,0:4]),12)
-                    grasp[self.graspindices.get('grasptrans_nocol')] = reshape(transpose(Tlocalgrasp_nocol[0:3,0:4]),12)
-                    grasp[self.graspindices.get('graspikparam_nocol')] = r_[int(IkParameterizationType.Transform6D), poseFromMatrix(Tlocalgrasp_nocol)]
-                    grasp[self.graspindices.get('igraspfinalfingers')] = finalshape[self.manip.GetGripperIndices()]
-                    grasp[self.graspindices.get('forceclosure')] = mindist if mindist is not None else 0
-                    if not forceclosurethreshold or mindist >= forceclosurethreshold:
-                        grasp[self.graspindices.get('performance')] = self._ComputeGraspPerformance(grasp)
-                        if checkgraspfn is None or checkgraspfn(contacts,[Tfinal,finalshape],grasp,{'mindist':mindist,'volume':volume}):
-                            self.grasps.append(grasp)
-
-            self.grasps = array(self.grasps)
-            if len(self.grasps) > 0:
-                order = argsort(self.grasps[:,self.graspindices.get('performance')[0]])
-                self.grasps = self.grasps[order]
-                
+        approachrays[:,3:6] = -approachrays[:,3:6]
+        pages = self.grasper.iterGraspThreadedPages(approachrays=approachrays, rolls=rolls, standoffs=standoffs, preshapes=preshapes, manipulatordirections=manipulatordirections, pagesize=pagesize, target=self.target, graspingnoise=graspingnoise, forceclosurethreshold=forceclosurethreshold,numthreads=numthreads,translationstepmult=self.translationstepmult,finestep=self.finestep)
+        numresults = 0
+        while True:
+            with self.robot: # lock the environment and save the robot state only while processing the page
+                chuckingdirection = self.manip.GetChuckingDirection()
+                self.robot.SetActiveManipulator(self.manip)
+                self.robot.SetTransform(eye(4)) # have to reset transform in order to remove randomness
+                self.robot.SetActiveDOFs(self.manip.GetGripperIndices(),DOFAffine.X|DOFAffine.Y|DOFAffine.Z if translate else 0)
+                # the page is requested from the grasper inside the lock
+                try:
+                    nextid, resultgrasps = pages.next()
+                except StopIteration:
+                    break
+                numresults += len(resultgrasps)
+                grasps = [self._processGraspThreadedResult(resultgrasp,chuckingdirection,forceclosurethreshold,checkgraspfn) for resultgrasp in resultgrasps]
+            for grasp in grasps:
+                if grasp is not None:
+                    yield grasp
+        print 'graspthreaded done, processed grasps %d'%numresults
+
+    def _processGraspThreadedResult(self,resultgrasp,chuckingdirection,forceclosurethreshold,checkgraspfn):
+        """converts one result of :meth:`.Grasper.GraspThreaded` into a grasp. Returns None if the grasp is not valid.
+        """
+        grasp = zeros(self.totaldof)
+        grasp[self.graspindices.get('igrasppos')] = resultgrasp[0]
+        grasp[self.graspindices.get('igraspdir')] = resultgrasp[1]
+        grasp[self.graspindices.get('igrasproll')] = resultgrasp[2]
+        grasp[self.graspindices.get('igraspstandoff')] = resultgrasp[3]
+        grasp[self.graspindices.get('imanipulatordirection')] = resultgrasp[4]
+        mindist = resultgrasp[5]
+        volume = resultgrasp[6]
+        grasp[self.graspindices.get('igrasppreshape')] = resultgrasp[7]
+        grasp[self.graspindices.get('ichuckingdirection')] = chuckingdirection
+        Tfinal = resultgrasp[8]
+        finalshape = resultgrasp[9]
+        contacts = resultgrasp[10]
+
+        with self.robot:
+            Tlocalgrasp = eye(4)
+            self.robot.SetTransform(Tfinal)
+            Tgrasp = self.manip.GetEndEffectorTransform()
+            Tlocalgrasp = dot(linalg.inv(self.target.GetTransform()),Tgrasp)
+            # find a non-colliding transform
+            direction = self.getGlobalApproachDir(grasp)
+            Tgrasp_nocol = self._computeCollisionFreeGraspTransform(Tgrasp,direction)
+            Tlocalgrasp_nocol = dot(linalg.inv(self.target.GetTransform()),Tgrasp_nocol)
+            self.robot.SetDOFValues(finalshape)
+
+            grasp[self.graspindices.get('igrasptrans')] = reshape(transpose(Tlocalgrasp[0:3,0:4]),12)
+            grasp[self.graspindices.get('grasptrans_nocol')] = reshape(transpose(Tlocalgrasp_nocol[0:3,0:4]),12)
+            grasp[self.graspindices.get('graspikparam_nocol')] = r_[int(IkParameterizationType.Transform6D), poseFromMatrix(Tlocalgrasp_nocol)]
+            grasp[self.graspindices.get('igraspfinalfingers')] = finalshape[self.manip.GetGripperIndices()]
+            grasp[self.graspindices.get('forceclosure')] = mindist if mindist is not None else 0
+            if not forceclosurethreshold or mindist >= forceclosurethreshold:
+                grasp[self.graspindices.get('performance')] = self._ComputeGraspPerformance(grasp)
+                if checkgraspfn is None or checkgraspfn(contacts,[Tfinal,finalshape],grasp,{'mindist':mindist,'volume':volume}):
+                    return grasp
+        return None
+
     def show(self,delay=0.1,options=None,forceclosure=True,showcontacts=True):
         with self.robot.CreateRobotStateSaver():
             # disable all links not children to the manipulator
@@ -779,6 +803,46 @@ class GraspingModel(DatabaseGenerator):
     def getGlobalApproachDir(self,grasp):
         """returns the global approach direction"""
         return dot(self.target.GetTransform()[0:3,0:3],grasp[self.graspindices.get('igraspdir')])
+    def computeCollisionEscapeOffsets(self,Tgrasps,directions,maxdoublings=40):
+        """For each end effector transform, finds the smallest multiple of collision_escape_offset to move back along its approach direction so that the end effector is not in collision.
+
+        Searches by doubling the number of steps until a collision-free offset is found and then bisecting down to the first collision-free step, so a grasp that starts k steps deep costs O(log k) collision checks rather than k. Assuming the colliding offsets form one interval starting at 0, the result is the same step the linear search would stop at. Assumes environment is locked and the robot is in the state to be checked.
+        :param Tgrasps: N end effector transforms
+        :param directions: N global approach directions
+        :param maxdoublings: raises PlanningError if a grasp is still in collision after 2**maxdoublings steps
+        :return: N offsets (distances along -direction)
+        """
+        offsets = zeros(len(Tgrasps))
+        for i,Tgrasp in enumerate(Tgrasps):
+            Tgrasp_nocol = array(Tgrasp)
+            def checkcollision(numsteps):
+                Tgrasp_nocol[0:3,3] = Tgrasp[0:3,3] - directions[i]*(numsteps*self.collision_escape_offset)
+                return self.manip.CheckEndEffectorCollision(Tgrasp_nocol)
+            if not checkcollision(0):
+                continue
+            # lowstep is always in collision, highstep is the first collision-free candidate
+            lowstep = 0
+            highstep = 1
+            while checkcollision(highstep):
+                lowstep = highstep
+                highstep *= 2
+                if highstep > 2**maxdoublings:
+                    raise PlanningError('failed to escape end effector collision')
+            while highstep-lowstep > 1:
+                midstep = (lowstep+highstep)//2
+                if checkcollision(midstep):
+                    lowstep = midstep
+                else:
+                    highstep = midstep
+            offsets[i] = highstep*self.collision_escape_offset
+        return offsets
+
+    def _computeCollisionFreeGraspTransform(self,Tgrasp,direction):
+        """returns Tgrasp moved back along direction out of collision, see :meth:`computeCollisionEscapeOffsets`"""
+        Tgrasp_nocol = array(Tgrasp)
+        Tgrasp_nocol[0:3,3] -= direction*self.computeCollisionEscapeOffsets([Tgrasp],[direction])[0]
+        return Tgrasp_nocol
+
     def setPreshape(self,grasp):
         """sets the preshape on the robot, assumes environment is locked"""
         self.robot.SetDOFValues(grasp[self.graspindices['igrasppreshape']],self.manip.GetGripperIndices())
@@ -813,6 +877,10 @@ class GraspingModel(DatabaseGenerator):
         while execute and not self.robot.GetController().IsDone(): # busy wait
             time.sleep(0.01)
         return trajdata
+    def _FindIKSolution(self,param,filteroptions):
+        if self.ikcache is not None:
+            return self.ikcache.FindIKSolution(param,filteroptions)
+        return self.manip.FindIKSolution(param,filteroptions)
     def computeValidGrasps(self,startindex=0,checkcollision=True,checkik=True,checkgrasper=True,backupdist=0.0,returnnum=inf):
         """Returns the set of grasps that satisfy conditions like collision-free and reachable.
 
@@ -834,11 +902,11 @@ class GraspingModel(DatabaseGenerator):
                 Tglobalgrasp = self.getGlobalGraspTransform(grasp,collisionfree=True)
                 if checkik:
                     if self.manip.GetIkSolver().Supports(IkParameterization.Type.Transform6D):
-                        if self.manip.FindIKSolution(Tglobalgrasp,checkcollision) is None:
+                        if self._FindIKSolution(Tglobalgrasp,checkcollision) is None:
                             continue
                     elif self.manip.GetIkSolver().Supports(IkParameterization.Type.TranslationDirection5D):
                         ikparam = IkParameterization(Ray(Tglobalgrasp[0:3,3],dot(Tglobalgrasp[0:3,0:3],self.manip.GetLocalToolDirection())),IkParameterization.Type.TranslationDirection5D)
-                        solution = self.manip.FindIKSolution(ikparam,checkcollision)
+                        solution = self._FindIKSolution(ikparam,checkcollision)
                         if solution is None:
                             continue
                         with self.robot.CreateRobotStateSaver():
@@ -856,7 +924,7 @@ class GraspingModel(DatabaseGenerator):
                     Tnewgrasp = array(Tglobalgrasp)
                     Tnewgrasp[0:3,3] -= backupdist * self.getGlobalApproachDir(grasp)
                     if checkik:
-                        if self.manip.FindIKSolution(Tnewgrasp,checkcollision) is None:
+                        if self._FindIKSolution(Tnewgrasp,checkcollision) is None:
                             continue
                     elif checkcollision:
                         if self.manip.CheckEndEffectorCollision(Tnewgrasp):
@@ -888,7 +956,7 @@ class GraspingModel(DatabaseGenerator):
                 self.setPreshape(grasp)
                 Tglobalgrasp = self.getGlobalGraspTransform(grasp,collisionfree=True)
                 if checkik:
-                    if self.manip.FindIKSolution(Tglobalgrasp,checkcollision) is None:
+                    if self._FindIKSolution(Tglobalgrasp,checkcollision) is None:
                         continue
                 elif checkcollision:
                     if self.manip.CheckEndEffectorCollision(Tglobalgrasp):
@@ -897,7 +965,7 @@ class GraspingModel(DatabaseGenerator):
                     Tnewgrasp = array(Tglobalgrasp)
                     Tnewgrasp[0:3,3] -= backupdist * self.getGlobalApproachDir(grasp)
                     if checkik:
-                        if self.manip.FindIKSolution(Tnewgrasp,checkcollision) is None:
+                        if self._FindIKSolution(Tnewgrasp,checkcollision) is None:
                             continue
                     elif checkcollision:
                         if self.manip.CheckEndEffectorCollision(Tnewgrasp):
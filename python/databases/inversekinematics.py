@@ -153,6 +153,9 @@ from ..openravepy_int import RaveCreateModule, RaveCreateIkSolver, IkParameteriz
 from . import DatabaseGenerator
 from ..misc import relpath, TSP
 import time,platform,shutil,sys
+import ctypes
+import hashlib
+from collections import OrderedDict
 import os.path
 from os import getcwd, remove
 import distutils
@@ -187,6 +190,128 @@ class InverseKinematicsError(Exception):
     def __ne__(self, r):
         return self.parameter != r.parameter
     
+class IkSolutionCache(object):
+    """Caches the results of manip.FindIKSolution(s) for repeated queries of nearly identical poses.
+
+    Entries are keyed on the quantized ik parameterization, the quantized free values and the filter options. Every entry also stores a digest of the state the ik result depends on: the robot transform, joint values, link enable states, grabbed bodies and their grab transforms, and manipulator tool transform, and when environment collisions are checked, the name, enable state, transform and joint values of every other body. A lookup whose digest does not match the stored one is treated as a miss and the stale entry is dropped, so entries are invalidated automatically as soon as the robot or the collision state changes.
+
+    Changes that are not part of the digest, like geometry changes or registering custom ik filters, require calling :meth:`clear`.
+    """
+    def __init__(self,manip,maxsize=1000,resolution=1e-6):
+        """
+        :param maxsize: the maximum number of cached queries, the least recently used ones are evicted first
+        :param resolution: the quantization step of the ik parameterization and free values. Poses closer than this share a cache entry, so the returned solutions can be off by up to this amount.
+        """
+        self.manip = manip
+        self.maxsize = maxsize
+        self.resolution = resolution
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def GetStatistics(self):
+        """returns a dictionary of the hit/miss counters and the current size"""
+        return {'hits':self.hits, 'misses':self.misses, 'invalidations':self.invalidations, 'evictions':self.evictions, 'size':len(self._entries), 'maxsize':self.maxsize}
+
+    def _QuantizeValues(self,values):
+        return rint(ravel(values)/self.resolution).astype(int64).tostring()
+
+    def _GetQueryKey(self,param,freevalues,filteroptions,returnall):
+        if isinstance(param,IkParameterization):
+            posekey = (int(param.GetType()),self._QuantizeValues(param.GetValues()))
+        else:
+            posekey = (None,self._QuantizeValues(param))
+        freekey = self._QuantizeValues(freevalues) if freevalues is not None else None
+        return (posekey,freekey,int(filteroptions),returnall)
+
+    def _ComputeStateDigest(self,filteroptions,returnall):
+        """
+        :param returnall: if True, the digest is for FindIKSolutions. All the solutions do not depend on the current arm values, so only the other joint values are part of it. FindIKSolution returns the solution closest to the current arm values, so they are included.
+        """
+        robot = self.manip.GetRobot()
+        digest = hashlib.sha1()
+        digest.update(self.manip.GetName())
+        digest.update(array(self.manip.GetLocalToolTransform(),float64).tostring())
+        digest.update(array(robot.GetTransform(),float64).tostring())
+        if returnall:
+            dofindices = setdiff1d(arange(robot.GetDOF()),self.manip.GetArmIndices())
+            if len(dofindices) > 0:
+                digest.update(array(robot.GetDOFValues(dofindices),float64).tostring())
+        else:
+            digest.update(array(robot.GetDOFValues(),float64).tostring())
+        digest.update(array(robot.GetLinkEnableStates(),uint8).tostring())
+        for body in robot.GetGrabbed():
+            digest.update(body.GetName())
+            digest.update(array(body.GetLinkEnableStates(),uint8).tostring())
+        # the grabbed bodies move with the arm, so their transforms relative to the grabbing links are what the collisions depend on
+        for info in robot.GetGrabbedInfo():
+            digest.update('%s\0%s\0'%(info._grabbedname,info._robotlinkname))
+            digest.update(array(info._trelative,float64).tostring())
+        if filteroptions & IkFilterOptions.CheckEnvCollisions:
+            for body in robot.GetEnv().GetBodies():
+                if body == robot:
+                    continue
+                digest.update(body.GetName())
+                digest.update(array(body.GetLinkEnableStates(),uint8).tostring())
+                digest.update(array(body.GetTransform(),float64).tostring())
+                if body.GetDOF() > 0:
+                    digest.update(array(body.GetDOFValues(),float64).tostring())
+        return digest.digest()
+
+    def _Find(self,param,freevalues,filteroptions,returnall):
+        with self.manip.GetRobot().GetEnv():
+            key = self._GetQueryKey(param,freevalues,filteroptions,returnall)
+            statedigest = self._ComputeStateDigest(filteroptions,returnall)
+            entry = self._entries.pop(key,None)
+            if entry is not None:
+                if entry[0] == statedigest:
+                    self.hits += 1
+                    self._entries[key] = entry
+                    return entry[1]
+                self.invalidations += 1
+            self.misses += 1
+            if returnall:
+                if freevalues is not None:
+                    result = self.manip.FindIKSolutions(param,freevalues,filteroptions)
+                else:
+                    result = self.manip.FindIKSolutions(param,filteroptions)
+            else:
+                if freevalues is not None:
+                    result = self.manip.FindIKSolution(param,freevalues,filteroptions)
+                else:
+                    result = self.manip.FindIKSolution(param,filteroptions)
+            self._entries[key] = (statedigest,result)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return result
+
+    def FindIKSolution(self,param,filteroptions,freevalues=None):
+        """cached version of manip.FindIKSolution, returns None if no solution is found
+
+        :param param: the end effector transform or the IkParameterization
+        :param freevalues: if not None, the values of the free joints
+        """
+        solution = self._Find(param,freevalues,filteroptions,False)
+        return array(solution) if solution is not None else None
+
+    def FindIKSolutions(self,param,filteroptions,freevalues=None):
+        """cached version of manip.FindIKSolutions
+
+        :param param: the end effector transform or the IkParameterization
+        :param freevalues: if not None, the values of the free joints
+        """
+        solutions = self._Find(param,freevalues,filteroptions,True)
+        return array(solutions) if solutions is not None else None
+
 class InverseKinematicsModel(DatabaseGenerator):
     """Generates analytical inverse-kinematics solutions, compiles them into a shared object/DLL, and sets the robot's iksolver. Only generates the models for the robot's active manipulator. To generate IK models for each manipulator in the robot, mulitple InverseKinematicsModel classes have to be created.
     """
@@ -269,6 +394,8 @@ class InverseKinematicsModel(DatabaseGenerator):
         self.ikfeasibility = None # if not None, ik is NOT feasibile and contains the error message
         self.statistics = dict()
         self._checkpreemptfn=checkpreemptfn
+        self._ikfastlibrary = None # the compiled shared object loaded with ctypes for ComputeIkBatch
+        self.ikcache = None # IkSolutionCache used by FindIKSolution(s) when enabled
         
     def  __del__(self):
         if self.ikfastproblem is not None:
@@ -289,6 +416,9 @@ class InverseKinematicsModel(DatabaseGenerator):
             envother.Add(clone.ikfastproblem)
         if self.has():
             clone.setrobot(self.freeinc)
+        if self.ikcache is not None:
+            # cached solutions belong to the state of the other environment
+            clone.ikcache = IkSolutionCache(clone.manip,maxsize=self.ikcache.maxsize,resolution=self.ikcache.resolution)
         return clone
     
     def has(self):
@@ -358,14 +488,7 @@ class InverseKinematicsModel(DatabaseGenerator):
         """
         if freeinc is not None:
             self.freeinc=freeinc
-        if self.freeinc is not None:
-            try:
-                iksuffix = ' ' + ' '.join(str(f) for f in self.freeinc)
-            except TypeError:
-                # possibly just a float
-                iksuffix = ' %f'%self.freeinc
-        else:
-            iksuffix = ' ' + ' '.join(str(f) for f in self.getDefaultFreeIncrements(0.1, 0.01))
+        iksuffix = self._GetFreeIncrementsSuffix()
 #         if self.manip.GetIkSolver() is not None:
 #             self.iksolver = RaveCreateIkSolver(self.env,self.manip.GetIKSolverName()+iksuffix)
         if self.iksolver is None:
@@ -402,6 +525,107 @@ class InverseKinematicsModel(DatabaseGenerator):
         
         return self.has()
     
+    def _GetFreeIncrementsSuffix(self):
+        """returns the free increments to append to the ik solver name
+        """
+        if self.freeinc is not None:
+            try:
+                return ' ' + ' '.join(str(f) for f in self.freeinc)
+            except TypeError:
+                # possibly just a float
+                return ' %f'%self.freeinc
+        return ' ' + ' '.join(str(f) for f in self.getDefaultFreeIncrements(0.1, 0.01))
+
+    def EnableIkCache(self,maxsize=1000,resolution=1e-6):
+        """Starts caching the solutions returned by :meth:`FindIKSolution` and :meth:`FindIKSolutions`, see :class:`IkSolutionCache`.
+
+        The returned cache can also be set as the ikcache of the grasping and visibility models or passed to :class:`.misc.MultiManipIKSolver`.
+        """
+        self.ikcache = IkSolutionCache(self.manip,maxsize=maxsize,resolution=resolution)
+        return self.ikcache
+
+    def DisableIkCache(self):
+        self.ikcache = None
+
+    def FindIKSolution(self,param,filteroptions,freevalues=None):
+        """Same as manip.FindIKSolution, but uses the ik cache if it is enabled"""
+        if self.ikcache is not None:
+            return self.ikcache.FindIKSolution(param,filteroptions,freevalues)
+        if freevalues is not None:
+            return self.manip.FindIKSolution(param,freevalues,filteroptions)
+        return self.manip.FindIKSolution(param,filteroptions)
+
+    def FindIKSolutions(self,param,filteroptions,freevalues=None):
+        """Same as manip.FindIKSolutions, but uses the ik cache if it is enabled"""
+        if self.ikcache is not None:
+            return self.ikcache.FindIKSolutions(param,filteroptions,freevalues)
+        if freevalues is not None:
+            return self.manip.FindIKSolutions(param,freevalues,filteroptions)
+        return self.manip.FindIKSolutions(param,filteroptions)
+
+    def _GetIkFastLibrary(self):
+        """loads the compiled ikfast shared object with ctypes"""
+        if self._ikfastlibrary is None:
+            filename = self.getfilename(True)
+            if len(filename) == 0:
+                raise InverseKinematicsError(u'failed to find the compiled ik shared object')
+            library = ctypes.CDLL(filename)
+            if not hasattr(library,'ComputeIkBatch'):
+                raise InverseKinematicsError(u'%s was generated without ComputeIkBatch, regenerate it with the current ikfast'%filename)
+            if library.GetIkRealSize() != 8:
+                raise InverseKinematicsError(u'ComputeIkBatch only supports ik compiled with double precision')
+            library.ComputeIkBatch.restype = ctypes.c_int
+            library.ComputeIkBatch.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+            self._ikfastlibrary = library
+        return self._ikfastlibrary
+
+    def ComputeIkBatch(self,eetrans,eerot=None,freevalues=None,maxsolutions=None):
+        """Solves the IK of many poses with one call into the compiled ikfast shared object.
+
+        The poses are the raw values passed to the generated ComputeIk, so they are in the coordinate system of the manipulator base and do not include the manipulator's local tool transform. Unlike the ik solver interface, solutions are not checked for joint limits or collisions.
+        :param eetrans: Nx3 array of translations
+        :param eerot: Nx9 (or Nx3x3) array of rotations, or the other values of the IK type (see ikfast.h). Can be None if the IK type does not use them.
+        :param freevalues: the values of the free joints, either one array shared by all poses or one row per pose.
+        :param maxsolutions: the initial number of solutions to allocate, the buffer is grown if needed
+        :return: (solutions, offsets) where the solutions of pose i are solutions[offsets[i]:offsets[i+1]]
+        """
+        library = self._GetIkFastLibrary()
+        numjoints = library.GetNumJoints()
+        numfree = library.GetNumFreeParameters()
+        eetrans = ascontiguousarray(eetrans,float64).reshape(-1,3)
+        numposes = len(eetrans)
+        if eerot is None:
+            eerot = zeros((numposes,9))
+        else:
+            eerot = ascontiguousarray(eerot,float64).reshape(numposes,9)
+        freestride = 0
+        if numfree > 0:
+            if freevalues is None:
+                raise InverseKinematicsError(u'ik needs %d free values'%numfree)
+            freevalues = ascontiguousarray(freevalues,float64)
+            if freevalues.ndim > 1:
+                freevalues = freevalues.reshape(numposes,numfree)
+                freestride = numfree
+            elif len(freevalues) != numfree:
+                raise InverseKinematicsError(u'ik needs %d free values, got %d'%(numfree,len(freevalues)))
+        if maxsolutions is None:
+            maxsolutions = 8*numposes
+        solutions = zeros((max(maxsolutions,1),numjoints))
+        offsets = zeros(numposes+1,int32)
+        ipose = 0
+        numsolutions = 0
+        while ipose < numposes:
+            pfree = freevalues[ipose*freestride:].ctypes.data if numfree > 0 else None
+            numdone = library.ComputeIkBatch(numposes-ipose, eetrans[ipose:].ctypes.data, eerot[ipose:].ctypes.data, pfree, freestride, solutions[numsolutions:].ctypes.data, len(solutions)-numsolutions, offsets[ipose:].ctypes.data)
+            # offsets of the call start at 0
+            offsets[ipose:(ipose+numdone+1)] += numsolutions
+            numsolutions = offsets[ipose+numdone]
+            ipose += numdone
+            if ipose < numposes:
+                # out of space
+                solutions = r_[solutions,zeros((len(solutions),numjoints))]
+        return solutions[:numsolutions],offsets
+
     def getDefaultFreeIncrements(self,freeincrot, freeinctrans):
         """Returns a list of delta increments appropriate for each free index
         """
@@ -644,6 +868,8 @@ class InverseKinematicsModel(DatabaseGenerator):
         freeinc = None
         ikfastmaxcasedepth = 3
         filepermissions = None
+        polyrootsmethods = None
+        selectpolyroots = False
         if options is not None:
             forceikbuild=options.force
             precision=options.precision
@@ -655,6 +881,8 @@ class InverseKinematicsModel(DatabaseGenerator):
                 freeinc = [float64(s) for s in options.freeinc]
             ikfastmaxcasedepth = options.maxcasedepth
             filepermissions = options.filepermissions
+            polyrootsmethods = options.polyrootsmethod
+            selectpolyroots = options.selectpolyroots
         if self.manip.GetKinematicsStructureHash() == 'f17f58ee53cc9d185c2634e721af7cd3': # wam 4dof
             if iktype is None:
                 iktype=IkParameterizationType.Translation3D
@@ -683,7 +911,7 @@ class InverseKinematicsModel(DatabaseGenerator):
                 freejoints = [self.robot.GetJoints()[ind].GetName() for ind in self.manip.GetArmIndices()[3:]]
             if iktype==None:
                 iktype == IkParameterizationType.TranslationDirection5D
-        self.generate(iktype=iktype,freejoints=freejoints,precision=precision,forceikbuild=forceikbuild,outputlang=outputlang,ipython=ipython,ikfastmaxcasedepth=ikfastmaxcasedepth)
+        self.generate(iktype=iktype,freejoints=freejoints,precision=precision,forceikbuild=forceikbuild,outputlang=outputlang,ipython=ipython,ikfastmaxcasedepth=ikfastmaxcasedepth,polyrootsmethods=polyrootsmethods,selectpolyroots=selectpolyroots)
         self.save(filepermissions)
 
     def getIndicesFromJointNames(self,freejoints):
@@ -702,11 +930,13 @@ class InverseKinematicsModel(DatabaseGenerator):
         print 'getIndicesFromJointNames',freeindices,freejoints
         return freeindices
 
-    def generate(self,iktype=None, freejoints=None, freeinc=None, freeindices=None, precision=None, forceikbuild=True, outputlang=None, avoidPrismaticAsFree=False, ipython=False, ikfastoptions=0, ikfastmaxcasedepth=3):
+    def generate(self,iktype=None, freejoints=None, freeinc=None, freeindices=None, precision=None, forceikbuild=True, outputlang=None, avoidPrismaticAsFree=False, ipython=False, ikfastoptions=0, ikfastmaxcasedepth=3, polyrootsmethods=None, selectpolyroots=False):
         """
         :param ikfastoptions: see IKFastSolver.generateIkSolver
         :param ikfastmaxcasedepth: the max level of degenerate cases to solve for
         :param avoidPrismaticAsFree: if True for redundant manipulators, will attempt to avoid setting prismatic joints as free joints.
+        :param polyrootsmethods: the root finding method of the high-degree polynomials in the generated code, see ikfast_generator_cpp.CodeGenerator.PolyRootsMethods
+        :param selectpolyroots: if True, chooses the root finding method of every polynomial by compiling and timing each method, see selectPolyRootsMethods
         """
         self.iksolver = None
         if iktype is not None:
@@ -926,8 +1156,12 @@ class InverseKinematicsModel(DatabaseGenerator):
             try:
                 generationstart = time.time()
                 chaintree = solver.generateIkSolver(baselink=baselink,eelink=eelink,freeindices=self.freeindices,solvefn=solvefn)
+                solverusinglapack = solver.usinglapack
                 self.ikfeasibility = None
-                code = solver.writeIkSolver(chaintree,lang=outputlang)
+                if polyrootsmethods is not None:
+                    code = solver.writeIkSolver(chaintree,lang=outputlang,polyrootsmethods=polyrootsmethods)
+                else:
+                    code = solver.writeIkSolver(chaintree,lang=outputlang)
                 if len(code) == 0:
                     raise InverseKinematicsError(u'failed to generate ik solver for robot %s:%s'%(self.robot.GetName(),self.manip.GetName()))
                 
@@ -942,6 +1176,15 @@ class InverseKinematicsModel(DatabaseGenerator):
                     log.warn(e)
                     
                 log.info(u'successfully generated c++ ik in %fs, file=%s', self.statistics['generationtime'], sourcefilename)
+                if selectpolyroots and outputlang == 'cpp' and len(getattr(solver,'polyrootsnodes',[])) > 0:
+                    polyrootsmethods = self.selectPolyRootsMethods(solver,chaintree,sourcefilename,output_filename)
+                    # only the selected methods decide if lapack is needed, not the candidates
+                    solver.usinglapack = solverusinglapack
+                    code = solver.writeIkSolver(chaintree,lang=outputlang,polyrootsmethods=polyrootsmethods)
+                    self.statistics['usinglapack'] = solver.usinglapack
+                    with open(sourcefilename,'w') as f:
+                        f.write(code)
+                self.statistics['polyrootsmethods'] = getattr(solver,'polyrootsnodes',[])
             except self.ikfast.IKFastSolver.IKFeasibilityError, e:
                 self.ikfeasibility = str(e)
                 log.warn(e)
@@ -949,50 +1192,114 @@ class InverseKinematicsModel(DatabaseGenerator):
         if self.ikfeasibility is None:
             log.info('compiling ik file to %s',output_filename)
             if outputlang == 'cpp':
-                # compile the code and create the shared object
-                compiler,compile_flags = self.getcompiler()
-                try:
-                   output_dir = os.path.relpath('/',getcwd())
-                except AttributeError: # python 2.5 does not have os.path.relpath
-                   output_dir = relpath('/',getcwd())
-
-                platformsourcefilename = os.path.splitext(output_filename)[0]+'.cpp' # needed in order to prevent interference with machines with different architectures 
-                shutil.copyfile(sourcefilename, platformsourcefilename)
-                objectfiles=[]
-                try:
-                    objectfiles = compiler.compile(sources=[platformsourcefilename],macros=[('IKFAST_CLIBRARY',1),('IKFAST_NO_MAIN',1)],extra_postargs=compile_flags,output_dir=output_dir)
-                    # because some parts of ikfast require lapack, always try to link with it
-                    try:
-                        iswindows = sys.platform.startswith('win') or platform.system().lower() == 'windows'
-                        libraries = None
-                        if self.statistics.get('usinglapack',False) or not iswindows:
-                            libraries = ['lapack']
-                        compiler.link_shared_object(objectfiles,output_filename=output_filename, libraries=libraries)
-                    except distutils.errors.LinkError,e:
-                        log.warn(e)
-                        if libraries is not None and 'lapack' in libraries:
-                            libraries.remove('lapack')
-                            if len(libraries) == 0:
-                                libraries = None
-                        log.info('linking again with %r... (MSVC bug?)',libraries)
-                        compiler.link_shared_object(objectfiles,output_filename=output_filename, libraries=libraries)
-                        
-                    if not self.setrobot():
-                        return ValueError('failed to generate ik solver')
-                finally:
-                    # cleanup intermediate files
-                    if os.path.isfile(platformsourcefilename):
-                        remove(platformsourcefilename)
-                    for objectfile in objectfiles:
-                        try:
-                            remove(objectfile)
-                        except:
-                            pass
+                self.compileIkSolver(sourcefilename,output_filename)
+                if not self.setrobot():
+                    return ValueError('failed to generate ik solver')
             else:
                 log.warn('cannot continue further if outputlang %s is not cpp',outputlang)
                 
         self._cachedKinematicsHash = self.manip.GetInverseKinematicsStructureHash(self.iktype)
         
+    def compileIkSolver(self,sourcefilename,output_filename):
+        """compiles the generated c++ file into a shared object
+        """
+        compiler,compile_flags = self.getcompiler()
+        try:
+           output_dir = os.path.relpath('/',getcwd())
+        except AttributeError: # python 2.5 does not have os.path.relpath
+           output_dir = relpath('/',getcwd())
+
+        platformsourcefilename = os.path.splitext(output_filename)[0]+'.cpp' # needed in order to prevent interference with machines with different architectures 
+        shutil.copyfile(sourcefilename, platformsourcefilename)
+        objectfiles=[]
+        try:
+            objectfiles = compiler.compile(sources=[platformsourcefilename],macros=[('IKFAST_CLIBRARY',1),('IKFAST_NO_MAIN',1)],extra_postargs=compile_flags,output_dir=output_dir)
+            # because some parts of ikfast require lapack, always try to link with it
+            try:
+                iswindows = sys.platform.startswith('win') or platform.system().lower() == 'windows'
+                libraries = None
+                if self.statistics.get('usinglapack',False) or not iswindows:
+                    libraries = ['lapack']
+                compiler.link_shared_object(objectfiles,output_filename=output_filename, libraries=libraries)
+            except distutils.errors.LinkError,e:
+                log.warn(e)
+                if libraries is not None and 'lapack' in libraries:
+                    libraries.remove('lapack')
+                    if len(libraries) == 0:
+                        libraries = None
+                log.info('linking again with %r... (MSVC bug?)',libraries)
+                compiler.link_shared_object(objectfiles,output_filename=output_filename, libraries=libraries)
+        finally:
+            # cleanup intermediate files
+            if os.path.isfile(platformsourcefilename):
+                remove(platformsourcefilename)
+            for objectfile in objectfiles:
+                try:
+                    remove(objectfile)
+                except:
+                    pass
+
+    def selectPolyRootsMethods(self,solver,chaintree,sourcefilename,output_filename,numiktests=500,numperftiming=2000):
+        """chooses the root finding method of every polynomial node of the generated ik by compiling the ik with each method and measuring it with the DebugIK and PerfTiming commands of the ikfast module.
+
+        The nodes are chosen one after the other keeping the methods of the previous nodes. Methods with wrong solutions or with a lower success rate than the best one are rejected, and the fastest of the rest is used. The measurements are stored in statistics['polyrootsselection'].
+
+        :return: dict from the node index to the method, can be passed to IKFastSolver.writeIkSolver
+        """
+        methods = {}
+        selection = []
+        basename,ext = os.path.splitext(output_filename)
+        for inode,(degree,defaultmethod) in enumerate(solver.polyrootsnodes):
+            results = []
+            for method in self.ikfast.CodeGenerators['cpp'].PolyRootsMethods:
+                methods[inode] = method
+                candidatesourcefilename = os.path.splitext(sourcefilename)[0]+'_polyroots%d%s.cpp'%(inode,method)
+                # every candidate is a different library since the ikfast module keeps libraries loaded
+                candidatefilename = basename+'_polyroots%d%s'%(inode,method)+ext
+                try:
+                    with open(candidatesourcefilename,'w') as f:
+                        f.write(solver.writeIkSolver(chaintree,lang='cpp',polyrootsmethods=methods))
+                    # compileIkSolver links lapack from the statistics
+                    self.statistics['usinglapack'] = solver.usinglapack
+                    self.compileIkSolver(candidatesourcefilename,candidatefilename)
+                    successrate,wrongrate,runtime = self._MeasureIkLibrary('%s_polyroots%d%s'%(self.getikname().split()[1],inode,method),candidatefilename,numiktests,numperftiming)
+                    log.info('polynomial %d (degree %d) using %s: success rate %f, wrong rate %f, mean time %fs',inode,degree,method,successrate,wrongrate,runtime)
+                    results.append((method,successrate,wrongrate,runtime))
+                except (InverseKinematicsError,distutils.errors.CCompilerError),e:
+                    log.warn('polynomial %d (degree %d) failed with %s: %s',inode,degree,method,e)
+                finally:
+                    for filename in [candidatesourcefilename,candidatefilename]:
+                        if os.path.isfile(filename):
+                            remove(filename)
+            validresults = [result for result in results if result[2] == 0]
+            if len(validresults) > 0:
+                bestsuccessrate = max([result[1] for result in validresults])
+                # allow for the noise of the random tests
+                methods[inode] = min([result for result in validresults if result[1] >= bestsuccessrate-0.002],key=lambda result: result[3])[0]
+            else:
+                methods[inode] = defaultmethod
+            selection.append(results)
+            log.info('polynomial %d (degree %d) uses %s',inode,degree,methods[inode])
+        self.statistics['polyrootsselection'] = selection
+        # restore the solver of the generated ik
+        self.iksolver = None
+        return methods
+
+    def _MeasureIkLibrary(self,libraryname,filename,numiktests,numperftiming):
+        """sets a compiled ik library as the ik solver of the manipulator and returns its success rate, wrong rate, and mean running time
+        """
+        with self.env:
+            iktype = self.ikfastproblem.SendCommand('AddIkLibrary %s %s'%(libraryname,filename))
+            if iktype is None:
+                raise InverseKinematicsError(u'failed to load ik library %s'%filename)
+            iksolver = RaveCreateIkSolver(self.env,'ikfast %s%s'%(libraryname,self._GetFreeIncrementsSuffix()))
+            if iksolver is None or not self.manip.SetIKSolver(iksolver):
+                raise InverseKinematicsError(u'failed to set ik library %s'%filename)
+        successrate,wrongrate = self.testik(str(numiktests))
+        with self.env:
+            results = self.ikfastproblem.SendCommand('PerfTiming num %d %s'%(numperftiming,filename))
+        return successrate,wrongrate,mean([double(s)*1e-9 for s in results.split()])
+
     def perftiming(self,num):
         with self.env:
             results = self.ikfastproblem.SendCommand('PerfTiming num %d %s'%(num,self.getfilename(True)))
@@ -1050,7 +1357,7 @@ class InverseKinematicsModel(DatabaseGenerator):
                         sols = self.manip.FindIKSolutions(ikparam,IkFilterOptions.CheckEnvCollisions)
                         weights = self.robot.GetDOFWeights(self.manip.GetArmIndices())
                         log.info('found %d solutions'%len(sols))
-                        sols = TSP(sols,lambda x,y: sum(weights*(x-y)**2))
+                        sols,indices = TSP(sols,weights=weights)
                         # find shortest route
                         for sol in sols:
                             self.robot.SetDOFValues(sol,self.manip.GetArmIndices())
@@ -1112,6 +1419,10 @@ class InverseKinematicsModel(DatabaseGenerator):
                           help='if true will drop into the ipython interpreter right before ikfast is called')
         parser.add_option('--iktype', action='store',type='string',dest='iktype',default=None,
                           help='The ik type to build the solver current types are: %s'%(', '.join(iktype.name for iktype in IkParameterizationType.values.values() if not int(iktype) & IkParameterizationType.VelocityDataBit )))
+        parser.add_option('--polyrootsmethod', action='store',type='string',dest='polyrootsmethod',default=None,
+                          help='The method for finding the roots of high-degree polynomials in the generated code: durandkerner, companion, or sturm (default=durandkerner).')
+        parser.add_option('--selectpolyroots', action='store_true',dest='selectpolyroots',default=False,
+                          help='If set, compiles the ik with every polynomial root finding method and keeps the fastest accurate one for each polynomial. The chosen methods are saved in the statistics.')
         parser.add_option('--filepermissions', action='store',type='int',dest='filepermissions',default=-1,
                           help='The desired permissions for saving the iksolver files and directories')
         return parser
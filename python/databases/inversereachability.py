@@ -69,11 +69,6 @@ from optparse import OptionParser
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
 
-try:
-    from scipy.optimize import leastsq
-except ImportError:
-    print 'could not import scipy.optimize.leastsq'
-
 class InverseReachabilityModel(DatabaseGenerator):
     """Inverts the reachability and computes probability distributions of the robot's base given an end effector position"""
     def __init__(self,robot,id=None):
@@ -217,10 +212,14 @@ class InverseReachabilityModel(DatabaseGenerator):
             # find all equivalence classes
             quatrolls = array([quatFromAxisAngle(array((0,0,1)),roll) for roll in arange(0,2*pi,quatthresh*0.5)])
             self.equivalenceclasses = []
+            rolledquats = zeros((len(quatrolls),4))
+            querypoints = zeros((len(quatrolls),5))
             while len(basetrans) > 0:
                 searchtrans = c_[basetrans[:,0:4],basetrans[:,6:7]]
                 kdtree = kinematicreachability.ReachabilityModel.QuaternionKDTree(searchtrans,1.0/self.rotweight)
-                querypoints = c_[quatArrayTMult(quatrolls, searchtrans[0][0:4]),tile(searchtrans[0][4:],(len(quatrolls),1))]
+                quatArrayTMult(quatrolls, searchtrans[0][0:4], out=rolledquats)
+                querypoints[:,0:4] = rolledquats
+                querypoints[:,4] = searchtrans[0][4]
                 foundindices = zeros(len(searchtrans),bool)
                 for querypoint in querypoints:
                     k = min(len(searchtrans),1000)
@@ -237,6 +236,8 @@ class InverseReachabilityModel(DatabaseGenerator):
                 q0 = sum(normalizedqarray,axis=0)
                 q0 /= sqrt(sum(q0**2))
                 if len(normalizedqarray) >= Nminimum:
+                    # scipy is slow to import, only load it when generating
+                    from scipy.optimize import leastsq
                     qmean,success = leastsq(lambda q: quatArrayTDist(q/sqrt(sum(q**2)),normalizedqarray), normalizedqarray[0],maxfev=10000)
                     qmean /= sqrt(sum(qmean**2))
                 else:
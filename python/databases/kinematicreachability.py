@@ -68,7 +68,6 @@ import numpy
 import time
 import os.path
 from os import makedirs
-from heapq import nsmallest # for nth smallest element
 from optparse import OptionParser
 
 import logging
@@ -300,16 +299,14 @@ class ReachabilityModel(DatabaseGenerator):
                 maxradius = armlength+xyzdelta*sqrt(3.0)*1.05
 
             allpoints,insideinds,shape,self.pointscale = self.UniformlySampleSpace(maxradius,delta=xyzdelta)
-            qarray = SpaceSamplerExtra().sampleSO3(quatdelta=quatdelta)
+            sampler = SpaceSamplerExtra()
+            qarray = sampler.sampleSO3(quatdelta=quatdelta)
             rotations = [eye(3)] if translationonly else rotationMatrixFromQArray(qarray)
             self.xyzdelta = xyzdelta
             self.quatdelta = 0
             if not translationonly:
                 # for rotations, get the average distance to the nearest rotation
-                neighdists = []
-                for q in qarray:
-                    neighdists.append(nsmallest(2,quatArrayTDist(q,qarray))[1])
-                self.quatdelta = mean(neighdists)
+                self.quatdelta = sampler.getSO3Separation(quatdelta=quatdelta)
             log.info('radius: %f, xyzsamples: %d, quatdelta: %f, rot samples: %d, freespace: %d',maxradius,len(insideinds),self.quatdelta,len(rotations),usefreespace)
             
         self.reachabilitydensity3d = zeros(prod(shape))
@@ -401,6 +398,21 @@ class ReachabilityModel(DatabaseGenerator):
         insideinds = flatnonzero(sum(allpoints**2,1)<maxradius**2)
         return allpoints,insideinds,X.shape,array((1.0/delta,nsteps))
 
+    def ComputeReachability3D(self,points):
+        """returns the reachability3d value of the voxel containing each point.
+
+        :param points: Nx3 array of end effector positions in the manipulator base coordinate system. Points outside of the sampled region have a value of 0.
+        """
+        with self.robot:
+            Tbaseinv = linalg.inv(self.manip.GetBase().GetTransform())
+            baseanchor = transformPoints(Tbaseinv,[self.getOrderedArmJoints()[0].GetAnchor()])[0]
+        reachability3d = self._GetValue(self.reachability3d)
+        inds = array(numpy.round(self.pointscale[0]*(points-baseanchor)+self.pointscale[1]),int)
+        valid = numpy.all((inds>=0)&(inds<reachability3d.shape),1)
+        values = zeros(len(points))
+        values[valid] = reachability3d[inds[valid,0],inds[valid,1],inds[valid,2]]
+        return values
+
     def ComputeNN(self,translationonly=False):
         if translationonly:
             if self.kdtree3d is None:
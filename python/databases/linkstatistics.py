@@ -74,9 +74,15 @@ import convexdecomposition
 from ..misc import ComputeGeodesicSphereMesh, ComputeBoxMesh, ComputeCylinderYMesh, SpaceSamplerExtra
 import time
 import os.path
+import hashlib
 from optparse import OptionParser
 from itertools import izip
-from os import makedirs
+from os import makedirs, rename
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
 
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
@@ -84,9 +90,10 @@ log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
 class LinkStatisticsModel(DatabaseGenerator):
     """Computes the convex decomposition of all of the robot's links"""
     
-    grabbedjointspheres = None # a list of (grabbedinfo, dict) that stores swept spheres of each joint. key is joint index. 
+    grabbedjointspheres = None # a dict of the digest of the grabbed state (see _GetGrabbedDigest) -> dict that stores swept spheres of each joint. key is joint index.
     def __init__(self,robot):
         DatabaseGenerator.__init__(self,robot=robot)
+        self._savepending = False # True if grabbedjointspheres has grabbed states that are not saved yet
     
     def has(self):
         return self.grabbedjointspheres is not None and len(self.grabbedjointspheres) > 0
@@ -99,7 +106,7 @@ class LinkStatisticsModel(DatabaseGenerator):
             return value
 
     def getversion(self):
-        return 6
+        return 8
     
     def save(self):
         self.SavePickle()
@@ -108,7 +115,26 @@ class LinkStatisticsModel(DatabaseGenerator):
         return self.LoadPickle()
     
     def SavePickle(self):
-        DatabaseGenerator.save(self,self.grabbedjointspheres)
+        """saves the joint spheres of all grabbed states, merged with the ones other processes have already saved
+        """
+        try:
+            params = DatabaseGenerator.load(self)
+        except Exception, e:
+            params = None
+        if params is not None:
+            params.update(self.grabbedjointspheres)
+            self.grabbedjointspheres = params
+        filename = self.getfilename(False)
+        log.info('saving model to %s',filename)
+        try:
+            makedirs(os.path.split(filename)[0])
+        except OSError:
+            pass
+        # write to a temporary file so concurrent readers never see a partial file
+        tempfilename = '%s.%d.tmp'%(filename,os.getpid())
+        with open(tempfilename, 'w') as f:
+            pickle.dump((self.getversion(),self.grabbedjointspheres), f)
+        rename(tempfilename,filename)
     
     def LoadPickle(self):
         try:
@@ -135,37 +161,40 @@ class LinkStatisticsModel(DatabaseGenerator):
 
             jointspheres = self._GetJointSpheresFromGrabbed(self.robot.GetGrabbedInfo())
             resolutions = xyzdelta*ones(self.robot.GetDOF())
-            for ijoint in range(len(self.robot.GetJoints())):
+            joints = self.robot.GetJoints()
+            for ijoint in range(len(joints)):
                 if ijoint in jointspheres:
-                    dofindex = self.robot.GetJoints()[ijoint].GetDOFIndex()
+                    dofindex = joints[ijoint].GetDOFIndex()
                     if abs(jointspheres[ijoint][1]) > 1e-7:
                         # sometimes there are no geometries attached for prototype robots...
                         resolutions[dofindex] = xyzdelta/jointspheres[ijoint][1]
             self.robot.SetDOFResolutions(resolutions)
             self.robot.SetAffineTranslationResolution(tile(xyzdelta,3))
             self.robot.SetAffineRotationAxisResolution(tile(resolutions[0],4))
+        self._SavePendingGrabbedStates()
         
     def setRobotWeights(self,type=0,weightmult=1.0):
         """sets the weights for the robot.
         """
         with self.env:
             jointspheres = self._GetJointSpheresFromGrabbed(self.robot.GetGrabbedInfo())
+            joints = self.robot.GetJoints()
             if type == 0:
                 weights = ones(self.robot.GetDOF())
                 totalweight = 0.0
                 numweights = 0
-                for ijoint in range(len(self.robot.GetJoints())):
+                for ijoint in range(len(joints)):
                     if ijoint in jointspheres:
-                        dofindex = self.robot.GetJoints()[ijoint].GetDOFIndex()
+                        dofindex = joints[ijoint].GetDOFIndex()
                         weights[dofindex] = jointspheres[ijoint][1]
                         totalweight += jointspheres[ijoint][1]
                         numweights += 1
 
                 # avoid division by zero, and let small weights be handled below
                 if totalweight > 1e-7:
-                    for ijoint in range(len(self.robot.GetJoints())):
+                    for ijoint in range(len(joints)):
                         if ijoint in jointspheres:
-                            dofindex = self.robot.GetJoints()[ijoint].GetDOFIndex()
+                            dofindex = joints[ijoint].GetDOFIndex()
                             weights[dofindex] *= weightmult*numweights/totalweight
                 else:
                     log.debug('total weight (%s) for robot %s is too small, so do not normalize', totalweight, self.robot.GetName())
@@ -186,6 +215,7 @@ class LinkStatisticsModel(DatabaseGenerator):
                 self.robot.SetAffineRotationAxisWeights(ones(4))
             else:
                 raise ValueError('no such type')
+        self._SavePendingGrabbedStates()
     
     def autogenerate(self,options=None):
         self.generate()
@@ -198,21 +228,52 @@ class LinkStatisticsModel(DatabaseGenerator):
         with self.robot:
             self.robot.SetTransform(eye(4))
             self.robot.SetDOFValues(zeros(self.robot.GetDOF()))
-            self.grabbedjointspheres = [(self.robot.GetGrabbedInfo(), self._ComputeJointSpheres())]
+            self.grabbedjointspheres = {self._GetGrabbedDigest(self.robot.GetGrabbedInfo()): self._ComputeJointSpheres()}
+    
+    def _GetGrabbedDigest(self, grabbedinfo):
+        """returns a digest of the grabbed state that does not depend on the order of the grabbed bodies. The relative transforms are rounded to 1e-7.
+
+        The kinematics geometry hash of every grabbed body is included, so a different body with the same name does not reuse the spheres.
+        """
+        digest = hashlib.sha1()
+        for info in sorted(grabbedinfo, key=lambda info: (info._grabbedname, info._robotlinkname)):
+            grabbedbody = self.env.GetKinBody(info._grabbedname)
+            digest.update('%s\0%s\0%s\0'%(info._grabbedname, info._robotlinkname, grabbedbody.GetKinematicsGeometryHash() if grabbedbody is not None else ''))
+            # adding 0.0 turns -0.0 into 0.0
+            digest.update((numpy.around(numpy.array(info._trelative, numpy.float64), 7)+0.0).tostring())
+            digest.update('\0'.join(sorted(str(link) for link in info._setRobotLinksToIgnore))+'\0\0')
+        return digest.hexdigest()
     
     def _GetJointSpheresFromGrabbed(self, grabbedinfo):
-        for testgrabbedinfo, testjointspheres in self.grabbedjointspheres:
-            if len(testgrabbedinfo) == len(grabbedinfo):
-                if all([(grabbedinfo[i]._grabbedname == testgrabbedinfo[i]._grabbedname and grabbedinfo[i]._robotlinkname == testgrabbedinfo[i]._robotlinkname and sum(abs(grabbedinfo[i]._trelative-testgrabbedinfo[i]._trelative)) <= 1e-7 and grabbedinfo[i]._setRobotLinksToIgnore == testgrabbedinfo[i]._setRobotLinksToIgnore) for i in range(len(grabbedinfo))]):
-                    return testjointspheres
+        grabbeddigest = self._GetGrabbedDigest(grabbedinfo)
+        jointspheres = self.grabbedjointspheres.get(grabbeddigest, None)
+        if jointspheres is not None:
+            return jointspheres
         
         log.debug('adding new linkstatistic for grabbed bodies: %r', [g._grabbedname for g in grabbedinfo])
         jointspheres = self._ComputeJointSpheres()
-        self.grabbedjointspheres.append((grabbedinfo, jointspheres)) # tuple copies so that it doesn't change...
+        self.grabbedjointspheres[grabbeddigest] = jointspheres
+        # saved by the caller once the environment lock is released
+        self._savepending = True
         return jointspheres
+
+    def _SavePendingGrabbedStates(self):
+        """saves the grabbed states computed since the last save so that other processes do not have to compute them again. Reading and writing the file is slow, so this should not be called while holding the environment lock.
+        """
+        if not self._savepending:
+            return
+        self._savepending = False
+        try:
+            self.SavePickle()
+        except (IOError, OSError), e:
+            log.warn(u'failed to save linkstatistics: %s', e)
     
     def _ComputeJointSpheres(self):
         jointspheres = {}
+        # joints indexed by their parent link so that finding the child joints does not go through all joints
+        childjointsfromlink = {}
+        for testj in self.robot.GetJoints():
+            childjointsfromlink.setdefault(testj.GetHierarchyParentLink().GetIndex(), []).append(testj)
         for j in self.robot.GetDependencyOrderedJoints()[::-1]:
             if not j.IsRevolute(0):
                 continue
@@ -232,7 +293,7 @@ class LinkStatisticsModel(DatabaseGenerator):
             minpos = spherepos - sphereradius*ones([1,1,1])
             maxpos = spherepos + sphereradius*ones([1,1,1])
 
-            childjoints = [testj for testj in self.robot.GetJoints() if testj.GetHierarchyParentLink() in childlinks]
+            childjoints = [testj for childlink in childlinks for testj in childjointsfromlink.get(childlink.GetIndex(), [])]
             for childjoint in childjoints:
                 if childjoint.GetJointIndex() in jointspheres:
                     childpos, childradius = jointspheres[childjoint.GetJointIndex()]
@@ -71,6 +71,7 @@ __license__ = 'Apache License, Version 2.0'
 
 import time
 import os.path
+from collections import OrderedDict
 
 if not __openravepy_build_doc__:
     from ..openravepy_int import *
@@ -82,12 +83,13 @@ else:
 from ..openravepy_int import RaveGetDefaultViewerType
 from . import DatabaseGenerator
 import inversekinematics, kinematicreachability
-from .. import interfaces
+from .. import interfaces, PlanningError
 
 import logging
 log = logging.getLogger('openravepy.'+__name__.split('.',2)[-1])
 
 class VisibilityModel(DatabaseGenerator):
+    maxprunecache = 256 # maximum number of target poses whose pruned transforms are cached by pruneTransformations
     visibilitytransforms = None # a list of camera pose in the pattern coordinate system
     targetlink = None # the target link object
     targetgeomname = None # name of a geometry object inside target link to constrain the visiblity checking
@@ -142,6 +144,8 @@ class VisibilityModel(DatabaseGenerator):
         self.rmodel = self.ikmodel = None
         self.preshapes = None
         self.iktype = iktype
+        self.ikcache = None # if set to an inversekinematics.IkSolutionCache of self.manip, used by computeValidTransform
+        self._prunecache = OrderedDict() # pruned visibility transforms indexed by the pruning parameters and the bucketed target pose in the manipulator base, least recently used first
         self.preprocess()
     def clone(self,envother):
         clone = DatabaseGenerator.clone(self,envother)
@@ -150,6 +154,9 @@ class VisibilityModel(DatabaseGenerator):
         clone.ikmodel = self.ikmodel.clone(envother) if not self.ikmodel is None else None
         clone.visualprob = self.visualprob.clone(envother)
         clone.basemanip = self.basemanip.clone(envother)
+        clone._prunecache = OrderedDict()
+        if self.ikcache is not None:
+            clone.ikcache = inversekinematics.IkSolutionCache(clone.manip,maxsize=self.ikcache.maxsize,resolution=self.ikcache.resolution)
         clone.preprocess()
         return clone
     def has(self):
@@ -182,6 +189,7 @@ class VisibilityModel(DatabaseGenerator):
                 self.ikmodel.autogenerate()
             if self.visibilitytransforms is not None:
                 self.visualprob.SetCameraTransforms(transforms=self.visibilitytransforms)
+            self._prunecache = OrderedDict()
     
     def autogenerate(self,options=None,gmodel=None):
         preshapes = None
@@ -361,49 +369,124 @@ class VisibilityModel(DatabaseGenerator):
             while not self.robot.GetController().IsDone(): # busy wait
                 time.sleep(0.01)
 
-    def computeValidTransform(self,returnall=False,checkcollision=True,computevisibility=True,randomize=False):
+    def computeValidTransform(self,returnall=False,checkcollision=True,computevisibility=True,randomize=False,chunksize=16,maxvisibilitychecks=None,usereachability=True):
+        """Searches the visibility transforms for arm configurations that can see the target.
+
+        If a reachability model is available, camera poses whose end effector position falls in an unreachable voxel are skipped and the rest are tried from the most reachable. IK is evaluated chunksize poses at a time, and the visibility check is run on the IK solutions of a chunk starting from the ones closest to the current arm configuration.
+        :param returnall: if True, returns all valid configurations, otherwise stops at the first one
+        :param randomize: if True, tries the poses in random order
+        :param maxvisibilitychecks: if not None, the maximum number of visibility checks to run
+        :param usereachability: if True, will use the reachability model to prune and order the poses
+        :return: a list of (solution, visibility transform index) tuples
+        """
         with self.robot:
             if self.manip.CheckIndependentCollision():
-                raise planning_error('robot independent links are initiallly in collision')
-            validjoints = []
+                raise PlanningError('robot independent links are initiallly in collision')
+            Tgrasps = self._ComputeEndEffectorTransforms(self.targetlink.GetParent().GetTransform(),self.visibilitytransforms)
             if randomize:
-                order = random.permutation(len(self.visibilitytransforms))
+                order = random.permutation(len(Tgrasps))
             else:
-                order = xrange(len(self.visibilitytransforms))
-            for i in order:
-                pose = self.visibilitytransforms[i]
-                Trelative = dot(linalg.inv(self.attachedsensor.GetTransform()),self.manip.GetEndEffectorTransform())
-                Tcamera = dot(self.targetlink.GetParent().GetTransform(),matrixFromPose(pose))
-                Tgrasp = dot(Tcamera,Trelative)
-                s = self.manip.FindIKSolution(Tgrasp,checkcollision)
-                if s is not None:
-                    self.robot.SetDOFValues(s,self.manip.GetArmIndices())
-                    if computevisibility and not self.visualprob.ComputeVisibility():
-                        continue
+                order = arange(len(Tgrasps))
+            rmodel = self._GetReachabilityModel() if usereachability else None
+            if rmodel is not None:
+                Tbaseinv = linalg.inv(self.manip.GetBase().GetTransform())
+                reachability = rmodel.ComputeReachability3D(transformPoints(Tbaseinv,Tgrasps[order,0:3,3]))
+                reachableindices = flatnonzero(reachability>0)
+                if not randomize:
+                    reachableindices = reachableindices[argsort(-reachability[reachableindices],kind='mergesort')]
+                order = order[reachableindices]
+            armvalues = self.robot.GetDOFValues(self.manip.GetArmIndices())
+            validjoints = []
+            numvisibilitychecks = 0
+            for ichunk in xrange(0,len(order),chunksize):
+                candidates = []
+                for i in order[ichunk:(ichunk+chunksize)]:
+                    if self.ikcache is not None:
+                        s = self.ikcache.FindIKSolution(Tgrasps[i],checkcollision)
+                    else:
+                        s = self.manip.FindIKSolution(Tgrasps[i],checkcollision)
+                    if s is not None:
+                        candidates.append((sum((s-armvalues)**2),s,i))
+                        if not computevisibility and not returnall:
+                            break
+                candidates.sort(key=lambda candidate: candidate[0])
+                for dist,s,i in candidates:
+                    if computevisibility:
+                        if maxvisibilitychecks is not None and numvisibilitychecks >= maxvisibilitychecks:
+                            return validjoints
+                        numvisibilitychecks += 1
+                        self.robot.SetDOFValues(s,self.manip.GetArmIndices())
+                        if not self.visualprob.ComputeVisibility():
+                            continue
                     validjoints.append((s,i))
                     if not returnall:
                         return validjoints
-                    print 'found',len(validjoints)
+                log.debug('found %d valid configurations in %d/%d poses',len(validjoints),min(ichunk+chunksize,len(order)),len(order))
             return validjoints
 
-    def pruneTransformations(self,thresh=0.04,numminneighs=10,maxdist=None,translationonly=True):
+    def _ComputeEndEffectorTransforms(self,Ttarget,visibilitytransforms):
+        """returns the Nx4x4 end effector transforms that place the camera at each of the visibility transforms of a target at Ttarget"""
+        # the sensor to end effector transform is the same for every camera pose
+        Trelative = dot(linalg.inv(self.attachedsensor.GetTransform()),self.manip.GetEndEffectorTransform())
+        Tcameras = matrixFromPoses(visibilitytransforms)
+        return dot(dot(Ttarget,Tcameras).transpose(1,0,2),Trelative)
+
+    def _GetReachabilityModel(self):
+        """returns the reachability model if it has been generated, otherwise None"""
         if self.rmodel is None:
-            self.rmodel = kinematicreachability.ReachabilityModel(robot=self.robot)
-            if not self.rmodel.load():
-                # do not autogenerate since that would force this model to depend on the reachability
-                self.rmodel = None
-                return array(visibilitytransforms)
+            rmodel = kinematicreachability.ReachabilityModel(robot=self.robot)
+            # do not autogenerate since that would force this model to depend on the reachability
+            if rmodel.load():
+                self.rmodel = rmodel
+        return self.rmodel
+
+    def pruneTransformations(self,thresh=0.04,numminneighs=10,maxdist=None,translationonly=True,quatthresh=None,cachedelta=0.01):
+        """Returns the visibility transforms that have at least numminneighs reachable poses close to them, sorted by decreasing density.
+
+        :param thresh: the translation radius of the neighborhood
+        :param translationonly: if True, only the camera positions are compared to the reachable positions. Otherwise the full end effector poses needed for each camera pose are compared to the reachable poses.
+        :param quatthresh: the quaternion distance (same as quatArrayTDist) radius of the neighborhood when translationonly is False. If None, uses the rotation separation of the reachability model.
+        :param cachedelta: the results are cached for target poses relative to the manipulator base that fall in the same bucket of this size. If None, does not use the cache.
+        """
+        if self._GetReachabilityModel() is None:
+            return array(self.visibilitytransforms)
+        Trelativetarget = dot(linalg.inv(self.manip.GetBase().GetTransform()),self.targetlink.GetParent().GetTransform())
+        cachekey = None
+        if cachedelta is not None:
+            relativepose = poseFromMatrix(Trelativetarget)
+            if relativepose[0] < 0:
+                relativepose[0:4] *= -1
+            cachekey = (self.targetlink.GetParent().GetName(),thresh,numminneighs,maxdist,translationonly,quatthresh,cachedelta,tuple(array(floor(relativepose/cachedelta+0.5),int)))
+            if cachekey in self._prunecache:
+                # reinsert to mark as most recently used
+                prunedtransforms = self._prunecache.pop(cachekey)
+                self._prunecache[cachekey] = prunedtransforms
+                return array(prunedtransforms)
         kdtree=self.rmodel.ComputeNN(translationonly)
         if maxdist is not None:
             visibilitytransforms = self.visibilitytransforms[invertPoses(self.visibilitytransforms)[:,6]<maxdist]
         else:
             visibilitytransforms = self.visibilitytransforms
-        newtrans = poseMultArrayT(poseFromMatrix(dot(linalg.inv(self.manip.GetBase().GetTransform()),self.targetlink.GetParent().GetTransform())),visibilitytransforms)
         if translationonly:
-            transdensity = kdtree.kFRSearchArray(newtrans[:,4:7],thresh**2,0,thresh*0.01)[2]
-            I=flatnonzero(transdensity>numminneighs)
-            return visibilitytransforms[I[argsort(-transdensity[I])]]
-        raise ValueError('not supported')
+            newtrans = poseMultArrayT(poseFromMatrix(Trelativetarget),visibilitytransforms)
+            density = kdtree.kFRSearchArray(newtrans[:,4:7],thresh**2,0,thresh*0.01)[2]
+        else:
+            if quatthresh is None:
+                quatthresh = self.rmodel.quatdelta
+            # search with the end effector poses in the manipulator base coordinate system, the same space as the reachability poses
+            Tgrasps = self._ComputeEndEffectorTransforms(Trelativetarget,visibilitytransforms)
+            graspposes = poseFromMatrices(Tgrasps)
+            # the kdtree measures the chord between quaternions, quatthresh is the angle 2*arcsin(chord/2) between them
+            quatchord = 2*sin(0.5*minimum(quatthresh,pi))
+            radius = sqrt(quatchord**2+(kdtree.transmult*thresh)**2)
+            density = kdtree.kFRSearchArray(graspposes,radius**2,0,radius*0.01)[2]
+        I=flatnonzero(density>numminneighs)
+        prunedtransforms = visibilitytransforms[I[argsort(-density[I])]]
+        if cachekey is not None:
+            self._prunecache[cachekey] = prunedtransforms
+            while len(self._prunecache) > self.maxprunecache:
+                self._prunecache.popitem(last=False)
+        return array(prunedtransforms)
 #         Imask = GetCameraRobotMask(orenv,options.robotfile,sensorindex=options.sensorindex,gripperjoints=gripperjoints,robotjoints=robotjoints,robotjointinds=robotjointinds,rayoffset=options.rayoffset)
 #         # save as a ascii matfile
 #         numpy.savetxt(options.savefile,Imask,'%d')
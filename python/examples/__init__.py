@@ -16,48 +16,11 @@ Execute example ``X`` using:
 Each sub-module contains a 'run' function that can be called directly with options to configure the example.
 """
 
-# tutorials showing a single functionality (simple)
-import tutorial_grasptransform
-import tutorial_ik5d
-import tutorial_iklookat
-import tutorial_iklookat_multiple
-import tutorial_iksolutions
-import tutorial_iktranslation
-import tutorial_iktranslation2d
-import tutorial_inversereachability
-import tutorial_plotting
-
-# examples showing complex demos
-import calibrationviews
-import checkconvexdecomposition
-import checkvisibility
-import collision
-import collision2
-import constraintplanning
-import cubeassembly
-import dualarmdemo_schunk
-import fastgrasping
-import fastgraspingthreaded
-import graspplanning
-import hanoi
-import inversekinematicspick
-import movehandstraight
-import pr2turnlever
-
-try:
-    from PyQt4 import QtGui, QtCore
-    import qtexampleselector
-    import qtserverprocess
-except ImportError:
-    pass
-
-import showsensors
-import simplegrasping
-import simplemanipulation
-import simplenavigation
-import testphysics
-import testphysics_controller
-import testphysics_diffdrive
-import testupdatingbodies
-import testviewercallback
-import visibilityplanning
+# the examples are imported when first used, see lazyimport
+from ..lazyimport import InstallLazySubmodules
+# first the tutorials showing a single functionality (simple), the qt examples need PyQt4
+InstallLazySubmodules(__name__, ['tutorial_grasptransform', 'tutorial_ik5d', 'tutorial_iklookat', 'tutorial_iklookat_multiple', 'tutorial_iksolutions', 'tutorial_iktranslation', 'tutorial_iktranslation2d', 'tutorial_inversereachability', 'tutorial_plotting',
+                                 'calibrationviews', 'checkconvexdecomposition', 'checkvisibility', 'collision', 'collision2', 'constraintplanning', 'cubeassembly', 'dualarmdemo_schunk', 'fastgrasping', 'fastgraspingthreaded', 'graspplanning', 'hanoi', 'inversekinematicspick', 'movehandstraight', 'pr2turnlever',
+                                 'qtexampleselector', 'qtserverprocess',
+                                 'showsensors', 'simplegrasping', 'simplemanipulation', 'simplenavigation', 'testphysics', 'testphysics_controller', 'testphysics_diffdrive', 'testupdatingbodies', 'testviewercallback', 'visibilityplanning'],
+                      optionalsubmodules=['qtexampleselector', 'qtserverprocess'])
@@ -569,6 +569,17 @@ IKFAST_API bool ComputeIk(const IkReal* eetrans, const IkReal* eerot, const IkRe
  */
 IKFAST_API bool ComputeIk2(const IkReal* eetrans, const IkReal* eerot, const IkReal* pfree, ikfast::IkSolutionListBase<IkReal>& solutions, void* pOpenRAVEManip);
 
+/** \brief Computes the IK solutions of numposes poses at once.
+
+   The poses are stored contiguously with the same layout as ``ComputeIk``, so pose i uses ``eetrans[3*i]`` and ``eerot[9*i]``.
+   - ``pfree`` - NULL if there are no free parameters, otherwise the free values of pose i start at ``pfree[freestride*i]``. A ``freestride`` of 0 shares the same free values among all poses.
+   - ``psolutions`` - buffer of ``maxsolutions*GetNumJoints()`` values where the solutions of all the poses are written one after the other.
+   - ``poffsets`` - numposes+1 values, the solutions of pose i are the ones in [``poffsets[i]``, ``poffsets[i+1]``).
+
+   Returns the number of poses whose solutions were written. If it is less than numposes, then psolutions is full and the call can be resumed from that pose.
+ */
+IKFAST_API int ComputeIkBatch(int numposes, const IkReal* eetrans, const IkReal* eerot, const IkReal* pfree, int freestride, IkReal* psolutions, int maxsolutions, int* poffsets);
+
 /// \brief Computes the end effector coordinates given the joint values. This function is used to double check ik.
 IKFAST_API void ComputeFk(const IkReal* joints, IkReal* eetrans, IkReal* eerot);
 
@@ -1379,6 +1379,7 @@ class IKFastSolver(AutoReloader):
         """
         self._checkpreemptfn = checkpreemptfn
         self.usinglapack = False
+        self.polyrootsnodes = [] # (degree,method) of the polynomial nodes written by the last writeIkSolver
         self.useleftmultiply = True
         self.freevarsubs = []
         self.degeneratecases = None
@@ -2148,8 +2149,10 @@ class IKFastSolver(AutoReloader):
         if not found:
             raise self.IKFeasibilityError(AllEquations,checkvars)
         
-    def writeIkSolver(self,chaintree,lang=None):
+    def writeIkSolver(self,chaintree,lang=None,polyrootsmethods=None):
         """write the ast into a specific langauge, prioritize c++
+
+        :param polyrootsmethods: the root finding methods of the polynomial nodes, see ikfast_generator_cpp.CodeGenerator. After the call, self.polyrootsnodes has the (degree,method) of every node, and self.usinglapack is set if any node uses the companion method.
         """
         self._CheckPreemptFn(progress=0.5)
         if lang is None:
@@ -2166,7 +2169,16 @@ class IKFastSolver(AutoReloader):
                 weakself._checkpreemptfn(u'CodeGen %s'%msg, 0.5+0.5*progress)
         else:
             _CheckPreemtCodeGen = None
-        return CodeGenerators[lang](kinematicshash=self.kinematicshash,version=__version__,iktypestr=self._iktype, checkpreemptfn=_CheckPreemtCodeGen).generate(chaintree)
+        kwargs = {}
+        if polyrootsmethods is not None:
+            kwargs['polyrootsmethods'] = polyrootsmethods
+        generator = CodeGenerators[lang](kinematicshash=self.kinematicshash,version=__version__,iktypestr=self._iktype, checkpreemptfn=_CheckPreemtCodeGen, **kwargs)
+        code = generator.generate(chaintree)
+        self.polyrootsnodes = getattr(generator,'polyrootsnodes',[])
+        if any([method == 'companion' for degree,method in self.polyrootsnodes]):
+            # the companion matrix roots are computed with dgeev_ of lapack
+            self.usinglapack = True
+        return code
     
     def generateIkSolver(self, baselink, eelink, freeindices=None, solvefn=None, ikfastoptions=0):
         """
@@ -198,9 +198,17 @@ class CodeGenerator(AutoReloader):
     """Generates C++ code from an AST generated by IKFastSolver.
     """
     _checkpreemptfn = None
-    def __init__(self,kinematicshash='',version='0',iktypestr='',checkpreemptfn=None):
+    PolyRootsMethods = ['durandkerner','companion','sturm']
+    """methods for finding the roots of polynomials of degree 3 and higher:
+
+    - durandkerner - simultaneous iteration on all complex roots
+    - companion - eigenvalues of the companion matrix with lapack, followed by newton polishing of the real roots
+    - sturm - only the real roots, isolated with a Sturm sequence and refined with safeguarded newton iterations
+    """
+    def __init__(self,kinematicshash='',version='0',iktypestr='',checkpreemptfn=None,polyrootsmethods=None):
         """
         :param checkpreemptfn: checkpreemptfn(msg, progress) called periodically at various points in ikfast. Takes in two arguments to notify user how far the process has completed.
+        :param polyrootsmethods: the root finding method of the polynomial nodes, one of PolyRootsMethods for all nodes, or a dict from the index of the node (in the order the nodes are generated) to the method. Nodes not in the dict use durandkerner.
         """
         self.symbolgen = cse_main.numbered_symbols('x')
         self.strprinter = printing.StrPrinter({'full_prec':False})
@@ -214,16 +222,21 @@ class CodeGenerator(AutoReloader):
         self._solutioncounter = 0
         self.version=version
         self._checkpreemptfn = checkpreemptfn
+        self.polyrootsmethods = polyrootsmethods
+        self.polyrootsnodes = [] # (degree,method) of every polynomial node that needs iterative root finding, in generation order
     
     def resetequations(self):
-        self.dictequations = [[],[]]
+        # [list of (var,expr) written, list of the expanded expressions used for comparing, dict from the key of an expanded expression to its index]
+        self.dictequations = [[],[],{}]
     def copyequations(self,dictequations=None):
         if dictequations is None:
             dictequations=self.dictequations
-        return [copy.copy(dictequations[0]),copy.copy(dictequations[1])]
+        return [copy.copy(dictequations[0]),copy.copy(dictequations[1]),copy.copy(dictequations[2])]
     
-    def generate(self, solvertree):
-        code = """/// autogenerated analytical inverse kinematics code from ikfast program part of OpenRAVE
+    def getHeaderCode(self):
+        """returns the license, includes, and inline math functions that all generated files start with. Opens IKFAST_NAMESPACE, so the caller has to close it.
+        """
+        return """/// autogenerated analytical inverse kinematics code from ikfast program part of OpenRAVE
 /// \\author Rosen Diankov
 ///
 /// Licensed under the Apache License, Version 2.0 (the "License");
@@ -535,6 +548,23 @@ template <typename T> struct ComplexLess
 };
 
 """%(self.version,str(datetime.datetime.now()),self.iktypestr,self.version)
+
+    def GetPolyRootsMethod(self, inode):
+        """returns the root finding method of the inode-th polynomial node
+        """
+        if self.polyrootsmethods is None:
+            return 'durandkerner'
+        if isinstance(self.polyrootsmethods, basestring):
+            method = self.polyrootsmethods
+        else:
+            method = self.polyrootsmethods.get(inode, 'durandkerner')
+        if not method in self.PolyRootsMethods:
+            raise ValueError('unknown polynomial root method %s'%method)
+        return method
+
+    def generate(self, solvertree):
+        self.polyrootsnodes = []
+        code = self.getHeaderCode()
         code += solvertree.generate(self)
         code += solvertree.end(self)
         
@@ -552,6 +582,38 @@ IKSolver solver;
 return solver.ComputeIk(eetrans,eerot,pfree,solutions);
 }
 
+/// solves the inverse kinematics equations of numposes poses stored contiguously, pose i uses eetrans[3*i:3*i+3] and eerot[9*i:9*i+9].
+/// \param pfree NULL if there are no free parameters, otherwise the free values of pose i start at pfree[freestride*i]. Set freestride to 0 to share the same free values among all poses.
+/// \param psolutions buffer of maxsolutions*GetNumJoints() values that the solutions of all the poses are written to one after the other. Free parameters left in a solution are set to 0.
+/// \param poffsets array of numposes+1 values, the solutions of pose i are the ones in [poffsets[i],poffsets[i+1]).
+/// \return the number of poses whose solutions were written. If less than numposes, then psolutions is full and the call can be resumed from the returned pose.
+IKFAST_API int ComputeIkBatch(int numposes, const IkReal* eetrans, const IkReal* eerot, const IkReal* pfree, int freestride, IkReal* psolutions, int maxsolutions, int* poffsets) {
+IkSolutionList<IkReal> solutions;
+std::vector<IkReal> vsolfree;
+const int numjoints = GetNumJoints();
+int numsolutions = 0;
+poffsets[0] = 0;
+for(int ipose = 0; ipose < numposes; ++ipose) {
+    IKSolver solver;
+    solutions.Clear();
+    solver.ComputeIk(eetrans+3*ipose, eerot+9*ipose, pfree != NULL ? pfree+freestride*ipose : NULL, solutions);
+    const int numposesolutions = (int)solutions.GetNumSolutions();
+    if( numsolutions+numposesolutions > maxsolutions ) {
+        return ipose;
+    }
+    IkReal* pdest = psolutions+numsolutions*numjoints;
+    for(int isolution = 0; isolution < numposesolutions; ++isolution, pdest += numjoints) {
+        const IkSolutionBase<IkReal>& sol = solutions.GetSolution(isolution);
+        vsolfree.resize(sol.GetFree().size());
+        std::fill(vsolfree.begin(), vsolfree.end(), IkReal(0));
+        sol.GetSolution(pdest, vsolfree.size() > 0 ? &vsolfree[0] : NULL);
+    }
+    numsolutions += numposesolutions;
+    poffsets[ipose+1] = numsolutions;
+}
+return numposes;
+}
+
 IKFAST_API const char* GetKinematicsHash() { return "%s"; }
 
 IKFAST_API const char* GetIkFastVersion() { return "%s"; }
@@ -1339,7 +1401,17 @@ IkReal r00 = 0, r11 = 0, r22 = 0;
         if D == 0:
             log.warn('polynomial %s is of degree 0!', node.poly)
             return 'continue; // poly is 0\n'
-        polyroots=self.using_polyroots(D)
+        if D >= 3:
+            method = self.GetPolyRootsMethod(len(self.polyrootsnodes))
+            self.polyrootsnodes.append((D,method))
+        else:
+            method = 'durandkerner' # closed form
+        if method == 'companion':
+            polyroots=self.using_polyrootscompanion(D)
+        elif method == 'sturm':
+            polyroots=self.using_polyrootssturm(D)
+        else:
+            polyroots=self.using_polyroots(D)
         name = node.jointname
         polyvar = node.poly.gens[0].name
         code = 'IkReal op[%d+1], zeror[%d];\nint numroots;\n'%(D,D)
@@ -1810,30 +1882,7 @@ IkReal r00 = 0, r11 = 0, r22 = 0;
             code = cStringIO.StringIO()
         exprs = [expr for var, expr in dictequations]
         replacements,reduced_exprs = customcse(exprs,symbols=self.symbolgen)
-        N = len(self.dictequations[0])
-        for rep in replacements:
-            comparerep = rep[1].subs(self.dictequations[0]).expand()
-            found = False
-            complexity = rep[1].count_ops()
-            maxcomplexity = 3 if N > 1000 else 2
-            if complexity > maxcomplexity: # check only long expressions
-                for i in range(N):
-                    if self.dictequations[1][i] is not None and comparerep-self.dictequations[1][i]==S.Zero:
-                        #self.dictequations.append((rep[0],self.dictequations[0][i][0],self.dictequations[1][i]))
-                        code.write('IkReal %s=%s;\n'%(rep[0],self.dictequations[0][i][0]))
-                        found = True
-                        break
-            else:
-                comparerep = None
-            if not found:
-                self.dictequations[0].append(rep)
-                self.dictequations[1].append(comparerep)
-                code2,sepcodelist2 = self._WriteExprCode(rep[1])
-                for sepcode in sepcodelist2:
-                    code.write(sepcode)
-                code.write('IkReal %s='%rep[0])
-                code.write(code2.getvalue())
-                code.write(';\n')
+        self._WriteReplacements(replacements,code)
         for i,rexpr in enumerate(reduced_exprs):
             code2,sepcodelist2 = self._WriteExprCode(rexpr)
             for sepcode in sepcodelist2:
@@ -1898,30 +1947,7 @@ IkReal r00 = 0, r11 = 0, r22 = 0;
         replacements,reduced_exprs = customcse(exprs,symbols=self.symbolgen)
         #for greaterzerocheck in greaterzerochecks:
         #    code.write('if((%s) < -0.00001)\ncontinue;\n'%exprbase)
-        N = len(self.dictequations[0])
-        for rep in replacements:
-            comparerep = rep[1].subs(self.dictequations[0]).expand()
-            found = False
-            complexity = rep[1].count_ops()
-            maxcomplexity = 3 if N > 1000 else 2
-            if complexity > maxcomplexity: # check only long expressions
-                for i in range(N):
-                    if self.dictequations[1][i] is not None and comparerep-self.dictequations[1][i]==S.Zero:
-                        #self.dictequations.append((rep[0],self.dictequations[0][i][0],self.dictequations[1][i]))
-                        code.write('IkReal %s=%s;\n'%(rep[0],self.dictequations[0][i][0]))
-                        found = True
-                        break
-            else:
-                comparerep = None
-            if not found:
-                self.dictequations[0].append(rep)
-                self.dictequations[1].append(comparerep)
-                code2,sepcodelist2 = self._WriteExprCode(rep[1])
-                for sepcode in sepcodelist2:
-                    code.write(sepcode)
-                code.write('IkReal %s='%rep[0])
-                code.write(code2.getvalue())
-                code.write(';\n')
+        self._WriteReplacements(replacements,code)
         for i,rexpr in enumerate(reduced_exprs):
             code2,sepcodelist2 = self._WriteExprCode(rexpr)
             for sepcode in sepcodelist2:
@@ -1931,6 +1957,48 @@ IkReal r00 = 0, r11 = 0, r22 = 0;
             code.write(';\n')
         return code
 
+    def _WriteReplacements(self, replacements, code):
+        """writes the common subexpressions. If an equivalent expression has already been written in the current scope, then reuses its variable.
+        """
+        for rep in replacements:
+            comparerep = self._SubstituteEquations(rep[1]).expand()
+            if rep[1].count_ops() > 2: # check only long expressions
+                key = self._GetEquationKey(comparerep)
+                index = self.dictequations[2].get(key,None)
+                if index is not None:
+                    code.write('IkReal %s=%s;\n'%(rep[0],self.dictequations[0][index][0]))
+                    continue
+                self.dictequations[2][key] = len(self.dictequations[0])
+            else:
+                comparerep = None
+            self.dictequations[0].append(rep)
+            self.dictequations[1].append(comparerep)
+            code2,sepcodelist2 = self._WriteExprCode(rep[1])
+            for sepcode in sepcodelist2:
+                code.write(sepcode)
+            code.write('IkReal %s='%rep[0])
+            code.write(code2.getvalue())
+            code.write(';\n')
+
+    def _SubstituteEquations(self, expr):
+        """substitutes the written equations into expr in the order they were written. Same as expr.subs(self.dictequations[0]), except only the variables present in the expression are substituted.
+        """
+        freesymbols = expr.free_symbols
+        for var,value in self.dictequations[0]:
+            if var in freesymbols:
+                expr = expr.subs(var,value)
+                freesymbols = expr.free_symbols
+        return expr
+
+    @staticmethod
+    def _GetEquationKey(expr):
+        """returns a hashable canonical form of an expanded expression. sympy already sorts the arguments of commutative operations, so only the floating-point numbers are converted to rationals in order for 0.5*x and x/2 to match.
+        """
+        floats = expr.atoms(Float)
+        if len(floats) > 0:
+            expr = expr.subs([(f,Rational(f)) for f in floats])
+        return expr
+
     def _WriteExprCode(self, expr, code=None):
         # go through all arguments and chop them
         if code is None:
@@ -2452,6 +2520,252 @@ IkReal r00 = 0, r11 = 0, r22 = 0;
             self.functions[name] = fcode
         return name
 
+    def using_polyrootscompanion(self, deg):
+        """finds the real roots from the eigenvalues of the companion matrix. Slower than durandkerner for low degrees, but does not depend on the convergence of an iteration.
+        """
+        name = 'polyroots%d_companion'%deg
+        if not name in self.functions:
+            fcode = """static inline void %(name)s(IkReal rawcoeffs[%(deg)d+1], IkReal rawroots[%(deg)d], int& numroots)
+{
+    if( rawcoeffs[0] == 0 ) {
+        // solve with one reduced degree
+        %(reducedpolyroots)s(&rawcoeffs[1], &rawroots[0], numroots);
+        return;
+    }
+    const IkReal tolsqrt = sqrt(std::numeric_limits<IkReal>::epsilon());
+    // the eigenvalues of a multiple root split into complex pairs with imaginary parts up to the k-th root of the precision
+    const IkReal tolimag = sqrt(tolsqrt);
+    // companion matrix of the monic polynomial in column-major order
+    double IKFAST_ALIGNED16(A[%(deg)d*%(deg)d]) = {0};
+    for(int i = 0; i < %(deg)d; ++i) {
+        A[%(deg)d*i] = -rawcoeffs[i+1]/rawcoeffs[0];
+    }
+    for(int i = 1; i < %(deg)d; ++i) {
+        A[i+%(deg)d*(i-1)] = 1;
+    }
+    double wr[%(deg)d], wi[%(deg)d], vl[1], vr[1], work[4*%(deg)d];
+    const char jobv = 'N';
+    const int n = %(deg)d, lwork = 4*%(deg)d, one = 1;
+    int info = 0;
+    dgeev_(&jobv, &jobv, &n, A, &n, wr, wi, vl, &one, vr, &one, work, &lwork, &info);
+    if( info != 0 ) {
+        %(polyroots)s(rawcoeffs, rawroots, numroots);
+        return;
+    }
+    numroots = 0;
+    for(int i = 0; i < %(deg)d; ++i) {
+        IkReal x = wr[i];
+        if( IKabs(wi[i]) > tolimag*(1+IKabs(x)) ) {
+            continue;
+        }
+        // polish with newton iterations on the original polynomial
+        for(int step = 0; step < 3; ++step) {
+            IkReal p = rawcoeffs[0], dp = 0;
+            for(int j = 1; j <= %(deg)d; ++j) {
+                dp = dp*x + p;
+                p = p*x + rawcoeffs[j];
+            }
+            if( dp == 0 ) {
+                break;
+            }
+            IkReal dx = p/dp;
+            if( IKabs(dx) > tolsqrt*(1+IKabs(x)) ) {
+                break; // multiple root, newton would diverge
+            }
+            x -= dx;
+        }
+        // multiple roots show up as several close eigenvalues
+        bool bduplicate = false;
+        for(int j = 0; j < numroots; ++j) {
+            if( IKabs(rawroots[j]-x) < tolsqrt*(1+IKabs(x)) ) {
+                bduplicate = true;
+                break;
+            }
+        }
+        if( !bduplicate ) {
+            rawroots[numroots++] = x;
+        }
+    }
+    std::sort(rawroots, rawroots+numroots);
+}
+"""%{'name':name, 'deg':deg, 'reducedpolyroots':self.using_polyroots(deg-1), 'polyroots':self.using_polyroots(deg)}
+            self.functions[name] = fcode
+        return name
+
+    def using_polyrootssturm(self, deg):
+        """finds the real roots by isolating them with a Sturm sequence, complex roots are never computed.
+        """
+        name = 'polyroots%d_sturm'%deg
+        if not name in self.functions:
+            fcode = """static inline IkReal %(name)s_eval(const IkReal* coeffs, int deg, IkReal x)
+{
+    IkReal p = coeffs[0];
+    for(int j = 1; j <= deg; ++j) {
+        p = p*x + coeffs[j];
+    }
+    return p;
+}
+
+static inline int %(name)s_signchanges(const IkReal seq[%(deg)d+1][%(deg)d+1], const int* seqdeg, int numseq, IkReal x)
+{
+    int numchanges = 0;
+    IkReal prev = 0;
+    for(int k = 0; k < numseq; ++k) {
+        IkReal p = %(name)s_eval(seq[k], seqdeg[k], x);
+        if( p != 0 ) {
+            if( prev*p < 0 ) {
+                ++numchanges;
+            }
+            prev = p;
+        }
+    }
+    return numchanges;
+}
+
+static inline void %(name)s(IkReal rawcoeffs[%(deg)d+1], IkReal rawroots[%(deg)d], int& numroots)
+{
+    if( rawcoeffs[0] == 0 ) {
+        // solve with one reduced degree
+        %(reducedpolyroots)s(&rawcoeffs[1], &rawroots[0], numroots);
+        return;
+    }
+    const IkReal eps = std::numeric_limits<IkReal>::epsilon();
+    // sturm sequence p0 = p, p1 = p', pk = -rem(pk-2, pk-1), coefficients are stored from the highest degree
+    IkReal seq[%(deg)d+1][%(deg)d+1];
+    int seqdeg[%(deg)d+1];
+    IkReal bound = 0;
+    for(int i = 0; i <= %(deg)d; ++i) {
+        seq[0][i] = rawcoeffs[i]/rawcoeffs[0];
+        if( i > 0 ) {
+            bound = max(bound, IKabs(seq[0][i]));
+        }
+    }
+    bound += 1; // cauchy bound on the magnitude of the roots
+    seqdeg[0] = %(deg)d;
+    for(int i = 0; i < %(deg)d; ++i) {
+        seq[1][i] = (%(deg)d-i)*seq[0][i];
+    }
+    seqdeg[1] = %(deg)d-1;
+    int numseq = 2;
+    while(seqdeg[numseq-1] > 0) {
+        const IkReal* a = seq[numseq-2];
+        const IkReal* b = seq[numseq-1];
+        const int m = seqdeg[numseq-2], n = seqdeg[numseq-1];
+        IkReal r[%(deg)d+1];
+        IkReal norm = 0;
+        for(int i = 0; i <= m; ++i) {
+            r[i] = a[i];
+            norm = max(norm, IKabs(a[i]));
+        }
+        for(int i = 0; i <= m-n; ++i) {
+            IkReal q = r[i]/b[0];
+            for(int j = 0; j <= n; ++j) {
+                r[i+j] -= q*b[j];
+            }
+        }
+        // the remainder is r[m-n+1:m+1], drop the leading coefficients lost in round-off
+        int ioffset = m-n+1;
+        while(ioffset <= m && IKabs(r[ioffset]) <= 1000*eps*(1+norm)) {
+            ++ioffset;
+        }
+        if( ioffset > m ) {
+            break; // the remainder is zero, so the last polynomial is the gcd and the count of distinct roots is still exact
+        }
+        IkReal* c = seq[numseq];
+        for(int i = ioffset; i <= m; ++i) {
+            c[i-ioffset] = -r[i];
+        }
+        seqdeg[numseq] = m-ioffset;
+        ++numseq;
+    }
+
+    // bisect the roots apart
+    IkReal intervals[%(deg)d+1][2];
+    int intervalchanges[%(deg)d+1][2];
+    int numintervals = 1;
+    intervals[0][0] = -bound; intervals[0][1] = bound;
+    intervalchanges[0][0] = %(name)s_signchanges(seq, seqdeg, numseq, -bound);
+    intervalchanges[0][1] = %(name)s_signchanges(seq, seqdeg, numseq, bound);
+    numroots = 0;
+    while(numintervals > 0) {
+        --numintervals;
+        IkReal lo = intervals[numintervals][0], hi = intervals[numintervals][1];
+        int nlo = intervalchanges[numintervals][0], nhi = intervalchanges[numintervals][1];
+        int n = nlo-nhi;
+        if( n <= 0 ) {
+            continue;
+        }
+        IkReal tol = 16*eps*(1+max(IKabs(lo),IKabs(hi)));
+        if( n == 1 || hi-lo <= tol ) {
+            // one root in (lo,hi]
+            IkReal plo = %(name)s_eval(seq[0], %(deg)d, lo), phi = %(name)s_eval(seq[0], %(deg)d, hi);
+            IkReal x = 0.5*(lo+hi);
+            if( n == 1 && plo*phi < 0 ) {
+                // safeguarded newton, falls back to bisection when the step leaves the bracket
+                for(int step = 0; step < 100 && hi-lo > tol; ++step) {
+                    IkReal p = seq[0][0], dp = 0;
+                    for(int j = 1; j <= %(deg)d; ++j) {
+                        dp = dp*x + p;
+                        p = p*x + seq[0][j];
+                    }
+                    if( p == 0 ) {
+                        break;
+                    }
+                    if( (p < 0) == (plo < 0) ) {
+                        lo = x;
+                    }
+                    else {
+                        hi = x;
+                    }
+                    IkReal xnew = dp != 0 ? x - p/dp : lo-1;
+                    if( xnew <= lo || xnew >= hi ) {
+                        xnew = 0.5*(lo+hi);
+                    }
+                    else if( IKabs(xnew-x) <= tol ) {
+                        x = xnew;
+                        break;
+                    }
+                    x = xnew;
+                }
+            }
+            else {
+                // root of even multiplicity does not change the sign, so bisect on the sign changes
+                for(int step = 0; step < 200 && hi-lo > tol; ++step) {
+                    IkReal mid = 0.5*(lo+hi);
+                    int nmid = %(name)s_signchanges(seq, seqdeg, numseq, mid);
+                    if( nlo-nmid > 0 ) {
+                        hi = mid;
+                    }
+                    else {
+                        lo = mid;
+                        nlo = nmid;
+                    }
+                }
+                x = 0.5*(lo+hi);
+            }
+            rawroots[numroots++] = x;
+            continue;
+        }
+        IkReal mid = 0.5*(lo+hi);
+        int nmid = %(name)s_signchanges(seq, seqdeg, numseq, mid);
+        // only keep intervals with roots, so there are never more intervals than distinct roots
+        if( nlo > nmid ) {
+            intervals[numintervals][0] = lo; intervals[numintervals][1] = mid;
+            intervalchanges[numintervals][0] = nlo; intervalchanges[numintervals][1] = nmid;
+            ++numintervals;
+        }
+        if( nmid > nhi ) {
+            intervals[numintervals][0] = mid; intervals[numintervals][1] = hi;
+            intervalchanges[numintervals][0] = nmid; intervalchanges[numintervals][1] = nhi;
+            ++numintervals;
+        }
+    }
+    std::sort(rawroots, rawroots+numroots);
+}
+"""%{'name':name, 'deg':deg, 'reducedpolyroots':self.using_polyroots(deg-1)}
+            self.functions[name] = fcode
+        return name
+
     def using_checkconsistency12(self):
         name = 'checkconsistency12'
         if not name in self.functions:
@@ -15,6 +15,7 @@ __license__ = 'Apache License, Version 2.0'
 # python 2.5 raises 'import *' not allowed with 'from .'
 from ..openravepy_int import RaveCreateModule, RaveCreateTrajectory, matrixSerialization, IkParameterization
 from .. import PlanningError
+from .serialization import SerializeValues, SerializeIntegers, DeserializeValues, DeserializeLeadingValues
     
 import numpy
 from copy import copy as shallowcopy
@@ -134,17 +135,11 @@ class BaseManipulation:
         """
         cmd += ' '
         if goal is not None:
-            cmd += 'goal ' + ' '.join('%.15e'%f for f in goal) + ' '
+            cmd += 'goal ' + SerializeValues(goal) + ' '
         if goals is not None:
-            cmd += 'goals %d '%len(goals)
-            for g in goals:
-                for f in g:
-                    cmd += '%.15e '%f
+            cmd += 'goals %d %s '%(len(goals),SerializeValues(goals))
         if initialconfigs is not None:
-            cmd += 'initialconfigs %d '%len(initialconfigs)
-            for g in initialconfigs:
-                for f in g:
-                    cmd += '%.15e '%f
+            cmd += 'initialconfigs %d %s '%(len(initialconfigs),SerializeValues(initialconfigs))
         if steplength is not None:
             cmd += 'steplength %.15e '%steplength
         if execute is not None:
@@ -183,10 +178,7 @@ class BaseManipulation:
             for m in matrices:
                 cmd += matrixSerialization(m) + ' '
         if initialconfigs is not None:
-            cmd += 'initialconfigs %d '%len(initialconfigs)
-            for g in initialconfigs:
-                for f in g:
-                    cmd += '%.15e '%f
+            cmd += 'initialconfigs %d %s '%(len(initialconfigs),SerializeValues(initialconfigs))
         if maxiter is not None:
             cmd += 'maxiter %d '%maxiter
         if maxtries is not None:
@@ -247,7 +239,7 @@ class BaseManipulation:
         """See :ref:`module-basemanipulation-moveunsyncjoints`
         """
         assert(len(jointinds)==len(jointvalues) and len(jointinds)>0)
-        cmd = 'MoveUnsyncJoints handjoints %d %s %s '%(len(jointinds),' '.join('%.15e'%f for f in jointvalues), ' '.join(str(f) for f in jointinds))
+        cmd = 'MoveUnsyncJoints handjoints %d %s %s '%(len(jointinds),SerializeValues(jointvalues),SerializeIntegers(jointinds))
         if planner is not None:
             cmd += 'planner %s '%planner
         if execute is not None:
@@ -283,14 +275,13 @@ class BaseManipulation:
         res = self.prob.SendCommand(cmd)
         if res is None:
             raise PlanningError('JitterActive')
-        resvalues = res.split()
         if outputfinal:
-            final = numpy.array([numpy.float64(resvalues[i]) for i in range(self.robot.GetActiveDOF())])
-            resvalues=resvalues[len(final):]
+            # the final values are followed by the serialized trajectory
+            final,res = DeserializeLeadingValues(res,self.robot.GetActiveDOF())
         else:
             final=None
         if (outputtraj is not None and outputtraj) or (outputtrajobj is not None and outputtrajobj):
-            traj = ' '.join(resvalues)
+            traj = res
         else:
             traj = None
         if traj is not None and outputtrajobj is not None and outputtrajobj:
@@ -304,7 +295,7 @@ class BaseManipulation:
         """
         cmd = 'FindIKWithFilters ikparam %s '%str(ikparam)
         if cone is not None:
-            cmd += 'cone %s '%(' '.join('%.15e'%f for f in cone))
+            cmd += 'cone %s '%SerializeValues(cone)
         if solveall is not None and solveall:
             cmd += 'solveall '
         if filteroptions is not None:
@@ -312,8 +303,8 @@ class BaseManipulation:
         res = self.prob.SendCommand(cmd)
         if res is None:
             raise PlanningError('FindIKWithFilters')
-        resvalues = res.split()
+        resvalues = DeserializeValues(res)
         num = int(resvalues[0])
         dim = (len(resvalues)-1)/num
-        solutions = numpy.reshape([numpy.float64(s) for s in resvalues[1:]],(num,dim))
+        solutions = numpy.reshape(resvalues[1:],(num,dim))
         return solutions
@@ -15,6 +15,7 @@ __license__ = 'Apache License, Version 2.0'
 # python 2.5 raises 'import *' not allowed with 'from .'
 from ..openravepy_int import RaveCreateModule, RaveCreateTrajectory, matrixSerialization, matrixFromPose
 from .. import PlanningError
+from .serialization import SerializeValues, SerializeIntegers, DeserializeValues
 
 from numpy import *
 from copy import copy as shallowcopy
@@ -86,37 +87,34 @@ class Grasper:
         if vintersectplane is not None:
             cmd += 'vintersectplane %.15e %.15e %.15e %.15e '%(vintersectplane[0], vintersectplane[1], vintersectplane[2], vintersectplane[3])
         if chuckingdirection is not None:
-            cmd += 'chuckingdirection '
-            for value in chuckingdirection:
-                cmd += '%.15e '%value
+            cmd += 'chuckingdirection %s '%SerializeValues(chuckingdirection)
         if execute is not None:
             cmd += 'execute %d '%execute
         if ordereddofindices is not None:
-            cmd += 'ordereddofindices '
-            for value in ordereddofindices:
-                cmd += '%d '%value
+            cmd += 'ordereddofindices %s '%SerializeIntegers(ordereddofindices)
         if avoidcontact:
             cmd += 'avoidcontact '
         res = self.prob.SendCommand(cmd)
         if res is None:
             raise PlanningError('Grasp failed')
-        resvalues = res.split()
+        resvalues = DeserializeValues(res)
         mindist = None
         volume = None
         contacts = None
         finalconfig = None
+        # the optional values are at the end, so peel them off backwards
+        offset = len(resvalues)
         if forceclosure:
-            volume = float64(resvalues.pop())
-            mindist = float64(resvalues.pop())
+            mindist = resvalues[offset-2]
+            volume = resvalues[offset-1]
+            offset -= 2
         if outputfinal:
-            jointvalues = []
-            for i in range(self.robot.GetDOF()):
-                jointvalues.insert(0,float64(resvalues.pop()))
-            pose = []
-            for i in range(7):
-                pose.insert(0,float64(resvalues.pop()))
+            dof = self.robot.GetDOF()
+            jointvalues = resvalues[(offset-dof):offset]
+            pose = resvalues[(offset-dof-7):(offset-dof)]
+            offset -= dof+7
             finalconfig = (array(jointvalues),matrixFromPose(pose))
-        contacts = reshape(array([float64(s) for s in resvalues],float64),(len(resvalues)/6,6))
+        contacts = reshape(resvalues[0:offset],(offset/6,6))
         return contacts,finalconfig,mindist,volume
 
     def GraspThreaded(self,approachrays,standoffs,preshapes,rolls,manipulatordirections=None,target=None,transformrobot=True,onlycontacttarget=True,tightgrasp=False,graspingnoise=None,forceclosurethreshold=None,collisionchecker=None,translationstepmult=None,numthreads=None,startindex=None,maxgrasps=None,finestep=None):
@@ -142,50 +140,77 @@ class Grasper:
             cmd += 'finestep %.15e '%finestep
         if numthreads is not None:
             cmd += 'numthreads %d '%numthreads
-        cmd += 'approachrays %d '%len(approachrays)
-        for f in approachrays.flat:
-            cmd += str(f) + ' '
-        cmd += 'rolls %d '%len(rolls)
-        for f in rolls.flat:
-            cmd += str(f) + ' '
-        cmd += 'standoffs %d '%len(standoffs)
-        for f in standoffs.flat:
-            cmd += str(f) + ' '
-        cmd += 'preshapes %d '%len(preshapes)
-        for f in preshapes.flat:
-            cmd += str(f) + ' '
-        cmd += 'manipulatordirections %d '%len(manipulatordirections)
-        for f in manipulatordirections.flat:
-            cmd += str(f) + ' '
-        res = self.prob.SendCommand(cmd)
+        cmdparts = [cmd]
+        for name,values in [('approachrays',approachrays),('rolls',rolls),('standoffs',standoffs),('preshapes',preshapes),('manipulatordirections',manipulatordirections)]:
+            cmdparts.append('%s %d %s '%(name,len(values),SerializeValues(values)))
+        res = self.prob.SendCommand(''.join(cmdparts))
         if res is None:
             raise PlanningError('Grasp failed')
-        resultgrasps = res.split()
+        # parse all the numbers at once and walk a cursor through them
+        resultgrasps = DeserializeValues(res)
         resvalues=[]
-        nextid = int(resultgrasps.pop(0))
+        nextid = int(resultgrasps[0])
+        numgrasps = int(resultgrasps[1])
+        offset = 2
         preshapelen = len(self.robot.GetActiveManipulator().GetGripperIndices())
-        for i in range(int(resultgrasps.pop(0))):
-            position = array([float64(resultgrasps.pop(0)) for i in range(3)])
-            direction = array([float64(resultgrasps.pop(0)) for i in range(3)])
-            roll = float64(resultgrasps.pop(0))
-            standoff = float64(resultgrasps.pop(0))
-            manipulatordirection = array([float64(resultgrasps.pop(0)) for i in range(3)])
-            mindist = float64(resultgrasps.pop(0))
-            volume = float64(resultgrasps.pop(0))
-            preshape = [float64(resultgrasps.pop(0)) for i in range(preshapelen)]
-            Tfinal = matrixFromPose([float64(resultgrasps.pop(0)) for i in range(7)])
-            finalshape = array([float64(resultgrasps.pop(0)) for i in range(self.robot.GetDOF())])
-            contacts_num=int(resultgrasps.pop(0))
-            contacts=[float64(resultgrasps.pop(0)) for i in range(contacts_num*6)]
-            contacts = reshape(contacts,(contacts_num,6))
+        dof = self.robot.GetDOF()
+        for i in range(numgrasps):
+            position = resultgrasps[offset:(offset+3)]; offset += 3
+            direction = resultgrasps[offset:(offset+3)]; offset += 3
+            roll = resultgrasps[offset]; offset += 1
+            standoff = resultgrasps[offset]; offset += 1
+            manipulatordirection = resultgrasps[offset:(offset+3)]; offset += 3
+            mindist = resultgrasps[offset]; offset += 1
+            volume = resultgrasps[offset]; offset += 1
+            preshape = list(resultgrasps[offset:(offset+preshapelen)]); offset += preshapelen
+            Tfinal = matrixFromPose(resultgrasps[offset:(offset+7)]); offset += 7
+            finalshape = resultgrasps[offset:(offset+dof)]; offset += dof
+            contacts_num = int(resultgrasps[offset]); offset += 1
+            contacts = reshape(resultgrasps[offset:(offset+contacts_num*6)],(contacts_num,6)); offset += contacts_num*6
             resvalues.append([position, direction, roll, standoff, manipulatordirection, mindist, volume, preshape,Tfinal,finalshape,contacts])
+        if offset != len(resultgrasps):
+            raise PlanningError('GraspThreaded returned %d values, but parsed %d'%(len(resultgrasps),offset))
         return nextid, resvalues
 
+    def iterGraspThreadedPages(self,approachrays,standoffs,preshapes,rolls,manipulatordirections=None,startindex=None,pagesize=None,**kwargs):
+        """Generator that calls :meth:`GraspThreaded` one page at a time and yields (nextindex, resultgrasps) after every call.
+
+        The grasp space is processed in pages of at most pagesize successful grasps using the startindex/maxgrasps arguments of :meth:`GraspThreaded`. Each page is only requested when the next value is asked for, so callers can hold the environment lock or change the robot state around every page.
+
+        :param pagesize: maximum number of successful grasps to return per call to the plugin. If None, will use 4*numthreads. If 0, the whole grasp space is processed in one call. Every page resends the whole command and restarts the grasper threads.
+        :param kwargs: extra parameters passed to :meth:`GraspThreaded`
+        """
+        numdirections = len(manipulatordirections) if manipulatordirections is not None else 1
+        numgrasps = len(approachrays)*len(rolls)*len(preshapes)*len(standoffs)*numdirections
+        if pagesize is None:
+            numthreads = kwargs.get('numthreads',None)
+            pagesize = 4*(numthreads if numthreads is not None and numthreads > 0 else 1)
+        nextid = startindex if startindex is not None else 0
+        while nextid < numgrasps:
+            if pagesize > 0:
+                nextid, resultgrasps = self.GraspThreaded(approachrays=approachrays,standoffs=standoffs,preshapes=preshapes,rolls=rolls,manipulatordirections=manipulatordirections,startindex=nextid,maxgrasps=pagesize,**kwargs)
+            else:
+                resultgrasps = self.GraspThreaded(approachrays=approachrays,standoffs=standoffs,preshapes=preshapes,rolls=rolls,manipulatordirections=manipulatordirections,startindex=startindex,**kwargs)[1]
+                nextid = numgrasps
+            yield nextid, resultgrasps
+
+    def iterGraspThreaded(self,approachrays,standoffs,preshapes,rolls,manipulatordirections=None,startindex=None,pagesize=None,**kwargs):
+        """Generator version of :meth:`GraspThreaded` that yields each successful grasp as soon as the page containing it is finished.
+
+        The pages are requested with :meth:`iterGraspThreadedPages`, so the caller can consume the first results without waiting for the whole space to be tested. Each yielded value has the same format as an entry of the grasps returned by :meth:`GraspThreaded`.
+
+        :param pagesize: maximum number of successful grasps to return per call to the plugin. If None, will use 4*numthreads. Every page resends the whole command and restarts the grasper threads, so use :meth:`GraspThreaded` directly when all the grasps are needed at once.
+        :param kwargs: extra parameters passed to :meth:`GraspThreaded`
+        """
+        for nextid, resultgrasps in self.iterGraspThreadedPages(approachrays,standoffs,preshapes,rolls,manipulatordirections=manipulatordirections,startindex=startindex,pagesize=pagesize,**kwargs):
+            for resultgrasp in resultgrasps:
+                yield resultgrasp
+
     def ConvexHull(self,points,returnplanes=True,returnfaces=True,returntriangles=True):
         """See :ref:`module-grasper-convexhull`
         """
         dim = len(points[0])
-        cmd = 'ConvexHull points %d %d '%(len(points),dim) + ' '.join(str(f) for f in points.flat) + ' '
+        cmd = 'ConvexHull points %d %d '%(len(points),dim) + SerializeValues(points) + ' '
         if returnplanes is not None:
             cmd += 'returnplanes %d '%returnplanes
         if returnfaces is not None:
@@ -195,20 +220,23 @@ class Grasper:
         res = self.prob.SendCommand(cmd)
         if res is None:
             raise PlanningError('ConvexHull')
-        resvalues = res.split()
+        resvalues = DeserializeValues(res)
+        offset = 0
         planes = None
         faces = None
         triangles = None
         if returnplanes:
-            numplanes = int(resvalues.pop(0))
-            planes = reshape(array([float64(resvalues.pop(0)) for i in range((dim+1)*numplanes)],float64),(numplanes,dim+1))
+            numplanes = int(resvalues[offset]); offset += 1
+            planes = reshape(resvalues[offset:(offset+(dim+1)*numplanes)],(numplanes,dim+1))
+            offset += (dim+1)*numplanes
         if returnfaces:
-            numfaces = int(resvalues.pop(0))
+            numfaces = int(resvalues[offset]); offset += 1
             faces = []
             for i in range(numfaces):
-                numvertices = int(resvalues.pop(0))
-                faces.append(array([int(resvalues.pop(0)) for i in range(numvertices)],int))
+                numvertices = int(resvalues[offset]); offset += 1
+                faces.append(array(resvalues[offset:(offset+numvertices)],int))
+                offset += numvertices
         if returntriangles:
-            numtriangles = int(resvalues.pop(0))
-            triangles = reshape(array([int(resvalues.pop(0)) for i in range(3*numtriangles)],int),(numtriangles,3))
+            numtriangles = int(resvalues[offset]); offset += 1
+            triangles = reshape(array(resvalues[offset:(offset+3*numtriangles)],int),(numtriangles,3))
         return planes,faces,triangles
@@ -15,6 +15,7 @@ __license__ = 'Apache License, Version 2.0'
 # python 2.5 raises 'import *' not allowed with 'from .'
 from ..openravepy_int import RaveCreateModule, RaveCreateTrajectory, matrixSerialization, IkParameterization, IkParameterization, poseSerialization
 from .. import PlanningError
+from .serialization import SerializeValues, SerializeIntegers, DeserializeValues, DeserializeLeadingValues
 
 from numpy import *
 from copy import copy as shallowcopy
@@ -84,8 +85,8 @@ class TaskManipulation:
                 graspfinestep=gmodel.finestep
         cmd = cStringIO.StringIO()
         cmd.write('graspplanning target %s approachoffset %.15e grasps %d %d '%(target.GetName(),approachoffset, grasps.shape[0],grasps.shape[1]))
-        for f in grasps.flat:
-            cmd.write('%.15e '%f)
+        cmd.write(SerializeValues(grasps))
+        cmd.write(' ')
         for name,valuerange in graspindices.iteritems():
             if name[0] == 'i' and len(valuerange) > 0 or name == 'grasptrans_nocol':
                 cmd.write(name)
@@ -150,7 +151,7 @@ class TaskManipulation:
     def EvaluateConstraints(self,freedoms,configs,targetframematrix=None,targetframepose=None,errorthresh=None):
         """See :ref:`module-taskmanipulation-evaluateconstraints`
         """
-        cmd = 'EvaluateConstraints constraintfreedoms %s '%(' '.join(str(f) for f in freedoms))
+        cmd = 'EvaluateConstraints constraintfreedoms %s '%SerializeIntegers(freedoms)
         if targetframematrix is not None:
             cmd += 'constraintmatrix %s '%matrixSerialization(targetframematrix)
         if targetframepose is not None:
@@ -158,11 +159,11 @@ class TaskManipulation:
         if errorthresh is not None:
             cmd += 'constrainterrorthresh %.15e '%errorthresh
         for config in configs:
-            cmd += 'config %s '%(' '.join(str(f) for f in config))
+            cmd += 'config %s '%SerializeValues(config)
         res = self.prob.SendCommand(cmd)
-        resvalues = res.split()
-        iters = array([int(s) for s in resvalues[0:len(configs)]])
-        newconfigs = reshape(array([float64(s) for s in resvalues[len(configs):]]),(len(configs),self.robot.GetActiveDOF()))
+        resvalues = DeserializeValues(res)
+        iters = array(resvalues[0:len(configs)],int)
+        newconfigs = reshape(resvalues[len(configs):],(len(configs),self.robot.GetActiveDOF()))
         return iters,newconfigs
     
     def ChuckFingers(self,offset=None,movingdir=None,execute=None,outputtraj=None,outputfinal=None,coarsestep=None,translationstepmult=None,finestep=None,outputtrajobj=None):
@@ -172,10 +173,10 @@ class TaskManipulation:
         dof=len(self.robot.GetActiveManipulator().GetGripperIndices())
         if offset is not None:
             assert(len(offset) == dof)
-            cmd += 'offset ' + ' '.join(str(f) for f in offset) + ' '
+            cmd += 'offset ' + SerializeValues(offset) + ' '
         if movingdir is not None:
             assert(len(movingdir) == dof)
-            cmd += 'movingdir %s '%(' '.join(str(f) for f in movingdir))
+            cmd += 'movingdir %s '%SerializeValues(movingdir)
         if execute is not None:
             cmd += 'execute %d '%execute
         if coarsestep is not None:
@@ -193,9 +194,7 @@ class TaskManipulation:
             raise PlanningError('CloseFingers')
         resvalues = res
         if outputfinal:
-            resvaluesSplit = resvalues.split()
-            final = array([float64(resvaluesSplit[i]) for i in range(dof)])
-            resvalues = resvalues[sum(len(resvaluesSplit[i])+1 for i in range(dof)):]
+            final,resvalues = DeserializeLeadingValues(resvalues,dof)
         else:
             final=None
         if (outputtraj is not None and outputtraj) or (outputtrajobj is not None and outputtrajobj):
@@ -220,7 +219,7 @@ class TaskManipulation:
             cmd += 'target %s '%target.GetName()
         if movingdir is not None:
             assert(len(movingdir) == dof)
-            cmd += 'movingdir %s '%(' '.join(str(f) for f in movingdir))
+            cmd += 'movingdir %s '%SerializeValues(movingdir)
         if execute is not None:
             cmd += 'execute %d '%execute
         if (outputtraj is not None and outputtraj) or (outputtrajobj is not None and outputtrajobj):
@@ -238,9 +237,7 @@ class TaskManipulation:
             raise PlanningError('ReleaseFingers')
         resvalues = res
         if outputfinal:
-            resvaluesSplit = resvalues.split()
-            final = array([float64(resvaluesSplit[i]) for i in range(dof)])
-            resvalues = resvalues[sum(len(resvaluesSplit[i])+1 for i in range(dof)):]
+            final,resvalues = DeserializeLeadingValues(resvalues,dof)
         else:
             final=None
         if (outputtraj is not None and outputtraj) or (outputtrajobj is not None and outputtrajobj):
@@ -262,7 +259,7 @@ class TaskManipulation:
         cmd = 'ReleaseActive '
         if movingdir is not None:
             assert(len(movingdir) == self.robot.GetActiveDOF())
-            cmd += 'movingdir %s '%(' '.join(str(f) for f in movingdir))
+            cmd += 'movingdir %s '%SerializeValues(movingdir)
         if execute is not None:
             cmd += 'execute %d '%execute
         if (outputtraj is not None and outputtraj) or (outputtrajobj is not None and outputtrajobj):
@@ -278,9 +275,7 @@ class TaskManipulation:
             raise PlanningError('ReleaseActive')
         resvalues = res
         if outputfinal:
-            resvaluesSplit = resvalues.split()
-            final = array([float64(resvaluesSplit[i]) for i in range(self.robot.GetActiveDOF())])
-            resvalues = resvalues[sum(len(resvaluesSplit[i])+1 for i in range(self.robot.GetActiveDOF())):]
+            final,resvalues = DeserializeLeadingValues(resvalues,self.robot.GetActiveDOF())
         else:
             final=None
         if (outputtraj is not None and outputtraj) or (outputtrajobj is not None and outputtrajobj):
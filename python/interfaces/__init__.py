@@ -1,6 +1,5 @@
 """Interface bindings
 """
-from .BaseManipulation import BaseManipulation
-from .Grasper import Grasper
-from .TaskManipulation import TaskManipulation
-from .visualfeedback import VisualFeedback
+# the interface modules are imported when first used, see lazyimport
+from ..lazyimport import InstallLazySubmodules
+InstallLazySubmodules(__name__, ['serialization'], {'BaseManipulation':'BaseManipulation', 'Grasper':'Grasper', 'TaskManipulation':'TaskManipulation', 'VisualFeedback':'visualfeedback'})
@@ -0,0 +1,49 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Bulk conversion of numeric arrays to and from the text used by the module SendCommand protocols.
+
+The encoders format a whole array with a single string operation instead of concatenating one value at a time, and the decoders parse the full reply with numpy.fromstring.
+"""
+__author__ = 'Rosen Diankov'
+__copyright__ = 'Copyright (C) 2009-2011 Rosen Diankov <rosen.diankov@gmail.com>'
+__license__ = 'Apache License, Version 2.0'
+
+import numpy
+
+def SerializeValues(values,format='%.15e'):
+    """returns all the values of an array (of any shape) as one space separated string.
+
+    :param format: the format of each value, the default keeps full double precision
+    """
+    values = numpy.ravel(values)
+    if len(values) == 0:
+        return ''
+    return ' '.join([format]*len(values))%tuple(values.tolist())
+
+def SerializeIntegers(values):
+    """returns all the values of an integer array as one space separated string
+    """
+    return SerializeValues(numpy.asarray(values,numpy.int64),'%d')
+
+def DeserializeValues(data,dtype=numpy.float64):
+    """parses a space separated string of numbers into a flat array.
+
+    Parsing stops at the first token that is not a number, so callers should check the number of returned values against the layout they expect.
+    """
+    return numpy.fromstring(data,dtype=dtype,sep=' ')
+
+def DeserializeLeadingValues(data,num,dtype=numpy.float64):
+    """parses the first num values of a reply that continues with non numeric data, like the final configuration followed by a serialized trajectory.
+
+    :return: (values, the rest of data after the values)
+    """
+    tokens = data.split(None,num)
+    return DeserializeValues(' '.join(tokens[0:num]),dtype), tokens[num] if len(tokens) > num else ''
@@ -15,6 +15,7 @@ __license__ = 'Apache License, Version 2.0'
 # python 2.5 raises 'import *' not allowed with 'from .
 from ..openravepy_int import RaveCreateModule, RaveCreateTrajectory, matrixSerialization, IkParameterization
 from .. import PlanningError
+from .serialization import SerializeValues, DeserializeValues
 
 import numpy
 from copy import copy as shallowcopy
@@ -74,9 +75,7 @@ class VisualFeedback:
         if raydensity is not None:
             cmd += 'raydensity %.15e '%raydensity
         if convexdata is not None:
-            cmd += 'convexdata %d '%len(convexdata)
-            for f in numpy.reshape(convexdata,len(convexdata)*2):
-                cmd += str(f) + ' '
+            cmd += 'convexdata %d %s '%(len(convexdata),SerializeValues(convexdata))
         res = self.prob.SendCommand(cmd)
         if res is None:
             raise PlanningError()
@@ -88,31 +87,23 @@ class VisualFeedback:
         if numrolls is not None:
             cmd += 'numrolls %d '%numrolls
         if transforms is not None:
-            cmd += 'transforms %d '%len(transforms)
-            for f in numpy.reshape(transforms,len(transforms)*7):
-                cmd += str(f) + ' '
+            cmd += 'transforms %d %s '%(len(transforms),SerializeValues(transforms))
         if extents is not None:
-            cmd += 'extents %d '%len(extents)
-            for f in numpy.reshape(extents,len(extents)*3):
-                cmd += str(f) + ' '
+            cmd += 'extents %d %s '%(len(extents),SerializeValues(extents))
         if sphere is not None:
-            cmd += 'sphere %d %d ' % (sphere[0], len(sphere) - 1)
-            for s in sphere[1:]:
-                cmd += '%.15e ' % s
+            cmd += 'sphere %d %d %s ' % (sphere[0], len(sphere) - 1, SerializeValues(sphere[1:]))
         if conedirangles is not None:
             for conedirangle in conedirangles:
                 cmd += 'conedirangle %.15e %.15e %.15e '%(conedirangle[0],conedirangle[1],conedirangle[2])
         res = self.prob.SendCommand(cmd)
         if res is None:
             raise PlanningError()
-        visibilitytransforms = numpy.array([numpy.float(s) for s in res.split()],numpy.float)
+        visibilitytransforms = DeserializeValues(res)
         return numpy.reshape(visibilitytransforms,(len(visibilitytransforms)/7,7))
     def SetCameraTransforms(self,transforms,mindist=None):
         """See :ref:`module-visualfeedback-setcameratransforms`
         """
-        cmd = 'SetCameraTransforms transforms %d '%len(transforms)
-        for f in numpy.reshape(transforms,len(transforms)*7):
-            cmd += str(f) + ' '
+        cmd = 'SetCameraTransforms transforms %d %s '%(len(transforms),SerializeValues(transforms))
         if mindist is not None:
             cmd += 'mindist %.15e '%(mindist)
         res = self.prob.SendCommand(cmd)
@@ -133,9 +124,7 @@ class VisualFeedback:
         """See :ref:`module-visualfeedback-computevisibleconfiguration`
         """
         cmd = 'ComputeVisibleConfiguration '
-        cmd += 'pose '
-        for i in range(7):
-            cmd += str(pose[i]) + ' '
+        cmd += 'pose %s '%SerializeValues(pose[0:7])
         res = self.prob.SendCommand(cmd)
         log.info('result of compute visible conf: %s' % res)
         if res is None:
@@ -151,9 +140,9 @@ class VisualFeedback:
         res = self.prob.SendCommand(cmd)
         if res is None:
             raise PlanningError()
-        samples = [float(s) for s in res.split()]
+        samples = DeserializeValues(res)
         returnedsamples = int(samples[0])
-        return numpy.reshape(numpy.array(samples[1:],float),(returnedsamples,(len(samples)-1)/returnedsamples))
+        return numpy.reshape(samples[1:],(returnedsamples,(len(samples)-1)/returnedsamples))
     def MoveToObserveTarget(self,affinedofs=None,smoothpath=None,planner=None,sampleprob=None,maxiter=None,execute=None,outputtraj=None):
         """See :ref:`module-visualfeedback-movetoobservetarget`
         """
@@ -181,9 +170,7 @@ class VisualFeedback:
         """
         cmd = 'VisualFeedbackGrasping '
         if graspset is not None:
-            cmd += 'graspset %d '%len(graspset)
-            for f in numpy.reshape(graspset,numpy.size(graspset)):
-                cmd += str(f) + ' '
+            cmd += 'graspset %d %s '%(len(graspset),SerializeValues(graspset))
         if usevisibility is not None:
             cmd += 'usevisibility %d '%usevisibility
         if planner is not None:
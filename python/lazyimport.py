@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2009-2011 Rosen Diankov <rosen.diankov@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Lazy loading of the submodules of the openravepy packages.
+
+The databases, interfaces and examples packages list their submodules instead of importing them, so that importing openravepy does not pay for numpy/scipy/h5py heavy modules that are never used. A submodule is imported the first time it is accessed as an attribute of its package, ``openravepy.databases.inversekinematics`` keeps working right after ``import openravepy``.
+
+Set the environment variable OPENRAVE_LAZYIMPORT=0 to import all submodules when their package is imported.
+"""
+from __future__ import with_statement # for python 2.5
+import os, sys, types
+
+def IsLazyImportEnabled():
+    return os.environ.get('OPENRAVE_LAZYIMPORT','1') != '0'
+
+class LazyModule(types.ModuleType):
+    """Package module that imports its submodules on first attribute access.
+    """
+    def __init__(self, module, lazyattributes):
+        """
+        :param module: the package module being replaced, its contents are copied
+        :param lazyattributes: dictionary of attribute name -> (submodule name, attribute name in the submodule). If the attribute name is None, the attribute is the submodule itself.
+        """
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        self.__dict__['__lazyattributes__'] = lazyattributes
+        # python 2 clears the globals of a module when it is deleted, and the functions defined in the package still use them
+        self.__dict__['__lazymodule__'] = module
+
+    def __getattribute__(self, name):
+        value = types.ModuleType.__getattribute__(self, name)
+        if isinstance(value, types.ModuleType):
+            # importing a submodule directly stores it in the package __dict__, even if its name is an attribute of the submodule like Grasper.Grasper
+            lazyattribute = types.ModuleType.__getattribute__(self, '__dict__')['__lazyattributes__'].get(name, None)
+            if lazyattribute is not None and lazyattribute[1] is not None:
+                value = getattr(value, lazyattribute[1])
+                self.__dict__[name] = value
+        return value
+
+    def __getattr__(self, name):
+        # only called when the attribute is not in __dict__
+        lazyattribute = self.__dict__['__lazyattributes__'].get(name, None)
+        if lazyattribute is None:
+            raise AttributeError(u'module %s has no attribute %s'%(self.__name__, name))
+        submodulename, attributename = lazyattribute
+        # importlib needs python 2.7
+        fullname = self.__name__+'.'+submodulename
+        __import__(fullname)
+        submodule = sys.modules[fullname]
+        value = submodule if attributename is None else getattr(submodule, attributename)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__.keys()).union(self.__dict__['__lazyattributes__'].keys()))
+
+def InstallLazySubmodules(modulename, submodules=(), attributes=None, optionalsubmodules=()):
+    """Replaces the package module in sys.modules with a :class:`LazyModule`. Has to be called at the end of the package __init__.
+
+    :param submodules: the names of the submodules that become attributes of the package when first accessed
+    :param attributes: dictionary of attribute name -> submodule name for attributes that are imported from a submodule with the same name, like ``from .Grasper import Grasper``
+    :param optionalsubmodules: submodules with optional dependencies, their import errors are ignored when lazy importing is disabled
+    :return: the new module
+    """
+    module = sys.modules[modulename]
+    lazyattributes = dict([(name, (name, None)) for name in submodules])
+    if attributes is not None:
+        for name, submodulename in attributes.iteritems():
+            lazyattributes[name] = (submodulename, name)
+    lazymodule = LazyModule(module, lazyattributes)
+    # "from package import *" has to import the submodules too
+    lazymodule.__all__ = sorted(set([name for name in module.__dict__.keys() if not name.startswith('_')]).union(lazyattributes.keys()))
+    sys.modules[modulename] = lazymodule
+    if not IsLazyImportEnabled():
+        for name in sorted(lazyattributes.keys()):
+            try:
+                getattr(lazymodule, name)
+            except ImportError:
+                if not lazyattributes[name][0] in optionalsubmodules:
+                    raise
+    return lazymodule
@@ -1,18 +1,35 @@
 import os, weakref, inspect
 
+# instance tracking lets reloading a class update its existing instances, it is off by default since it costs a weakref per instance. set OPENRAVE_TRACKINSTANCES=1 when developing with reload()
+_trackinstances = os.environ.get('OPENRAVE_TRACKINSTANCES','0') != '0'
+
+def SetInstanceTracking(enabled):
+    """Enables or disables tracking the instances of :class:`InstanceTracker` classes. Instances created while tracking is disabled are never tracked."""
+    global _trackinstances
+    _trackinstances = bool(enabled)
+
+def IsInstanceTracking():
+    return _trackinstances
+
+def _TrackInstance(cls, instance):
+    """adds a weak reference of instance to cls.__instance_refs__, the reference removes itself when the instance is deleted so the dictionary only holds live instances. keyed by id since the instances do not have to be hashable"""
+    refs = cls.__instance_refs__
+    key = id(instance)
+    def _remove(ref, refs=refs, key=key):
+        if refs.get(key) is ref:
+            del refs[key]
+    refs[key] = weakref.ref(instance, _remove)
+
 class MetaInstanceTracker(type):
     def __init__(cls, name, bases, ns):
         super(MetaInstanceTracker, cls).__init__(name, bases, ns)
-        cls.__instance_refs__ = []
+        cls.__instance_refs__ = {}
     def __instances__(cls):
         instances = []
-        validrefs = []
-        for ref in cls.__instance_refs__:
+        for ref in cls.__instance_refs__.values():
             instance = ref()
             if instance is not None:
                 instances.append(instance)
-                validrefs.append(ref)
-        cls.__instance_refs__ = validrefs
         return instances
 
 class InstanceTracker(object):
@@ -21,7 +38,8 @@ class InstanceTracker(object):
         cls = args[0]
         # deprecation due to python 2.6 cannot specifying arguments
         self = super(InstanceTracker, cls).__new__(cls)#*args, **kwargs)
-        cls.__instance_refs__.append(weakref.ref(self))
+        if _trackinstances:
+            _TrackInstance(cls, self)
         return self
 
     def __reduce_ex__(self, proto):
@@ -36,7 +54,8 @@ class MetaAutoReloader(MetaInstanceTracker):
                 old_class = d[name]
                 for instance in old_class.__instances__():
                     instance.change_class(cls)
-                    cls.__instance_refs__.append(weakref.ref(instance))
+                    _TrackInstance(cls, instance)
+                old_class.__instance_refs__.clear()
 
                 for subcls in old_class.__subclasses__():
                     newbases = []
@@ -19,6 +19,8 @@ import os.path
 from sys import platform as sysplatformname
 from sys import stdout
 import numpy
+import heapq
+import time
 try:
     from itertools import izip
 except ImportError:
@@ -446,24 +448,126 @@ def ComputeCylinderYMesh(radius,height,angledelta=0.1):
         iprev = i
     return vertices,numpy.array(indices)
 
-def TSP(solutions,distfn=None):
+def TSP(solutions,distfn=None,weights=None,timelimit=1.0):
     """solution to travelling salesman problem. orders the set of solutions such that visiting them one after another is fast.
+
+    The first solution always stays first. By default the metric is the weighted squared distance sum(weights*(x-y)**2) and is computed in bulk: a greedy nearest-neighbor ordering is built with a KD-tree (if scipy is present) and then improved with 2-opt and Or-opt moves until no move improves the ordering or timelimit is reached.
+
+    :param distfn: a python function computing the distance between two solutions. If specified, the slow O(n^2) greedy ordering is used and weights/timelimit are ignored.
+    :param weights: per-dimension weights of the default metric, for example the DOF weights of the robot
+    :param timelimit: maximum time in seconds to spend improving the greedy ordering, 0 disables the improvement
+    :return: newsolutions, newindices
     """
-    if distfn is None:
-        # create a dummy distance fn
-        distfn = lambda x,y: sum((x-y)**2)
-    
     newsolutions = numpy.array(solutions)
-    newindices = numpy.arange(len(solutions))
-    for i in range(newsolutions.shape[0]-2):
-        n = newsolutions.shape[0]-i-1
-        dists = [distfn(newsolutions[i,:],newsolutions[j,:]) for j in range(i+1,newsolutions.shape[0])]
-        minind = numpy.argmin(dists)+i+1
-        sol = numpy.array(newsolutions[i+1,:])
-        newsolutions[i+1,:] = newsolutions[minind,:]
-        newsolutions[minind,:] = sol
-        newindices[i+1], newindices[minind] = newindices[minind], newindices[i+1]
-    return newsolutions, newindices
+    if distfn is not None:
+        newindices = numpy.arange(len(solutions))
+        for i in range(newsolutions.shape[0]-2):
+            dists = [distfn(newsolutions[i,:],newsolutions[j,:]) for j in range(i+1,newsolutions.shape[0])]
+            minind = numpy.argmin(dists)+i+1
+            sol = numpy.array(newsolutions[i+1,:])
+            newsolutions[i+1,:] = newsolutions[minind,:]
+            newsolutions[minind,:] = sol
+            newindices[i+1], newindices[minind] = newindices[minind], newindices[i+1]
+        return newsolutions, newindices
+    
+    if len(newsolutions) <= 2:
+        return newsolutions, numpy.arange(len(newsolutions))
+    # scale each dimension so that the weighted metric becomes the squared euclidean distance
+    points = numpy.reshape(numpy.array(newsolutions,numpy.float64),(len(newsolutions),-1))
+    if weights is not None:
+        points *= numpy.sqrt(numpy.asarray(weights,numpy.float64))
+    newindices = _TSPNearestNeighborOrder(points)
+    if timelimit is not None and timelimit > 0:
+        newindices = _TSPImproveOrder(points,newindices,time.time()+timelimit)
+    return newsolutions[newindices], newindices
+
+def _TSPNearestNeighborOrder(points):
+    """greedy nearest-neighbor ordering starting at the first point"""
+    N = len(points)
+    try:
+        from scipy.spatial import cKDTree
+        kdtree = cKDTree(points)
+    except ImportError:
+        kdtree = None
+    order = numpy.zeros(N,int)
+    visited = numpy.zeros(N,bool)
+    visited[0] = True
+    current = 0
+    numvisited = 1
+    while numvisited < N:
+        nextindex = None
+        if kdtree is not None:
+            # query a few neighbors, most of the time one of them is not visited yet
+            k = 8
+            while nextindex is None and k < 4*(N-numvisited):
+                dists,neighs = kdtree.query(points[current],min(k,N))
+                neighs = neighs[~visited[neighs]]
+                if len(neighs) > 0:
+                    nextindex = neighs[0]
+                k *= 4
+        if nextindex is None:
+            unvisited = numpy.flatnonzero(~visited)
+            nextindex = unvisited[numpy.argmin(numpy.sum((points[unvisited]-points[current])**2,1))]
+        order[numvisited] = nextindex
+        visited[nextindex] = True
+        current = nextindex
+        numvisited += 1
+    return order
+
+def _TSPImproveOrder(points,order,endtime):
+    """improves an open path ordering with fixed start using 2-opt and Or-opt (segments of up to 3 points) moves until endtime"""
+    N = len(order)
+    eps = 1e-12
+    improved = True
+    while improved and time.time() < endtime:
+        improved = False
+        # 2-opt: reverse order[i+1:j+1] replacing edges (i,i+1),(j,j+1) with (i,j),(i+1,j+1)
+        for i in range(N-2):
+            if time.time() >= endtime:
+                break
+            path = points[order]
+            edgecosts = numpy.r_[numpy.sum((path[1:]-path[:-1])**2,1),0.0]
+            oldcosts = edgecosts[i]+edgecosts[i+2:]
+            newcosts = numpy.sum((path[i+2:]-path[i])**2,1)
+            newcosts[:-1] += numpy.sum((path[i+3:]-path[i+1])**2,1)
+            j = numpy.argmax(oldcosts-newcosts)
+            if oldcosts[j]-newcosts[j] > eps:
+                j += i+2
+                order[i+1:j+1] = order[i+1:j+1][::-1].copy()
+                improved = True
+        # Or-opt: move a segment order[s:s+L] between two other consecutive points or to the end, possibly reversed
+        for L in range(1,4):
+            s = 1
+            while s+L <= N and time.time() < endtime:
+                segment = order[s:s+L]
+                rest = numpy.r_[order[:s],order[s+L:]]
+                if len(rest) < 2:
+                    break
+                first = points[segment[0]]
+                last = points[segment[-1]]
+                removegain = numpy.sum((points[order[s-1]]-first)**2)
+                if s+L < N:
+                    removegain += numpy.sum((last-points[order[s+L]])**2) - numpy.sum((points[order[s-1]]-points[order[s+L]])**2)
+                restpath = points[rest]
+                # inserting after rest[k], the last index means appending at the end
+                restedgecosts = numpy.r_[numpy.sum((restpath[1:]-restpath[:-1])**2,1),0.0]
+                forwardcosts = numpy.sum((restpath-first)**2,1)
+                forwardcosts[:-1] += numpy.sum((restpath[1:]-last)**2,1)
+                reversecosts = numpy.sum((restpath-last)**2,1)
+                reversecosts[:-1] += numpy.sum((restpath[1:]-first)**2,1)
+                forwardcosts -= restedgecosts
+                reversecosts -= restedgecosts
+                kforward = numpy.argmin(forwardcosts)
+                kreverse = numpy.argmin(reversecosts)
+                if reversecosts[kreverse] < forwardcosts[kforward]:
+                    k,addcost,segment = kreverse,reversecosts[kreverse],segment[::-1]
+                else:
+                    k,addcost = kforward,forwardcosts[kforward]
+                if removegain-addcost > eps:
+                    order = numpy.r_[rest[:k+1],segment,rest[k+1:]]
+                    improved = True
+                s += 1
+    return order
 
 def sequence_cross_product(*sequences):
     """iterates through the cross product of all items in the sequences"""
@@ -487,21 +591,64 @@ class MultiManipIKSolver:
 
     The class is extremely useful in dual-manipulation IK solutions. It also handled grabbed bodies correctly.
     """
-    def __init__(self,manips):
+    def __init__(self,manips,ikcaches=None):
+        """
+        :param ikcaches: if not None, one :class:`.databases.inversekinematics.IkSolutionCache` (or None) per manipulator used to look up the ik solutions of each manipulator
+        """
         self.robot = manips[0].GetRobot()
         self.manips = manips
+        self.ikcaches = ikcaches if ikcaches is not None else [None]*len(manips)
         indeplinksets=[set([l for l in manip.GetIndependentLinks()]) for manip in self.manips]
         indeplinknames=indeplinksets[0].intersection(*indeplinksets[1:])
         alllinknames = set([l for l in self.robot.GetLinks()])
         self.enablelinknames = [alllinknames.difference(indeplinksets[i]).union(indeplinknames) for i in range(len(self.manips))]
-    
+        # links that only move with manipulator i, used to attribute collision reports. Links that move with several manipulators (a torso in all the chains) cannot be attributed to one solution.
+        deplinksets = [alllinknames.difference(indeplinksets[i]) for i in range(len(self.manips))]
+        self.armlinks = [deplinksets[i].difference(*[deplinksets[j] for j in range(len(self.manips)) if j != i]) for i in range(len(self.manips))]
+        self.sharedlinks = set([link for i in range(len(self.manips)) for link in deplinksets[i] if not link in self.armlinks[i]])
+
+    def _getManipIndexFromLink(self,link):
+        """returns the index of the manipulator whose solution moves link, or None if link does not depend on any manipulator or depends on several of them (see sharedlinks)"""
+        if link is None:
+            return None
+        body = link.GetParent()
+        for i,manip in enumerate(self.manips):
+            if body == self.robot:
+                if link in self.armlinks[i]:
+                    return i
+            elif manip.IsGrabbing(body):
+                return i
+        return None
+
+    @staticmethod
+    def _iterBestFirst(costs):
+        """iterates through the index tuples of the cross product of sorted costs in increasing total cost.
+
+        :param costs: a list of sorted 1D arrays, one per sequence
+        """
+        start = (0,)*len(costs)
+        heap = [(sum([c[0] for c in costs]),start)]
+        visited = set([start])
+        while len(heap) > 0:
+            cost,indices = heapq.heappop(heap)
+            yield indices
+            for i in range(len(indices)):
+                if indices[i]+1 < len(costs[i]):
+                    nextindices = indices[:i]+(indices[i]+1,)+indices[i+1:]
+                    if not nextindices in visited:
+                        visited.add(nextindices)
+                        heapq.heappush(heap,(cost+costs[i][nextindices[i]]-costs[i][indices[i]],nextindices))
+
     def findMultiIKSolution(self,Tgrasps,filteroptions=openravepy_int.IkFilterOptions.CheckEnvCollisions,dooptimize=False):
         """Return one set collision-free ik solutions for all manipulators.
 
         Method always checks self-collisions.
+
+        The cross product of the solutions is searched lazily and returns at the first valid combination. When a combination collides, the colliding links are used to remember which single solution or pair of solutions caused it so that all other combinations containing them are skipped without any collision checking.
         
         :param Tgrasps: a list of all the end effector transforms of each of the manipualtors
         :param filteroptions: a bitmask of :class:`IkFilterOptions`
+        :param dooptimize: if True, combinations are visited in increasing total joint distance from the current robot configuration
         """
         assert(len(Tgrasps)==len(self.manips))
         with self.robot:
@@ -517,7 +664,10 @@ class MultiManipIKSolver:
                         # enable only the grabbed bodies of this manipulator
                         for body in grabbed:
                             body.Enable(manip.IsGrabbing(body))
-                        values=manip.FindIKSolutions(Tgrasps[i],filteroptions)
+                        if self.ikcaches[i] is not None:
+                            values=self.ikcaches[i].FindIKSolutions(Tgrasps[i],filteroptions)
+                        else:
+                            values=manip.FindIKSolutions(Tgrasps[i],filteroptions)
                         if values is not None and len(values) > 0:
                             alljointvalues.append(values)
                         else:
@@ -528,31 +678,96 @@ class MultiManipIKSolver:
                     saver.Restore()
 
             if dooptimize:
-                curvalues = [self.robot.GetDOFValues(manip.GetArmIndices()) for main in self.manips]
-                distancesolutions = []
-                for sols in sequence_cross_product(*alljointvalues):
-                    dist = numpy.sum([numpy.sum(numpy.abs(sol0-sol1)) for sol0,sol1 in izip(sols,curvalues)])
-                    distancesolutions.append([dist, sols])
-                distancesolutions.sort(lambda x,y: int(x[0]-y[0]))
-                for dist,sols in distancesolutions:
-                    for sol,manip in izip(sols,self.manips):
-                        self.robot.SetDOFValues(sol,manip.GetArmIndices()) 
-                    if not self.robot.CheckSelfCollision():
-                        if not (filteroptions&openravepy_int.IkFilterOptions.CheckEnvCollisions) or not self.robot.GetEnv().CheckCollision(self.robot):
-                            return sols
+                # the total distance is a sum of per-manipulator distances, so sorting each set of solutions independently and walking the cross product best-first visits the combinations in increasing total distance
+                sortedjointvalues = []
+                costs = []
+                for values,manip in izip(alljointvalues,self.manips):
+                    dists = numpy.sum(numpy.abs(values-self.robot.GetDOFValues(manip.GetArmIndices())),1)
+                    sortedindices = numpy.argsort(dists)
+                    sortedjointvalues.append(values[sortedindices])
+                    costs.append(dists[sortedindices])
+                alljointvalues = sortedjointvalues
+                combinations = self._iterBestFirst(costs)
             else:
-                for sols in sequence_cross_product(*alljointvalues):
-                    for sol,manip in izip(sols,self.manips):
-                        self.robot.SetDOFValues(sol,manip.GetArmIndices()) 
-                    if not self.robot.CheckSelfCollision():
-                        if not (filteroptions&openravepy_int.IkFilterOptions.CheckEnvCollisions) or not self.robot.GetEnv().CheckCollision(self.robot):
-                            return sols
+                combinations = sequence_cross_product(*[range(len(values)) for values in alljointvalues])
+
+            checkenv = filteroptions&openravepy_int.IkFilterOptions.CheckEnvCollisions
+            report = openravepy_int.CollisionReport()
+            collidingsingles = set() # (manipindex, solindex)
+            collidingpairs = set() # ((manipindex0, solindex0), (manipindex1, solindex1)) with manipindex0 < manipindex1
+            for indices in combinations:
+                keys = list(enumerate(indices))
+                if any([key in collidingsingles for key in keys]):
+                    continue
+                if any([(keys[i],keys[j]) in collidingpairs for i in range(len(keys)) for j in range(i+1,len(keys))]):
+                    continue
+                
+                for values,index,manip in izip(alljointvalues,indices,self.manips):
+                    self.robot.SetDOFValues(values[index],manip.GetArmIndices())
+                if self.robot.CheckSelfCollision(report):
+                    if report.plink1 in self.sharedlinks or report.plink2 in self.sharedlinks:
+                        # the pose of a shared link depends on several solutions, so only this combination is skipped
+                        continue
+                    imanip1 = self._getManipIndexFromLink(report.plink1)
+                    imanip2 = self._getManipIndexFromLink(report.plink2)
+                    if imanip1 is not None and imanip2 is not None and imanip1 != imanip2:
+                        collidingpairs.add(tuple(sorted([keys[imanip1],keys[imanip2]])))
+                    elif imanip1 is not None:
+                        collidingsingles.add(keys[imanip1])
+                    elif imanip2 is not None:
+                        collidingsingles.add(keys[imanip2])
+                    continue
+                
+                if checkenv and self.robot.GetEnv().CheckCollision(self.robot,report):
+                    if report.plink1 in self.sharedlinks or report.plink2 in self.sharedlinks:
+                        continue
+                    # the environment does not move, so only a collision of an arm link can be attributed to a single solution
+                    for link in [report.plink1,report.plink2]:
+                        imanip = self._getManipIndexFromLink(link)
+                        if imanip is not None:
+                            collidingsingles.add(keys[imanip])
+                    continue
+                
+                return tuple([values[index] for values,index in izip(alljointvalues,indices)])
             
             return None
 
 class SpaceSamplerExtra:
-    def __init__(self):
-         self.faceindices = self.facenumr = self.facenump = None
+    # tables shared by all instances. The SO3 samples are also stored in the openrave database directory since they are expensive to compute for high levels
+    _cachedfaceindices = None
+    _cachedS2 = {} # level -> (theta,pfi)
+    _cachedSO3 = {} # level -> qarray
+    _cachedSO3separation = {} # level -> mean distance to the nearest rotation
+    def __init__(self,usediskcache=True):
+        """
+        :param usediskcache: if True, will load/save the SO3 samples from/to the openrave database directory
+        """
+        self.faceindices = self.facenumr = self.facenump = None
+        self.usediskcache = usediskcache
+    @staticmethod
+    def computeNearestNeighborDistances(qarray):
+        """for every quaternion, returns the natural distance (same as quatArrayTDist) to its closest other quaternion in qarray.
+
+        Uses a KD-tree over qarray and -qarray if scipy is present, otherwise blocks of dot products.
+        """
+        qarray = numpy.asarray(qarray,numpy.float64)
+        N = len(qarray)
+        try:
+            from scipy.spatial import cKDTree
+            # q and -q are the same rotation and the chord distance is monotonic with the quaternion distance
+            kdtree = cKDTree(numpy.r_[qarray,-qarray])
+            chorddists,neighs = kdtree.query(qarray,3)
+            # the first neighbor is the quaternion itself
+            chorddists = numpy.where(numpy.mod(neighs[:,1],N)==numpy.arange(N),chorddists[:,2],chorddists[:,1])
+            return 2.0*numpy.arcsin(numpy.minimum(1.0,0.5*chorddists))
+        except ImportError:
+            maxdots = numpy.zeros(N)
+            blocksize = max(1,int(4e6/max(N,1)))
+            for i in range(0,N,blocksize):
+                dots = numpy.abs(numpy.dot(qarray[i:(i+blocksize)],qarray.T))
+                dots[numpy.arange(len(dots)),numpy.arange(i,i+len(dots))] = -1
+                maxdots[i:(i+blocksize)] = numpy.max(dots,1)
+            return numpy.arccos(numpy.minimum(1.0,maxdots))
     @staticmethod
     def computeSepration(qarray):
         """used to test separation of a set of quaternions"""
@@ -564,21 +779,26 @@ class SpaceSamplerExtra:
         return numpy.arccos(numpy.min(1.0,numpy.max(qmaxdists))), numpy.arccos(numpy.min(1.0,numpy.min(qmaxdists)))
     def computeFaceIndices(self,N):
         if self.faceindices is None or len(self.faceindices[0]) < N:
-            indices = numpy.arange(N**2)
-            # separate the odd and even bits into odd,even
-            maxiter = int(numpy.log2(len(indices)))
-            oddbits = numpy.zeros(N**2,int)
-            evenbits = numpy.zeros(N**2,int)
-            mult = 1
-            for i in range(maxiter):
-                oddbits += (indices&1)*mult
-                evenbits += mult*((indices&2)/2)
-                indices >>= 2
-                mult *= 2
-            self.faceindices = [oddbits+evenbits,oddbits-evenbits]
+            cached = SpaceSamplerExtra._cachedfaceindices
+            if cached is not None and len(cached[0]) >= N:
+                # the bit-separated indices of a smaller N are a prefix of the ones of a larger N
+                self.faceindices = cached
+            else:
+                indices = numpy.arange(N**2)
+                # separate the odd and even bits into odd,even
+                maxiter = int(numpy.log2(len(indices)))
+                oddbits = numpy.zeros(N**2,int)
+                evenbits = numpy.zeros(N**2,int)
+                mult = 1
+                for i in range(maxiter):
+                    oddbits += (indices&1)*mult
+                    evenbits += mult*((indices&2)/2)
+                    indices >>= 2
+                    mult *= 2
+                self.faceindices = SpaceSamplerExtra._cachedfaceindices = [oddbits+evenbits,oddbits-evenbits]
         if self.facenumr is None or len(self.facenumr) != N*12:
-            self.facenumr = numpy.reshape(numpy.transpose(numpy.tile([2,2,2,2,3,3,3,3,4,4,4,4],(N,1))),N*12)
-            self.facenump = numpy.reshape(numpy.transpose(numpy.tile([1,3,5,7,0,2,4,6,1,3,5,7],(N,1))),N*12)
+            self.facenumr = numpy.repeat([2,2,2,2,3,3,3,3,4,4,4,4],N)
+            self.facenump = numpy.repeat([1,3,5,7,0,2,4,6,1,3,5,7],N)
     def sampleS2(self,level=0,angledelta=None):
         """uses healpix algorithm with ordering from Yershova et. al. 2009 journal paper"""
         if angledelta is not None:
@@ -590,6 +810,9 @@ class SpaceSamplerExtra:
             # [3, 0.13104214473149575]
             # [4, 0.085649339187184162]
             level=max(0,int(0.5-numpy.log2(angledelta)))
+        if level in SpaceSamplerExtra._cachedS2:
+            theta,pfi = SpaceSamplerExtra._cachedS2[level]
+            return numpy.array(theta),numpy.array(pfi)
         Nside = 2**level
         Nside2 = Nside**2
         N = 12*Nside**2
@@ -610,11 +833,12 @@ class SpaceSamplerExtra:
         z[southpoleinds] = -1.0 + nr[southpoleinds]**2*(1.0/(3.0*Nside2))
         kshift[southpoleinds] = 0
         # compute pfi
-        facenump = numpy.reshape(numpy.transpose(numpy.tile([1,3,5,7,0,2,4,6,1,3,5,7],(Nside2,1))),N)
         jp = (self.facenump*nr+numpy.tile(self.faceindices[1][0:Nside2],12)+1+kshift)/2
         jp[jp>4*Nside] -= 4*Nside
         jp[jp<1] += 4*Nside
-        return numpy.arccos(z),(jp-(kshift+1)*0.5)*((0.5*numpy.pi)/nr)
+        theta,pfi = numpy.arccos(z),(jp-(kshift+1)*0.5)*((0.5*numpy.pi)/nr)
+        SpaceSamplerExtra._cachedS2[level] = (theta,pfi)
+        return numpy.array(theta),numpy.array(pfi)
     @staticmethod
     def hopf2quat(hopfarray):
         """convert hopf rotation coordinates to quaternion"""
@@ -625,28 +849,79 @@ class SpaceSamplerExtra:
         s0 = numpy.sin(half0)
         s2 = numpy.sin(half2)
         return numpy.c_[c0*c2,c0*s2,s0*numpy.cos(hopfarray[:,1]+half2),s0*numpy.sin(hopfarray[:,1]+half2)]
+    @staticmethod
+    def getSO3Level(quatdelta):
+        """returns the sampleSO3 level aiming for an average quaternion distance of quatdelta"""
+        # level=0, quatdist = 0.5160220
+        # level=1: quatdist = 0.2523583
+        # level=2: quatdist = 0.120735
+        return max(0,int(-0.5-numpy.log2(quatdelta)))
     def sampleSO3(self,level=0,quatdelta=None):
         """Uniformly Sample 3D Rotations.
         If quatdelta is specified, will compute the best level aiming for that average quaternion distance.
         Algorithm From
         A. Yershova, S. Jain, S. LaValle, J. Mitchell "Generating Uniform Incremental Grids on SO(3) Using the Hopf Fibration", International Journal of Robotics Research, Nov 13, 2009.
+
+        The samples of each level are computed once and cached in memory and (if usediskcache is set) in the openrave database directory.
         """
         if quatdelta is not None:
-            # level=0, quatdist = 0.5160220
-            # level=1: quatdist = 0.2523583
-            # level=2: quatdist = 0.120735
-            level=max(0,int(-0.5-numpy.log2(quatdelta)))
-        s1samples,step = numpy.linspace(0.0,2*numpy.pi,6*(2**level),endpoint=False,retstep=True)
-        s1samples += step*0.5
-        theta,pfi = self.sampleS2(level)
-        band = numpy.zeros((len(s1samples),3))
-        band[:,2] = s1samples
-        qarray = numpy.zeros((0,4))
-        for i in range(len(theta)):
-            band[:,0] = theta[i]
-            band[:,1] = pfi[i]
-            qarray = numpy.r_[qarray,self.hopf2quat(band)]
-        return qarray
+            level=self.getSO3Level(quatdelta)
+        qarray = SpaceSamplerExtra._cachedSO3.get(level,None)
+        if qarray is None and self.usediskcache:
+            qarray = self._LoadSO3(level)
+        if qarray is None:
+            s1samples,step = numpy.linspace(0.0,2*numpy.pi,6*(2**level),endpoint=False,retstep=True)
+            s1samples += step*0.5
+            theta,pfi = self.sampleS2(level)
+            # every S2 sample gets the full S1 band
+            hopfarray = numpy.c_[numpy.repeat(theta,len(s1samples)),numpy.repeat(pfi,len(s1samples)),numpy.tile(s1samples,len(theta))]
+            qarray = self.hopf2quat(hopfarray)
+            if self.usediskcache:
+                self._SaveSO3(level,qarray)
+        SpaceSamplerExtra._cachedSO3[level] = qarray
+        return numpy.array(qarray)
+    def iterSampleSO3(self,maxlevel=0,minlevel=0):
+        """iterates through the rotation sets of increasing resolution from minlevel to maxlevel, yielding level,qarray.
+
+        The face indices of maxlevel are computed first so that all lower levels reuse them, and every level is taken from the cache if already computed. Allows coarse-to-fine searches to stop at the first resolution that is good enough.
+        """
+        self.computeFaceIndices(4**maxlevel)
+        for level in range(minlevel,maxlevel+1):
+            yield level,self.sampleSO3(level)
+    def getSO3Separation(self,level=0,quatdelta=None):
+        """returns the mean natural distance from each rotation of sampleSO3(level) to its closest neighbor"""
+        if quatdelta is not None:
+            level=self.getSO3Level(quatdelta)
+        if not level in SpaceSamplerExtra._cachedSO3separation:
+            SpaceSamplerExtra._cachedSO3separation[level] = numpy.mean(self.computeNearestNeighborDistances(self.sampleSO3(level)))
+        return SpaceSamplerExtra._cachedSO3separation[level]
+    @staticmethod
+    def _GetSO3Filename(level,read):
+        return openravepy_int.RaveFindDatabaseFile(os.path.join('spacesampler','so3.%d.npy'%level),read)
+    def _LoadSO3(self,level):
+        filename = self._GetSO3Filename(level,True)
+        if len(filename) == 0:
+            return None
+        try:
+            qarray = numpy.load(filename)
+            if qarray.shape == (72*8**level,4):
+                return qarray
+            log.warn('%s has wrong shape %r',filename,qarray.shape)
+        except (IOError,ValueError) as e:
+            log.warn('failed to load %s: %s',filename,e)
+        return None
+    def _SaveSO3(self,level,qarray):
+        filename = self._GetSO3Filename(level,False)
+        if len(filename) == 0:
+            return
+        try:
+            try:
+                os.makedirs(os.path.split(filename)[0])
+            except OSError:
+                pass
+            numpy.save(filename,qarray)
+        except IOError as e:
+            log.warn('failed to save %s: %s',filename,e)
     @staticmethod
     def sampleR3lattice(averagedist,boxdims):
         """low-discrepancy lattice sampling in using the roots of x^3-3x+1.
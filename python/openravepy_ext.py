@@ -109,19 +109,48 @@ def normalizeZRotation(qarray):
     cosangles = numpy.cos(zangles)
     return numpy.c_[cosangles*qarray[:,0]-sinangles*qarray[:,3], cosangles*qarray[:,1]-sinangles*qarray[:,2], cosangles*qarray[:,2]+sinangles*qarray[:,1], cosangles*qarray[:,3]+sinangles*qarray[:,0]],-2.0*zangles
 
-def quatArrayTMult(qarray,q):
-    """ multiplies a Nx4 array of quaternions with a quaternion"""
-    return numpy.c_[(qarray[:,0]*q[0] - qarray[:,1]*q[1] - qarray[:,2]*q[2] - qarray[:,3]*q[3],
-                     qarray[:,0]*q[1] + qarray[:,1]*q[0] + qarray[:,2]*q[3] - qarray[:,3]*q[2],
-                     qarray[:,0]*q[2] + qarray[:,2]*q[0] + qarray[:,3]*q[1] - qarray[:,1]*q[3],
-                     qarray[:,0]*q[3] + qarray[:,3]*q[0] + qarray[:,1]*q[2] - qarray[:,2]*q[1])]
-
-def quatMultArrayT(q,qarray):
-    """ multiplies a quaternion q with each quaternion in the Nx4 array qarray"""
-    return numpy.c_[(q[0]*qarray[:,0] - q[1]*qarray[:,1] - q[2]*qarray[:,2] - q[3]*qarray[:,3],
-                     q[0]*qarray[:,1] + q[1]*qarray[:,0] + q[2]*qarray[:,3] - q[3]*qarray[:,2],
-                     q[0]*qarray[:,2] + q[2]*qarray[:,0] + q[3]*qarray[:,1] - q[1]*qarray[:,3],
-                     q[0]*qarray[:,3] + q[3]*qarray[:,0] + q[1]*qarray[:,2] - q[2]*qarray[:,1])]
+def _quatArrayTMultMatrix(q):
+    """returns the 4x4 matrix M such that dot(qarray,M) multiplies each quaternion in qarray with q"""
+    return numpy.array(((q[0], q[1], q[2], q[3]),
+                        (-q[1], q[0], -q[3], q[2]),
+                        (-q[2], q[3], q[0], -q[1]),
+                        (-q[3], -q[2], q[1], q[0])))
+
+def _quatMultArrayTMatrix(q):
+    """returns the 4x4 matrix M such that dot(qarray,M) multiplies q with each quaternion in qarray"""
+    return numpy.array(((q[0], q[1], q[2], q[3]),
+                        (-q[1], q[0], q[3], -q[2]),
+                        (-q[2], -q[3], q[0], q[1]),
+                        (-q[3], q[2], -q[1], q[0])))
+
+def _quatRotationMatrix(q):
+    """returns the 3x3 rotation matrix of a quaternion"""
+    xx = q[1] * q[1]
+    xy = q[1] * q[2]
+    xz = q[1] * q[3]
+    xw = q[1] * q[0]
+    yy = q[2] * q[2]
+    yz = q[2] * q[3]
+    yw = q[2] * q[0]
+    zz = q[3] * q[3]
+    zw = q[3] * q[0]
+    return 2*numpy.array(((0.5-yy-zz, xy-zw, xz+yw),
+                          (xy+zw, 0.5-xx-zz, yz-xw),
+                          (xz-yw, yz+xw, 0.5-xx-yy)))
+
+def quatArrayTMult(qarray,q,out=None):
+    """ multiplies a Nx4 array of quaternions with a quaternion
+
+    :param out: if not None, a C-contiguous Nx4 float64 array that receives the result without allocating it. Cannot overlap qarray.
+    """
+    return numpy.dot(qarray,_quatArrayTMultMatrix(q),out=out)
+
+def quatMultArrayT(q,qarray,out=None):
+    """ multiplies a quaternion q with each quaternion in the Nx4 array qarray
+
+    :param out: if not None, a C-contiguous Nx4 float64 array that receives the result without allocating it. Cannot overlap qarray.
+    """
+    return numpy.dot(qarray,_quatMultArrayTMatrix(q),out=out)
 
 def quatArrayRotate(qarray,trans):
     """rotates a point by an array of 4xN quaternions. Returns a 3xN vector"""
@@ -164,24 +193,25 @@ def quatRotate(q,trans):
                           (xy+zw)*trans[0]+(0.5-xx-zz)*trans[1]+(yz-xw)*trans[2],
                           (xz-yw)*trans[0]+(yz+xw)*trans[1]+(0.5-xx-yy)*trans[2]))
 
-def quatRotateArrayT(q,transarray):
-    """rotates a set of points in Nx3 transarray by a quaternion. Returns a Nx3 vector"""
-    xx = q[1] * q[1]
-    xy = q[1] * q[2]
-    xz = q[1] * q[3]
-    xw = q[1] * q[0]
-    yy = q[2] * q[2]
-    yz = q[2] * q[3]
-    yw = q[2] * q[0]
-    zz = q[3] * q[3]
-    zw = q[3] * q[0]
-    return 2*numpy.c_[((0.5-yy-zz)*transarray[:,0]+(xy-zw)*transarray[:,1]+(xz+yw)*transarray[:,2],
-                       (xy+zw)*transarray[:,0]+(0.5-xx-zz)*transarray[:,1]+(yz-xw)*transarray[:,2],
-                       (xz-yw)*transarray[:,0]+(yz+xw)*transarray[:,1]+(0.5-xx-yy)*transarray[:,2])]
+def quatRotateArrayT(q,transarray,out=None):
+    """rotates a set of points in Nx3 transarray by a quaternion. Returns a Nx3 vector
+
+    :param out: if not None, a C-contiguous Nx3 float64 array that receives the result without allocating it. Cannot overlap transarray.
+    """
+    return numpy.dot(transarray,_quatRotationMatrix(q).T,out=out)
+
+def poseMultArrayT(pose,posearray,out=None):
+    """multiplies a pose with an array of poses (each pose is a quaterion + translation)
 
-def poseMultArrayT(pose,posearray):
-    """multiplies a pose with an array of poses (each pose is a quaterion + translation)"""
-    return numpy.c_[quatMultArrayT(pose[0:4],posearray[:,0:4]),quatRotateArrayT(pose[0:4],posearray[:,4:7])+numpy.tile(pose[4:7],(len(posearray),1))]
+    :param out: if not None, a C-contiguous Nx7 float64 array that receives the result without allocating it. Cannot overlap posearray.
+    """
+    # the quaternion and translation parts are multiplied with one block diagonal matrix so that the result is written in one pass
+    M = numpy.zeros((7,7))
+    M[0:4,0:4] = _quatMultArrayTMatrix(pose[0:4])
+    M[4:7,4:7] = _quatRotationMatrix(pose[0:4]).T
+    out = numpy.dot(posearray,M,out=out)
+    out[:,4:7] += pose[4:7]
+    return out
     
 def quatArrayTDist(q,qarray):
     """computes the natural distance (Haar measure) for quaternions, q is a 4-element array, qarray is Nx4"""
@@ -199,11 +229,25 @@ def TransformInversePoints(T,points):
 
 transformInversePoints = TransformInversePoints # deprecated
 
-def ComputePoseArrayDistSqr(pose0, posearray, quatweight=1.0):
+def ComputePoseArrayDistSqr(pose0, posearray, quatweight=1.0, out=None, work=None):
     """computes the squared distance between pose0 and all poses in posearray
+
+    The quaternion distance is the smaller of the distances to q and -q.
+
+    :param out: if not None, a C-contiguous float64 array of length N that receives the result
+    :param work: if not None, a C-contiguous Nx7 float64 scratch array, otherwise it is allocated. With both out and work, the call does not allocate any array of size N.
     """
-    pose0tiled = numpy.tile(pose0, (len(posearray),1))
-    diff2 = numpy.abs(pose0tiled - posearray)**2
-    qdists0 = numpy.sum(diff2[:,0:4], 1)
-    qdists1 = numpy.sum((pose0tiled[:,0:4]+posearray[:,0:4])**2, 1)
-    return numpy.minimum(qdists0, qdists1)*quatweight + numpy.sum(diff2[:, 4:7], 1)
+    pose0 = numpy.asarray(pose0, numpy.float64)
+    if work is None:
+        work = numpy.empty((len(posearray),7))
+    # |q0+q|^2 = |q0-q|^2 + 4 q0.q, so the smaller one adds min(0, 4 q0.q) to |q0-q|^2
+    coeffs = numpy.zeros(7)
+    coeffs[0:4] = 4.0*pose0[0:4]
+    out = numpy.dot(posearray, coeffs, out=out)
+    numpy.minimum(out, 0.0, out=out)
+    numpy.subtract(posearray, pose0, out=work)
+    numpy.square(work, out=work)
+    work[:,0] += out
+    coeffs[0:4] = quatweight
+    coeffs[4:7] = 1.0
+    return numpy.dot(work, coeffs, out=out)
@@ -16,14 +16,31 @@
 #
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Generates the analytical forward kinematics of all the links of a robot.
+
+The passive joints of every closed loop are solved symbolically with the ikfast equation solver, and the link transforms are written out as C++ (through the ikfast code generator) and as a NumPy module that evaluates many configurations at once. The generated files are cached with the kinematics hash of the robot, so a robot is only solved once:
+
+.. code-block:: python
+
+  fkmodule = fkfast.GetForwardKinematicsModule(robot)
+  Tlinks = fkmodule.ComputeLinkTransforms(dofvalues) # dofvalues is N x DOF, Tlinks is N x numlinks x 4 x 4
+
+The transforms are relative to the first link of the robot.
+"""
 from __future__ import with_statement # for python 2.5
 __author__ = 'Rosen Diankov'
 __copyright__ = 'Copyright (C) 2009-2010 Rosen Diankov (rosen.diankov@gmail.com)'
 __license__ = 'Lesser GPL, Version 3'
+__version__ = '0x10000001' # hex of the version, has to be prefixed with 0x
 
 from sympy import *
+from sympy import printing
+from sympy.simplify import cse_main
+from sympy.core.function import AppliedUndef
 import openravepy
+from openravepy import ikfast
 import numpy
+import os, imp, datetime, cStringIO
 try:
     from openravepy.metaclass import AutoReloader
 except:
@@ -31,404 +48,519 @@ except:
         pass
 
 from itertools import izip
-try:
-    from itertools import combinations
-except ImportError:
-    def combinations(items,n):
-        if n == 0: yield[]
-        else:
-            for  i in xrange(len(items)):
-                for cc in combinations(items[i+1:],n-1):
-                    yield [items[i]]+cc
+
+import logging
+log = logging.getLogger('openravepy.fkfast')
 
 class FKFastSolver(AutoReloader):
     """Solves the analytical forwards kinematics equations of a robot and outputs them in specified programming languages.
     Can handle closed-loops and mimic joints.
     """
-    def __init__(self, kinbody=None,kinematicshash='',accuracy=None,precision=None):
-        self.joints = []
-        self.freevarsubs = []
-        self.degeneratecases = None
-        self.kinematicshash = kinematicshash
+    def __init__(self, kinbody=None,kinematicshash=None,precision=None):
         self.kinbody = kinbody
-        self.iksolver = openravepy.ikfast.IKFastSolver(kinbody=self.kinbody,accuracy=accuracy,precision=precision)
-        self.iksolver.IsHinge = self.IsHinge # temporary hack
-
-    def normalizeRotation(self,M):
-        right = M[0,0:3]/sqrt(M[0,0:3].dot(M[0,0:3]))
-        for i in range(3):
-            right[i] = self.iksolver.chop(right[i])
-        up = M[1,0:3] - right*right.dot(M[1,0:3])
-        up = up/sqrt(up.dot(up))
-        for i in range(3):
-            up[i] = self.iksolver.chop(up[i])
-        M[0,0:3] = right
-        M[1,0:3] = up
-        M[2,0:3] = right.cross(up)
-        for i in range(3):
-            M[i,3] = self.iksolver.chop(M[i,3])
-        return M
-
-    def numpyMatrixToSympy(self,T):
-        return self.normalizeRotation(Matrix(4,4,[Real(float(x),30) for x in T.flat]))
-
-    def numpyVectorToSympy(self,v):
-        return Matrix(3,1,[self.iksolver.chop(Real(float(x),30)) for x in v])
-        
+        if kinematicshash is None:
+            kinematicshash = kinbody.GetKinematicsGeometryHash()
+        self.kinematicshash = kinematicshash
+        self.iksolver = ikfast.IKFastSolver(kinbody=self.kinbody,kinematicshash=kinematicshash,precision=precision)
+        # the passive joint variables are not part of the ikfast axis map
+        self.iksolver.IsHinge = self.IsHinge
+        self.iksolver.IsPrismatic = self.IsPrismatic
+        self.baselink = None
+        self.passiveaxes = {} # name of a passive variable -> (joint,iaxis)
+        self._passivevars = {} # (joint name,iaxis) -> passive variable
+        self._mimicexpressions = {} # (joint name,iaxis) -> value of the mimic axis, see GetMimicExpression
+        for joint in self.kinbody.GetPassiveJoints():
+            for iaxis in range(joint.GetDOF()):
+                if not joint.IsMimic(iaxis) and not joint.IsStatic():
+                    var = Symbol('p%d'%len(self.passiveaxes))
+                    self.passiveaxes[var.name] = (joint,iaxis)
+                    self._passivevars[(joint.GetName(),iaxis)] = var
+        self.passiveequations = [] # list of (var,expr) in evaluation order, each expr only depends on the dof values and the previous passive variables
+        self.linkequations = [] # the 4x4 transform of every link relative to baselink
+        self._strprinter = printing.StrPrinter({'full_prec':False})
+
+    def IsHinge(self,axisname):
+        if axisname in self.passiveaxes:
+            joint,iaxis = self.passiveaxes[axisname]
+            return joint.IsRevolute(iaxis)
+        return ikfast.IKFastSolver.IsHinge(self.iksolver,axisname)
+
+    def IsPrismatic(self,axisname):
+        if axisname in self.passiveaxes:
+            joint,iaxis = self.passiveaxes[axisname]
+            return joint.IsPrismatic(iaxis)
+        return ikfast.IKFastSolver.IsPrismatic(self.iksolver,axisname)
+
+    def GetAxisVariable(self,joint,iaxis):
+        """returns the symbolic value of a joint axis, or None if the axis never moves.
+        """
+        if joint.GetDOFIndex() >= 0:
+            return Symbol('j%d'%(joint.GetDOFIndex()+iaxis))
+        if joint.IsMimic(iaxis):
+            return self.GetMimicExpression(joint,iaxis)
+        if joint.IsStatic():
+            return None
+        return self._passivevars[(joint.GetName(),iaxis)]
+
+    def GetMimicExpression(self,joint,iaxis,_mimicstack=()):
+        """returns the value of a mimic joint axis in terms of the dof variables and the passive variables.
+
+        The fparser equation is parsed with every joint name mapped to its own symbol, so joint names that are part of function names (a in atan2) are left alone. Joints that are mimic themselves are resolved recursively.
+        """
+        key = (joint.GetName(),iaxis)
+        if key in self._mimicexpressions:
+            return self._mimicexpressions[key]
+        if key in _mimicstack:
+            raise ikfast.IKFastSolver.CannotSolveError('mimic equations of joints %s depend on each other'%[name for name,axis in _mimicstack])
+        eq = joint.GetMimicEquation(iaxis)
+        if ':=' in eq or ';' in eq:
+            raise ikfast.IKFastSolver.CannotSolveError('mimic equation of joint %s uses fparser definitions that cannot be converted: %s'%(joint.GetName(),eq))
+        jointsymbols = {}
+        for testjoint in self.kinbody.GetJoints()+self.kinbody.GetPassiveJoints():
+            jointsymbols[testjoint.GetName()] = Symbol('_joint%d'%len(jointsymbols))
+        symboljoints = dict([(symbol,self.kinbody.GetJoint(name)) for name,symbol in jointsymbols.iteritems()])
+        try:
+            expr = sympify(eq,locals=jointsymbols)
+        except (SympifyError,SyntaxError,TypeError),e:
+            raise ikfast.IKFastSolver.CannotSolveError('failed to parse mimic equation of joint %s: %s'%(joint.GetName(),e))
+        unknownfunctions = [f.func for f in expr.atoms(AppliedUndef)]
+        if len(unknownfunctions) > 0:
+            raise ikfast.IKFastSolver.CannotSolveError('mimic equation of joint %s uses functions %s that cannot be converted'%(joint.GetName(),unknownfunctions))
+        unknownsymbols = [symbol for symbol in expr.free_symbols if not symbol in symboljoints]
+        if len(unknownsymbols) > 0:
+            raise ikfast.IKFastSolver.CannotSolveError('mimic equation of joint %s depends on %s, which are not joints'%(joint.GetName(),unknownsymbols))
+        subs = []
+        for symbol in expr.free_symbols:
+            testjoint = symboljoints[symbol]
+            if testjoint.IsMimic(0):
+                value = self.GetMimicExpression(testjoint,0,_mimicstack+(key,))
+            else:
+                value = self.GetAxisVariable(testjoint,0)
+            subs.append((symbol,value if value is not None else S.Zero))
+        expr = expr.subs(subs)
+        self._mimicexpressions[key] = expr
+        return expr
+
     def forwardKinematicsChain(self, chainlinks, chainjoints):
-        with self.kinbody:
-            assert(len(chainjoints)+1==len(chainlinks))
-            Links = []
-            Tright = eye(4)
-            jointvars = []
-            isolvejointvars = []
-            ifreejointvars = []
-            jointinds = []
-            self.jointindexmap = dict()
-            jointindexmap_inv = dict()
-            for i,joint in enumerate(chainjoints):
-                if chainjoints[i].GetHierarchyParentLink() == chainlinks[i]:
-                    TLeftjoint = self.numpyMatrixToSympy(joint.GetInternalHierarchyLeftTransform())
-                    TRightjoint = self.numpyMatrixToSympy(joint.GetInternalHierarchyRightTransform())
-                    jaxis = self.numpyVectorToSympy(joint.GetInternalHierarchyAxis(0))
-                else:
-                    TLeftjoint = self.iksolver.affineInverse(self.numpyMatrixToSympy(joint.GetInternalHierarchyRightTransform()))
-                    TRightjoint = self.iksolver.affineInverse(self.numpyMatrixToSympy(joint.GetInternalHierarchyLeftTransform()))
-                    jaxis = -self.numpyVectorToSympy(joint.GetInternalHierarchyAxis(0))
-                if not joint.IsStatic():
-                    if not joint in self.jointindexmap:
-                        self.jointindexmap[len(jointvars)] = joint
-                        jointindexmap_inv[joint] = len(jointvars)
-                        var = Symbol(joint.GetName())
-                    else:
-                        var = Symbol(jointindexmap_inv[joint].GetName())
-
-                    Tjoint = eye(4)
-                    if joint.GetType() == openravepy.KinBody.Joint.Type.Hinge:
-                        Tjoint[0:3,0:3] = self.iksolver.rodrigues(jaxis,var)
-                    elif joint.GetType() == openravepy.KinBody.Joint.Type.Slider:
-                        Tjoint[0:3,3] = jaxis*(var)
-                    else:
-                        raise ValueError('failed to process joint type %s'%joint.GetType())
-
-                    if i > 0 and chainjoints[i]==chainjoints[i-1]:
-                        # the joint is the same as the last joint
-                        Links[-1] = self.iksolver.affineSimplify(Links[-1] * Tright * TLeftjoint * Tjoint)
-                        Tright = TRightjoint
-                    else:
-                        # the joints are different, so add regularly
-                        jointvars.append(var)
-                        if False: # not free joint
-                            ifreejointvars.append(len(jointvars)-1)
-                            if len(isolvejointvars) == 0:
-                                # no unknown joints have been found yet, so instead of adding a new entry, merge with previous matrix
-                                Tright = Tright * TLeftjoint * Tjoint * TRightjoint
-                                continue
-                        else:
-                            isolvejointvars.append(len(jointvars)-1)
-                        Links.append(Tright * TLeftjoint)
-                        jointinds.append(len(Links))
-                        Links.append(Tjoint)
-                        Tright = TRightjoint
-                else:
-                    Tright = self.iksolver.affineSimplify(Tright * TLeftjoint * TRightjoint)
-            Links.append(Tright)
-        
-        # before returning the final links, try to push as much translation components
-        # outwards to both ends. Sometimes these components can get in the way of detecting
-        # intersecting axes
-        if len(jointinds) > 0:
-            iright = jointinds[-1]
-            Ttrans = eye(4)
-            Ttrans[0:3,3] = Links[iright-1][0:3,0:3].transpose() * Links[iright-1][0:3,3]
-            Trot_with_trans = Ttrans * Links[iright]
-            separated_trans = Trot_with_trans[0:3,0:3].transpose() * Trot_with_trans[0:3,3]
-            for j in range(0,3):
-                if separated_trans[j].has_any_symbols(*jointvars):
-                    Ttrans[j,3] = Real(0,30)
+        """returns the symbolic transform of chainlinks[-1] in the coordinate system of chainlinks[0]. The joints can be traversed in either direction of the hierarchy.
+        """
+        assert(len(chainjoints)+1==len(chainlinks))
+        T = eye(4)
+        for i,joint in enumerate(chainjoints):
+            if joint.GetHierarchyParentLink() == chainlinks[i]:
+                TLeftjoint = self.iksolver.RoundMatrix(self.iksolver.GetMatrixFromNumpy(joint.GetInternalHierarchyLeftTransform()))
+                TRightjoint = self.iksolver.RoundMatrix(self.iksolver.GetMatrixFromNumpy(joint.GetInternalHierarchyRightTransform()))
+                axissign = S.One
+                axes = range(joint.GetDOF())
+            else:
+                TLeftjoint = self.iksolver.affineInverse(self.iksolver.RoundMatrix(self.iksolver.GetMatrixFromNumpy(joint.GetInternalHierarchyRightTransform())))
+                TRightjoint = self.iksolver.affineInverse(self.iksolver.RoundMatrix(self.iksolver.GetMatrixFromNumpy(joint.GetInternalHierarchyLeftTransform())))
+                axissign = -S.One
+                axes = range(joint.GetDOF()-1,-1,-1)
+            T = T * TLeftjoint
+            for iaxis in axes:
+                var = self.GetAxisVariable(joint,iaxis)
+                if var is None:
+                    continue
+                Tj = eye(4)
+                jaxis = axissign*self.iksolver.numpyVectorToSympy(joint.GetInternalHierarchyAxis(iaxis))
+                if joint.IsRevolute(iaxis):
+                    Tj[0:3,0:3] = self.iksolver.rodrigues(jaxis,var)
+                elif joint.IsPrismatic(iaxis):
+                    Tj[0:3,3] = jaxis*var
                 else:
-                    Ttrans[j,3] = separated_trans[j]
-            Links[iright+1] = Ttrans * Links[iright+1]
-            Links[iright-1] = Links[iright-1] * self.iksolver.affineInverse(Ttrans)
-            print "moved translation ",Ttrans[0:3,3].transpose(),"to right end"
-        
-        if len(jointinds) > 1:
-            ileft = jointinds[0]
-            separated_trans = Links[ileft][0:3,0:3] * Links[ileft+1][0:3,3]
-            Ttrans = eye(4)
-            for j in range(0,3):
-                if not separated_trans[j].has_any_symbols(*jointvars):
-                    Ttrans[j,3] = separated_trans[j]
-            Links[ileft-1] = Links[ileft-1] * Ttrans
-            Links[ileft+1] = self.iksolver.affineInverse(Ttrans) * Links[ileft+1]
-            print "moved translation ",Ttrans[0:3,3].transpose(),"to left end"
-
-        if len(jointinds) > 3: # last 3 axes always have to be intersecting, move the translation of the first axis to the left
-            ileft = jointinds[-3]
-            separated_trans = Links[ileft][0:3,0:3] * Links[ileft+1][0:3,3]
-            Ttrans = eye(4)
-            for j in range(0,3):
-                if not separated_trans[j].has_any_symbols(*jointvars):
-                    Ttrans[j,3] = separated_trans[j]
-            Links[ileft-1] = Links[ileft-1] * Ttrans
-            Links[ileft+1] = self.iksolver.affineInverse(Ttrans) * Links[ileft+1]
-            print "moved translation on intersecting axis ",Ttrans[0:3,3].transpose(),"to left"
-
-        return Links, jointvars, isolvejointvars, ifreejointvars
-
-    def IsHinge(self,jointname):
-        j = self.kinbody.GetJoint(jointname)
-        if j is not None:
-            return j.GetType()==openravepy.KinBody.Joint.Type.Hinge
-        if jointname.startswith('dummy') >= 0:
-            return False
-        return True # dummy joint most likely for angles
-
-    def isZero(self,eq,vars,num=8):
-        for i in range(num):
-            subs = [(v,numpy.random.rand()) for v in vars]
-            eq2=self.iksolver.chop(eq.subs(subs).evalf()).evalf()
-            if eq2 == S.Zero:
-                return True
-        return False
-
-    def SolveFK(self):
-        knot = 2
-        knownlinks = [0]
-        knotlink = self.kinbody.GetLinks()[knot]
-        loops = self.kinbody.GetClosedLoops()
-
-        # compute known link transformations at this point
-        knownlink = self.kinbody.GetLinks()[knownlinks[0]]
-        pathstoknot = [(self.kinbody.GetChain(knownlink.GetIndex(),knot,returnjoints=False), self.kinbody.GetChain(knownlink.GetIndex(),knot,returnjoints=True))]
-        for loop in loops:
-            lknotindex = [i for i,(link,joint) in enumerate(loop) if link.GetIndex() == knot]
-            lknownindex = [i for i,(link,joint) in enumerate(loop) if link == knownlink]
-            if len(lknotindex) > 0 and len(lknownindex) > 0:
-                knotindex = lknotindex[0]
-                knownindex = lknownindex[0]
-                if knownindex < knotindex:
-                    subloop = loop[knownindex:(knotindex+1)]
-                    path = ([l for l,j in subloop],[j for l,j in subloop[:-1]])
-                    if not path in pathstoknot:
-                        pathstoknot.append(path)
-                    subloop = loop[knownindex::-1]+loop[:knotindex:-1]+[loop[knotindex]]
-                    path = ([l for l,j in subloop],[j for l,j in subloop[1:]])
-                    if not path in pathstoknot:
-                        pathstoknot.append(path)
+                    raise ValueError('failed to process joint %s'%joint.GetName())
+                T = T * Tj
+            T = T * TRightjoint
+        return T
+
+    def GetLoopPaths(self,loop):
+        """splits a closed loop into the two paths that go from the loop link closest to the base link to the link on the opposite side of the loop.
+
+        :param loop: list of (link,joint) returned by KinBody.GetClosedLoops, the joint connects the link with the next link of the loop
+        :return: two (links,joints) paths, both starting and ending on the same links
+        """
+        depths = [len(self.kinbody.GetChain(self.baselink.GetIndex(),link.GetIndex(),returnjoints=True)) for link,joint in loop]
+        ianchor = depths.index(min(depths))
+        loop = loop[ianchor:]+loop[:ianchor]
+        iknot = len(loop)/2
+        path0 = ([link for link,joint in loop[:iknot+1]], [joint for link,joint in loop[:iknot]])
+        backindices = range(len(loop)-1,iknot-1,-1)
+        path1 = ([loop[0][0]]+[loop[i][0] for i in backindices], [loop[i][1] for i in backindices])
+        return path0,path1
+
+    def GetUnknownVariables(self,paths,solvedvars):
+        """returns the passive variables of the paths that have not been solved yet
+        """
+        unknownvars = []
+        for links,joints in paths:
+            for joint in joints:
+                for iaxis in range(joint.GetDOF()):
+                    var = self._passivevars.get((joint.GetName(),iaxis),None)
+                    if var is not None and not var in solvedvars and not var in unknownvars:
+                        unknownvars.append(var)
+        return unknownvars
+
+    def SolveFK(self,baselink=None):
+        """solves the passive joints of all the closed loops, and then the transforms of all the links.
+
+        :param baselink: the link the transforms are relative to, by default the first link of the robot
+        :return: the list of symbolic 4x4 transforms, one for every link of the robot
+        """
+        if baselink is None:
+            baselink = self.kinbody.GetLinks()[0]
+        self.baselink = baselink
+        self.passiveequations = []
+        self.linkequations = []
+        solvedvars = set()
+        with self.kinbody:
+            unsolvedpaths = [self.GetLoopPaths(loop) for loop in self.kinbody.GetClosedLoops()]
+            while len(unsolvedpaths) > 0:
+                # solve the loops with the least unknowns first, their passive variables are known when solving the rest
+                unsolvedpaths.sort(key=lambda paths: len(self.GetUnknownVariables(paths,solvedvars)))
+                paths = unsolvedpaths.pop(0)
+                unknownvars = self.GetUnknownVariables(paths,solvedvars)
+                if len(unknownvars) == 0:
+                    continue
+                for var,expr in self.solveLoop(paths,unknownvars):
+                    self.passiveequations.append((var,expr))
+                    solvedvars.add(var)
+
+            for link in self.kinbody.GetLinks():
+                if link == baselink:
+                    T = eye(4)
                 else:
-                    assert False # not implemented yet
-
-        pathseqs = []
-        for path in pathstoknot:
-            Links, jointvars, isolvejointvars, ifreejointvars = self.forwardKinematicsChain(path[0],path[1])
-            Tfirstleft = Links.pop(0)
-            Tfirstright = Links.pop()
-            LinksInv = [self.iksolver.affineInverse(link) for link in Links]
-            #Tee = Tfirstleft.inv() * Tee_in * Tfirstright.inv()
-            # LinksAccumLeftInv[x] * Tee = LinksAccumRight[x]
-            # LinksAccumLeftInv[x] = InvLinks[x-1] * ... * InvLinks[0]
-            # LinksAccumRight[x] = Links[x]*Links[x+1]...*Links[-1]
-            LinksAccumLeftInvAll = [eye(4)]
-            LinksAccumRightAll = [eye(4)]
-            for i in range(len(Links)):
-                LinksAccumLeftInvAll.append(LinksInv[i]*LinksAccumLeftInvAll[-1])
-                LinksAccumRightAll.append(Links[len(Links)-i-1]*LinksAccumRightAll[-1])
-            LinksAccumRightAll.reverse()
-            pathseqs.append([self.iksolver.affineSimplify(LinksAccumRightAll[0]),self.iksolver.affineSimplify(LinksAccumLeftInvAll[-1]),[Tfirstleft,Tfirstright],jointvars,isolvejointvars,ifreejointvars])
-
-        alljointvars = set()
-        for patheqs in pathseqs:
-            alljointvars = alljointvars.union(patheqs[3])
-        alljoints = [self.kinbody.GetJoint(var.name) for var in alljointvars]
-        solvejointvars = list(alljointvars)
-
-        # take all joints with a dof index as the free dof
-        possiblefreevars = [v for v in alljointvars if self.kinbody.GetJoint(v.name).GetDOFIndex()>=0]
-        unknownvars = solvejointvars[:]
-        for v in possiblefreevars:
-            unknownvars.remove(v)
-        unknownsubs = []
-        for v in unknownvars:
-            if self.IsHinge(v.name):
-                unknownsubs += [(cos(v),Symbol('c%s'%v.name)),(sin(v),Symbol('s%s'%v.name))]
-
-        Equations = []
-        eliminatevargroups = []
-        MUL=Symbol('MUL')
-        for patheqs0,patheqs1 in combinations(pathseqs,2):
-            Tleft0,Tright0 = patheqs0[2]
-            T0,T0inv = patheqs0[0:2]
-            Tleft1,Tright1 = patheqs1[2]
-            T1,T1inv = patheqs1[0:2]
-            Tleft = self.iksolver.affineInverse(Tleft1)*Tleft0
-            Tright = Tright0 * self.iksolver.affineInverse(Tright1)
-            PolyEquations,numminvars = self.iksolver.buildRaghavanRothEquations(Tleft*T0*Tright, T1,unknownvars)
-            Equations2 = [[eq[0].as_basic().expand(),eq[1].as_basic().expand()] for eq in PolyEquations]
-            Equations += Equations2
-            for vars in [patheqs0[3],patheqs1[3]]:
-                eliminatevargroup = []
-                for eq0,eq1 in Equations2:
-                    if eq0.has_any_symbols(*vars):
-                        if eq0 != S.Zero and eq0.count_ops() == 1 or eq0.count_ops() == 2+MUL:
-                            eliminatevargroup.append((eq0,eq1,int(eq0.count_ops().subs(MUL,4).evalf())))
-                if len(eliminatevargroup) > 0:
-                    eliminatevargroup.sort(lambda x,y: -x[2]+y[2])
-                    eliminatevargroups.append(eliminatevargroup)
-
-        reducesubs = []
-        for var in solvejointvars:
-            if self.IsHinge(var.name):
-                reducesubs.append((sin(var)**2,1-cos(var)**2))
-        # create the length equations by moving the coordinate systems
-        for patheqs,path in izip(pathseqs,pathstoknot):
-            # find an appropriate coordinate system
-            baselink,basejoint = path[0][0],path[1][0]
-            endlink,endjoint = path[0][-1],path[1][-1]
-            if basejoint.GetHierarchyChildLink() == baselink:
-                Tleft = self.numpyMatrixToSympy(basejoint.GetInternalHierarchyRightTransform())
-            elif basejoint.GetHierarchyParentLink() == baselink:
-                Tleft = self.iksolver.affineInverse(self.numpyMatrixToSympy(basejoint.GetInternalHierarchyLeftTransform()))
-            else:
-                Tleft = eye(4)
-            if endjoint.GetHierarchyChildLink() == endlink:
-                Tright = self.iksolver.affineInverse(self.numpyMatrixToSympy(endjoint.GetInternalHierarchyRightTransform()))
-            elif endjoint.GetHierarchyParentLink() == endlink:
-                Tright = self.numpyMatrixToSympy(endjoint.GetInternalHierarchyLeftTransform())
-            else:
-                Tright = eye(4)
-            Lengths = []
-            for patheqs2 in pathseqs:
-                T = Tleft*patheqs2[2][0]*patheqs2[0]*patheqs2[2][1]*Tright
-                pos = T[0:3,3]
-                eq = (pos[0]**2+pos[1]**2+pos[2]**2).expand().subs(reducesubs).expand()
-                if self.iksolver.codeComplexity(eq) < 1500:
-                    # sympy's trigsimp/customtrigsimp give up too easily
-                    eq = self.iksolver.chop(self.iksolver.customtrigsimp(self.iksolver.customtrigsimp(self.iksolver.customtrigsimp(eq)).expand()))
-                    if self.iksolver.isExpressionUnique(Lengths,eq) and self.iksolver.isExpressionUnique(Lengths,-eq):
-                        Lengths.append(eq.expand())
-            for l0,l1 in combinations(Lengths,2):
-                Equations.append([l0,l1])
-
-        AllEquations = [eq[0]-eq[1] for eq in Equations]
-        self.iksolver.sortComplexity(AllEquations)
-        reducedeqs = []
-        i = 0
-        while i < len(AllEquations):
-            reducedeq = self.iksolver.removecommonexprs(AllEquations[i])
-            if self.iksolver.isExpressionUnique(reducedeqs,reducedeq) and self.iksolver.isExpressionUnique(reducedeqs,-reducedeq):
-                reducedeqs.append(reducedeq)
-                i += 1
-            else:
-                eq=AllEquations.pop(i)
-
-        # make all possible substitutions, not certain how many new constraints this introduces
-#         OrgEquations = AllEquations[:]
-#         for eliminatevargroup in eliminatevargroups[0:1]:
-#             usedvars = [var for var in unknownvars if any([eq[0].has_any_symbols(var) for eq in eliminatevargroup])]
-#             for eq in OrgEquations:
-#                 if not eq.has_any_symbols(*usedvars):
-#                     continue
-#                 for oldvalue,newvalue,rank in eliminatevargroup:
-#                     eq = eq.subs(oldvalue,newvalue)
-#                 eq = self.iksolver.chop(eq.expand(),accuracy=self.iksolver.accuracy)
-#                 reducedeq = self.iksolver.removecommonexprs(eq)
-#                 if self.chop(eq,accuracy=self.iksolver.accuracy*1000) != S.Zero and self.iksolver.isExpressionUnique(reducedeqs,reducedeq):
-#                     AllEquations.append(eq)
-#                     reducedeqs.append(reducedeq)
-
-        # see if all hinge joints are on the same plane (allows us to simplify things a lot)
-        axes = [j.GetAxis(0) for j in alljoints if j.GetType() == openravepy.KinBody.Joint.Type.Hinge]
-        isplanar = all([abs(dot(axis,axes[0]))>0.999999 for axis in axes])
-        if isplanar:
-            print 'robot is planar, adding sum of angles of all loops'
-            angleeqs = []
-            commonaxis = None
-            for patheqs in pathseqs:
-                vars=patheqs[3]
-                R = (patheqs[2][0]*patheqs[0]*patheqs[2][1])[0:3,0:3]
-                valuesubs = [[var,S.Zero] for var in vars]
-                R0 = R.subs(valuesubs).evalf()
-                axes = []
-                # to find the angle signs, test pi/2 for each value
-                for i in range(len(vars)):
-                    valuesubs[i][1] = pi/2
-                    R1 = R.subs(valuesubs)
-                    valuesubs[i][1] = S.Zero
-                    Rdelta=R0.transpose()*R1
-                    axes.append(axisAngleFromRotationMatrix(Rdelta.tolist()))
-                if commonaxis == None:
-                    commonaxis = axes[0]
-                angleeq = S.Zero
-                for i,var in enumerate(vars):
-                    if self.IsHinge(var.name):
-                        angleeq += sign(commonaxis[0]*axes[i][0]+commonaxis[1]*axes[i][1]+commonaxis[2]*axes[i][2]) * var
-                angleeqs.append(angleeq)
-            for angeq0,angeq1 in combinations(angleeqs,2):
-                AllEquations.append(angeq0-angeq1)
+                    chainlinks = self.kinbody.GetChain(baselink.GetIndex(),link.GetIndex(),returnjoints=False)
+                    chainjoints = self.kinbody.GetChain(baselink.GetIndex(),link.GetIndex(),returnjoints=True)
+                    if len(chainlinks) == 0:
+                        raise ikfast.IKFastSolver.CannotSolveError('link %s is not connected to %s'%(link.GetName(),baselink.GetName()))
+                    T = self.forwardKinematicsChain(chainlinks,chainjoints)
+                unsolved = [var for var in T.free_symbols if var.name in self.passiveaxes and not var in solvedvars]
+                if len(unsolved) > 0:
+                    raise ikfast.IKFastSolver.CannotSolveError('passive joints %s of link %s are not part of any closed loop'%(unsolved,link.GetName()))
+                self.linkequations.append(T)
+        log.info('forward kinematics solved for %d links and %d passive joints',len(self.linkequations),len(self.passiveequations))
+        return self.linkequations
+
+    def solveLoop(self,paths,unknownvars):
+        """solves the passive variables of one closed loop by equating the transforms of its two paths.
+
+        :return: list of (var,expr) in evaluation order
+        """
+        T0 = self.forwardKinematicsChain(*paths[0])
+        T1 = self.forwardKinematicsChain(*paths[1])
+        knownvars = sorted([var for var in T0.free_symbols.union(T1.free_symbols) if not var in unknownvars],key=lambda var: var.name)
+        trigvars = [var for var in knownvars+unknownvars if self.IsHinge(var.name)]
+        AllEquations = []
+        for i in range(12):
+            eq = self.iksolver.RoundEquationTerms((T0[i]-T1[i]).expand())
+            if eq != S.Zero and self.iksolver.CheckExpressionUnique(AllEquations,eq):
+                AllEquations.append(eq)
+        # the distance between the first and last links of the paths does not depend on the rotations, usually the simplest equation of the loop
+        eq = T0[0:3,3].dot(T0[0:3,3]) - T1[0:3,3].dot(T1[0:3,3])
+        eq = self.iksolver.RoundEquationTerms(self.iksolver.trigsimp(eq.expand(),trigvars).expand())
+        if eq != S.Zero and self.iksolver.CheckExpressionUnique(AllEquations,eq):
+            AllEquations.append(eq)
         self.iksolver.sortComplexity(AllEquations)
 
-        # do a sanity check
-        maxvalue = max([eq.subs(allsubs).evalf() for eq in AllEquations])
-        # maybe too strict?
-        assert(maxvalue < 5e-10)
-        if maxvalue > self.iksolver.accuracy:
-            self.iksolver.accuracy = maxvalue*1.1
-            print 'setting new accuracy to: ',self.iksolver.accuracy
-            AllEquations = [self.iksolver.chop(eq,accuracy=maxvalue*2) for eq in AllEquations]
-            self.iksolver.sortComplexity(AllEquations)
-
-        # pick free variables until equations become solvable
-        try:
-            endbranchtree = [openravepy.ikfast.SolverStoreSolution (jointvars)]
-            solsubs = []
-            for v in possiblefreevars:
-                if self.IsHinge(v.name):
-                    solsubs += [(cos(v),Symbol('c%s'%v.name)),(sin(v),Symbol('s%s'%v.name))]
-            tree = self.iksolver.solveAllEquations(AllEquations,curvars=unknownvars,othersolvedvars=possiblefreevars,solsubs=solsubs,endbranchtree=endbranchtree)
-            print 'forward kinematics solved, setting equations!'
-            self.setMimicEquations(tree)
-            return tree
-        except self.iksolver.CannotSolveError:
-            pass
-            
-        return None
-
-    def setMimicEquations(self,tree):
-        # sometimes there are multiple solutions to variables, do sanity checks knowing the initial values of the robot
-        pass
-    
-
-def test_bobcat():
-    env.Reset()
-    env.StopSimulation()
-    robot = env.ReadRobotXMLFile('arm_bucket_assy.robot.xml')
-    env.AddRobot(robot)
-
-    import fkfast
-    from fkfast import FKFastSolver
-    fksolver = fkfast.FKFastSolver(robot)
-    self=fksolver
-
-    P0 = Symbol('P0')
-    P1 = Symbol('P1')
-    P2 = Symbol('P2')
-    P3 = Symbol('P3')
-    P4 = Symbol('P4')
-    P5 = Symbol('P5')
-    A=Symbol('A')
-    curvars=[P0,P5,A]
-    othersolvedvars=[P1,P2,P3,P4]
-    solsubs=[]
-    for v in othersolvedvars:
-        solsubs.append((cos(v),Symbol('c%s'%v.name)))
-        solsubs.append((sin(v),Symbol('s%s'%v.name)))
-    othersolvedvars.append(A)
-    cursubs = []
-    for v in othersolvedvars:
-        if robot.GetJoint(v.name) is not None:
-            value = robot.GetJoint(v.name).GetValues()[0]
-        else:
-            value = 0
-        cursubs += [(v,value),(Symbol('c%s'%v.name,),cos(value).evalf()), (Symbol('s%s'%v.name,),sin(value).evalf())]
-    allsubs = cursubs + [(P0,0)] + [(P5,0)] + [(A,0)]
+        self._InitializeSolver(knownvars,unknownvars)
+        endbranchtree = [ikfast.AST.SolverStoreSolution(unknownvars,isHinge=[self.IsHinge(var.name) for var in unknownvars])]
+        tree = self.iksolver.SolveAllEquations(AllEquations,curvars=unknownvars[:],othersolvedvars=knownvars[:],solsubs=self.iksolver.freevarsubs[:],endbranchtree=endbranchtree)
+        return self._GetLoopSolutions(tree,knownvars,unknownvars)
+
+    def _InitializeSolver(self,knownvars,unknownvars):
+        """sets up the state ikfast.IKFastSolver.generateIkSolver would have set before calling SolveAllEquations. The known variables take the place of the free joints and there is no end effector pose.
+        """
+        iksolver = self.iksolver
+        iksolver.freevarsubs = []
+        iksolver.freevarsubsinv = []
+        iksolver.freevars = []
+        iksolver.freejointvars = []
+        iksolver.invsubs = []
+        for v in knownvars:
+            var = iksolver.Variable(v)
+            iksolver.freevarsubs += [(cos(var.var), var.cvar), (sin(var.var), var.svar)]
+            iksolver.freevarsubsinv += [(var.cvar,cos(var.var)), (var.svar,sin(var.var))]
+            iksolver.freevars += [var.cvar,var.svar]
+            iksolver.freejointvars.append(var.var)
+        for v in unknownvars:
+            var = iksolver.Variable(v)
+            iksolver.invsubs += [(var.cvar,cos(v)),(var.svar,sin(v))]
+        iksolver._solvejointvars = unknownvars
+        iksolver._jointvars = knownvars+unknownvars
+        iksolver.pvars = []
+        iksolver.ppsubs = []
+        iksolver.npxyzsubs = []
+        iksolver.rxpsubs = []
+        iksolver._rotsymbols = []
+        iksolver._rotpossymbols = []
+        iksolver._rotnormgroups = []
+        iksolver._rotposnormgroups = []
+        iksolver._rotdotgroups = []
+        iksolver._rotposdotgroups = []
+        iksolver._rotcrossgroups = []
+        iksolver._rotposcrossgroups = []
+        iksolver.degeneratecases = None
+        iksolver.testconsistentvalues = None
+        iksolver.gsymbolgen = cse_main.numbered_symbols('gconst')
+        iksolver.globalsymbols = []
+        iksolver._scopecounter = 0
+
+    def _GetLoopSolutions(self,tree,knownvars,unknownvars):
+        """picks one closed-form expression for every unknown from the solution tree.
+
+        The tree usually has several branches (elbow up/down of the loop). The mechanism can only be in one of them without disassembling, so the branch closest to the current configuration of the robot is used.
+        """
+        solutionnodes = []
+        for node in tree:
+            if isinstance(node,ikfast.AST.SolverSolution):
+                solutionnodes.append(node)
+            solutionnodes += node.GetChildrenOfType(ikfast.AST.SolverSolution)
+        varsubs = list(reversed(self.iksolver.globalsymbols))
+        for v in knownvars+unknownvars:
+            var = self.iksolver.Variable(v)
+            varsubs += [(var.cvar,cos(v)),(var.svar,sin(v)),(var.tvar,tan(v)),(var.htvar,tan(v/2))]
+        valuesubs = []
+        for v in knownvars+unknownvars:
+            valuesubs.append((v,self._GetCurrentValue(v)))
+
+        # evaluate in the order the solver solved the variables
+        solveorder = []
+        for node in solutionnodes:
+            if node.jointname in [var.name for var in unknownvars] and not node.jointname in solveorder:
+                solveorder.append(node.jointname)
+        if len(solveorder) != len(unknownvars):
+            raise ikfast.IKFastSolver.CannotSolveError('failed to solve passive joints %s'%[var.name for var in unknownvars if not var.name in solveorder])
+        solutions = []
+        for name in solveorder:
+            var = Symbol(name)
+            curvalue = self._GetCurrentValue(var)
+            bestexpr = None
+            besterror = None
+            for node in solutionnodes:
+                if node.jointname != name:
+                    continue
+                nodesubs = list(reversed(node.dictequations))
+                for expr in self._GetSolutionCandidates(node):
+                    expr = expr.subs(nodesubs).subs(varsubs)
+                    try:
+                        value = complex(expr.subs(valuesubs).evalf())
+                    except TypeError:
+                        continue
+                    if abs(value.imag) > 1e-6 or not numpy.isfinite(value.real):
+                        continue
+                    error = value.real-curvalue
+                    if self.IsHinge(name):
+                        error = numpy.arctan2(numpy.sin(error),numpy.cos(error))
+                    if besterror is None or abs(error) < besterror:
+                        bestexpr = expr
+                        besterror = abs(error)
+            if bestexpr is None:
+                raise ikfast.IKFastSolver.CannotSolveError('passive joint %s has no real solution at the current configuration'%name)
+            log.info('passive joint %s solved with error %e at the current configuration',name,besterror)
+            solutions.append((var,bestexpr))
+        return solutions
+
+    @staticmethod
+    def _GetSolutionCandidates(node):
+        candidates = []
+        if node.jointeval is not None:
+            candidates += node.jointeval
+            if node.AddPiIfNegativeEq is not None:
+                candidates += [eq+pi for eq in node.jointeval]
+        if node.jointevalcos is not None:
+            for eq in node.jointevalcos:
+                candidates += [acos(eq),-acos(eq)]
+        if node.jointevalsin is not None:
+            for eq in node.jointevalsin:
+                candidates += [asin(eq),pi-asin(eq)]
+        return candidates
+
+    def _GetCurrentValue(self,var):
+        if var.name in self.passiveaxes:
+            joint,iaxis = self.passiveaxes[var.name]
+            return joint.GetValue(iaxis)
+        return self.kinbody.GetDOFValues([int(var.name[1:])])[0]
+
+    def generateCpp(self):
+        """returns C++ code that computes the link transforms, the math functions come from the ikfast code generator.
+        """
+        generator = ikfast.CodeGenerators['cpp'](kinematicshash=self.kinematicshash,version=ikfast.__version__,iktypestr='fkfast')
+        generator.resetequations()
+        generator.symbolgen = cse_main.numbered_symbols('x')
+        numdofs = self.kinbody.GetDOF()
+        numlinks = len(self.linkequations)
+        dofsubs = [(Symbol('j%d'%i),Symbol('j[%d]'%i)) for i in range(numdofs)]
+        code = generator.getHeaderCode()
+        code += """
+/// forward kinematics generated with fkfast version %s
+IKFAST_API int GetNumLinks() { return %d; }
+
+IKFAST_API int GetNumJoints() { return %d; }
+
+IKFAST_API const char* GetKinematicsHash() { return "%s"; }
+
+IKFAST_API const char* GetFkFastVersion() { return "%s"; }
+
+/// computes the transforms of all the links relative to link %s for numconfigs configurations.
+/// \\param pjoints the values of configuration i are in pjoints[i*GetNumJoints():(i+1)*GetNumJoints()]
+/// \\param ptransforms buffer of numconfigs*GetNumLinks()*12 values. The row-major 3x4 transform of link k of configuration i starts at ptransforms[12*(i*GetNumLinks()+k)].
+/// \\return the number of configurations whose closed loops could be assembled, the transforms of the other configurations are set to NaN.
+/// A configuration cannot be assembled when a passive joint has no real solution, in which case the guards of the generated equations skip it, the clamped math functions throw, or the values become NaN or infinite.
+IKFAST_API int ComputeLinkTransformsBatch(int numconfigs, const IkReal* pjoints, IkReal* ptransforms) {
+int numcomputed = 0;
+for(int iconfig = 0; iconfig < numconfigs; ++iconfig) {
+const IkReal* j = pjoints+iconfig*%d;
+IkReal* t = ptransforms+iconfig*%d;
+std::fill(t, t+%d, numeric_limits<IkReal>::quiet_NaN());
+IkReal tconfig[%d];
+try {
+"""%(__version__,numlinks,numdofs,self.kinematicshash,__version__,self.baselink.GetName(),numdofs,12*numlinks,12*numlinks,12*numlinks)
+        fcode = ''
+        if len(self.passiveequations) > 0:
+            fcode += 'IkReal ' + ','.join(var.name for var,expr in self.passiveequations) + ';\n'
+        for var,expr in self.passiveequations:
+            fcode += generator.writeEquations(lambda k: var.name,expr.subs(dofsubs))
+        if len(self.passiveequations) > 0:
+            # x-x is NaN for both NaN and infinite x
+            fcode += 'if( ' + ' || '.join('isnan(%s-%s)'%(var.name,var.name) for var,expr in self.passiveequations) + ' ) {\ncontinue;\n}\n'
+        exprs = []
+        outputnames = []
+        for ilink,T in enumerate(self.linkequations):
+            for i in range(12):
+                exprs.append(T[i].subs(dofsubs))
+                outputnames.append('tconfig[%d]'%(12*ilink+i))
+        fcode += generator.writeEquations(lambda k: outputnames[k],exprs)
+        code += fcode
+        code += """}
+catch(const std::exception&) {
+// IKacos, IKasin and IKatan2 throw on arguments that cannot come from an assembled configuration, the exception cannot cross the C interface
+continue;
+}
+bool valid = true;
+for(int k = 0; k < %d && valid; ++k) {
+valid = !isnan(tconfig[k]-tconfig[k]);
+}
+if( valid ) {
+std::copy(tconfig, tconfig+%d, t);
+++numcomputed;
+}
+}
+return numcomputed;
+}
+"""%(12*numlinks,12*numlinks)
+        code += """
+/// computes the transforms of the links of one configuration, see ComputeLinkTransformsBatch
+IKFAST_API bool ComputeLinkTransforms(const IkReal* j, IkReal* ptransforms) {
+return ComputeLinkTransformsBatch(1, j, ptransforms) == 1;
+}
+
+#ifdef IKFAST_NAMESPACE
+} // end namespace
+#endif
+"""
+        return code
+
+    def generateNumpy(self):
+        """returns the source of a python module that computes the link transforms of many configurations at once with numpy.
+        """
+        numdofs = self.kinbody.GetDOF()
+        code = cStringIO.StringIO()
+        code.write("""# -*- coding: utf-8 -*-
+# autogenerated forward kinematics from fkfast program part of OpenRAVE
+# fkfast version %s generated on %s
+from __future__ import division
+from numpy import *
+import numpy
+atan = arctan
+atan2 = arctan2
+Abs = abs
+
+kinematicshash = '%s'
+fkfastversion = '%s'
+numlinks = %d
+numdofs = %d
+
+# same tolerances as IKacos, IKasin and the sqrt guards of the C++ code, arguments outside them mean the closed loops cannot be assembled
+sincosthresh = 1e-7
+sqrtthresh = -0.00001
+
+def acos(x):
+    return where(abs(x) > 1+sincosthresh, nan, arccos(clip(x,-1,1)))
+
+def asin(x):
+    return where(abs(x) > 1+sincosthresh, nan, arcsin(clip(x,-1,1)))
+
+def sqrt(x):
+    return where(x < sqrtthresh, nan, numpy.sqrt(maximum(x,0)))
+
+def ComputeLinkTransforms(dofvalues):
+    \"\"\"computes the transforms of all the links relative to link %s.
+
+    :param dofvalues: array of numdofs values, or N x numdofs array of N configurations
+    :return: numlinks x 4 x 4 array, or N x numlinks x 4 x 4 array. The transforms of configurations whose closed loops cannot be assembled are NaN.
+    \"\"\"
+    j = atleast_2d(asarray(dofvalues,float64))
+    Tlinks = zeros((len(j),numlinks,4,4))
+    Tlinks[:,:,3,3] = 1
+"""%(__version__,str(datetime.datetime.now()),self.kinematicshash,__version__,len(self.linkequations),numdofs,self.baselink.GetName()))
+        for i in range(numdofs):
+            code.write('    j%d = j[:,%d]\n'%(i,i))
+        symbolgen = cse_main.numbered_symbols('x')
+        # the passive variables depend on each other, so they cannot share subexpressions with the ones evaluated before them
+        for var,expr in self.passiveequations:
+            self._WriteNumpyEquations(code,[var.name],[expr],symbolgen)
+        names = []
+        exprs = []
+        for ilink,T in enumerate(self.linkequations):
+            for i in range(12):
+                if T[i] != S.Zero:
+                    names.append('Tlinks[:,%d,%d,%d]'%(ilink,i/4,i%4))
+                    exprs.append(T[i])
+        self._WriteNumpyEquations(code,names,exprs,symbolgen)
+        # like the C++ code, every transform of a configuration that cannot be assembled is NaN
+        code.write('    valid = all(isfinite(Tlinks.reshape(len(j),-1)),1)\n')
+        for var,expr in self.passiveequations:
+            code.write('    valid &= isfinite(%s)\n'%var.name)
+        code.write("""    Tlinks[~valid] = nan
+    if asarray(dofvalues).ndim == 1:
+        return Tlinks[0]
+    return Tlinks
+""")
+        return code.getvalue()
+
+    def _WriteNumpyEquations(self,code,names,exprs,symbolgen):
+        replacements,reduced_exprs = ikfast.ikfast_generator_cpp.customcse(exprs,symbols=symbolgen)
+        for var,expr in replacements:
+            code.write('    %s = %s\n'%(var,self._strprinter.doprint(expr)))
+        for name,expr in izip(names,reduced_exprs):
+            code.write('    %s = %s\n'%(name,self._strprinter.doprint(expr)))
+
+def GetFilename(kinematicshash,extension,read=False):
+    """returns the filename of the generated forward kinematics inside the openrave database.
+    """
+    return openravepy.RaveFindDatabaseFile(os.path.join('kinematics.'+kinematicshash,'fkfast%s.%s'%(__version__,extension)),read)
+
+_fkmodules = {} # kinematics hash -> loaded numpy module
+
+def GetForwardKinematicsModule(kinbody,forcegenerate=False,precision=None):
+    """returns the generated numpy module computing the link transforms of kinbody.
+
+    The module is only generated if no module with the same kinematics hash has been loaded or saved to the openrave database. The C++ source is saved next to it.
+    """
+    kinematicshash = kinbody.GetKinematicsGeometryHash()
+    if not forcegenerate and kinematicshash in _fkmodules:
+        return _fkmodules[kinematicshash]
+    filename = GetFilename(kinematicshash,'py',read=True)
+    if forcegenerate or len(filename) == 0:
+        solver = FKFastSolver(kinbody,kinematicshash=kinematicshash,precision=precision)
+        solver.SolveFK()
+        filename = GetFilename(kinematicshash,'py',read=False)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        open(GetFilename(kinematicshash,'cpp',read=False),'w').write(solver.generateCpp())
+        open(filename,'w').write(solver.generateNumpy())
+        log.info('generated forward kinematics %s',filename)
+    fkmodule = imp.load_source('fkfast_'+kinematicshash,filename)
+    _fkmodules[kinematicshash] = fkmodule
+    return fkmodule
@@ -54,35 +54,30 @@ def SimpleInterpolate(q0,q1,qd0,qd1,T):
 
 
 def Concat(traj_list):
-    traj=traj_list.pop(0)
-    while traj_list!=[]:
-        traj=Glue(traj,traj_list.pop(0))
-    return traj
-    
-
-def Glue(traj1,traj2):
+    if len(traj_list)==1:
+        return traj_list[0]
+    # all the pieces are stacked in one pass, each piece but the last one
+    # dropping its final sample (which is the first sample of the next piece)
+    last=len(traj_list)-1
+    offsets=cumsum([0]+[traj.t_vect[-1] for traj in traj_list[0:-1]])
     new_traj=SampleTrajectory()
-    new_traj.dim=traj1.dim
-    new_traj.n_steps=traj1.n_steps+traj2.n_steps-1
-    new_traj.t_step=traj1.t_step
+    new_traj.dim=traj_list[0].dim
+    new_traj.n_steps=sum([traj.n_steps for traj in traj_list])-last
+    new_traj.t_step=traj_list[0].t_step
     new_traj.duration=new_traj.t_step*(new_traj.n_steps-1)
-    new_traj.t_vect=r_[traj1.t_vect[0:-1],traj2.t_vect+traj1.t_vect[-1]]
-    new_traj.q_vect=c_[traj1.q_vect[:,0:-1],traj2.q_vect]
-    new_traj.qd_vect=c_[traj1.qd_vect[:,0:-1],traj2.qd_vect]
-    new_traj.qdd_vect=c_[traj1.qdd_vect[:,0:-1],traj2.qdd_vect]
+    new_traj.t_vect=concatenate([traj.t_vect[0:-1]+offsets[i] for i,traj in enumerate(traj_list[0:-1])]+[traj_list[last].t_vect+offsets[last]])
+    new_traj.q_vect=concatenate([traj.q_vect[:,0:-1] for traj in traj_list[0:-1]]+[traj_list[last].q_vect],axis=1)
+    new_traj.qd_vect=concatenate([traj.qd_vect[:,0:-1] for traj in traj_list[0:-1]]+[traj_list[last].qd_vect],axis=1)
+    new_traj.qdd_vect=concatenate([traj.qdd_vect[:,0:-1] for traj in traj_list[0:-1]]+[traj_list[last].qdd_vect],axis=1)
     return new_traj
+    
+
+def Glue(traj1,traj2):
+    return Concat([traj1,traj2])
 
 
 def reverse_array(a):
-    b=array(a)
-    if len(shape(a))>1:
-        for i in range(a.shape[0]):
-            for j in range(a.shape[1]):
-                b[i,j]=a[i,a.shape[1]-j-1]
-    else:
-        for j in range(len(a)):
-            b[j]=a[len(a)-j-1]
-    return b
+    return array(a[...,::-1])
 
 
 def Reverse(traj):
@@ -101,48 +96,30 @@ def Reverse(traj):
 def Sub(traj,t1,t2=None):
     new_traj=SampleTrajectory()
     new_traj.dim=traj.dim
-    if t2==None:
+    if t2 is None:
         t2=traj.n_steps
     new_traj.n_steps=t2-t1
     new_traj.t_step=traj.t_step
     new_traj.duration=new_traj.t_step*(new_traj.n_steps-1)
-    new_traj.t_vect=traj.t_vect[range(t1,t2)]-traj.t_vect[t1]
-    new_traj.q_vect=traj.q_vect[:,range(t1,t2)]
-    new_traj.qd_vect=traj.qd_vect[:,range(t1,t2)]
-    new_traj.qdd_vect=traj.qdd_vect[:,range(t1,t2)]
+    new_traj.t_vect=traj.t_vect[t1:t2]-traj.t_vect[t1]
+    new_traj.q_vect=array(traj.q_vect[:,t1:t2])
+    new_traj.qd_vect=array(traj.qd_vect[:,t1:t2])
+    new_traj.qdd_vect=array(traj.qdd_vect[:,t1:t2])
     return new_traj    
 
 
 def Insert(traj,i1,i2,trajx):
     n_steps=traj.n_steps    
     t_vect=traj.t_vect
-    q_vect=traj.q_vect
     t_step=traj.t_step
-    qd_vect=traj.qd_vect
-    qdd_vect=traj.qdd_vect
     n_stepsx=trajx.n_steps
     n=i1+(n_steps-i2-1)+n_stepsx
-    
-    t_vect_new=zeros(n)
-    q_vect_new=zeros((traj.dim,n))
-    qd_vect_new=zeros((traj.dim,n))
-    qdd_vect_new=zeros((traj.dim,n))
-
-    t_vect_new[range(i1)]=t_vect[range(i1)]
-    t_vect_new[range(i1,i1+n_stepsx)]=t_vect[i1]+trajx.t_vect
-    t_vect_new[range(i1+n_stepsx,n)]=trajx.t_vect[-1]-trajx.t_vect[0]-(t_vect[i2]-t_vect[i1])+t_vect[range(i2+1,n_steps)]
-
-    q_vect_new[:,range(i1)]=q_vect[:,range(i1)]
-    q_vect_new[:,range(i1,i1+n_stepsx)]=trajx.q_vect
-    q_vect_new[:,range(i1+n_stepsx,n)]=q_vect[:,range(i2+1,n_steps)]
-
-    qd_vect_new[:,range(i1)]=qd_vect[:,range(i1)]    
-    qd_vect_new[:,range(i1,i1+n_stepsx)]=trajx.qd_vect
-    qd_vect_new[:,range(i1+n_stepsx,n)]=qd_vect[:,range(i2+1,n_steps)]
-    
-    qdd_vect_new[:,range(i1)]=qdd_vect[:,range(i1)]
-    qdd_vect_new[:,range(i1,i1+n_stepsx)]=trajx.qdd_vect
-    qdd_vect_new[:,range(i1+n_stepsx,n)]=qdd_vect[:,range(i2+1,n_steps)]
+
+    t_shift=trajx.t_vect[-1]-trajx.t_vect[0]-(t_vect[i2]-t_vect[i1])
+    t_vect_new=concatenate([t_vect[0:i1],t_vect[i1]+trajx.t_vect,t_shift+t_vect[i2+1:n_steps]])
+    q_vect_new=concatenate([traj.q_vect[:,0:i1],trajx.q_vect,traj.q_vect[:,i2+1:n_steps]],axis=1)
+    qd_vect_new=concatenate([traj.qd_vect[:,0:i1],trajx.qd_vect,traj.qd_vect[:,i2+1:n_steps]],axis=1)
+    qdd_vect_new=concatenate([traj.qdd_vect[:,0:i1],trajx.qdd_vect,traj.qdd_vect[:,i2+1:n_steps]],axis=1)
 
     new_traj=SampleTrajectory()
     new_traj.n_steps=n
@@ -157,6 +134,16 @@ def Insert(traj,i1,i2,trajx):
     return new_traj
 
 
+def finite_difference(x_vect,t_step):
+    """Forward differences along the time axis, the last sample repeats the
+    last difference
+    """
+    xd_vect=zeros(x_vect.shape)
+    xd_vect[:,0:-1]=diff(x_vect,axis=1)/t_step
+    xd_vect[:,-1]=xd_vect[:,-2]
+    return xd_vect
+
+
 
 ####################### Trajectory classes ##############################
 
@@ -179,24 +166,18 @@ class MintimeTrajectory():
 
         return sample_traj
 
+    def value_vect(self,t_vect):
+        n_samples=len(t_vect)
+        r=zeros((self.dim,n_samples))
+        for i in range(n_samples):
+            r[:,i]=self.value(t_vect[i])
+        return r
+
     def ResampleTraj(self,s_vect,sdot_vect,t_step):
         n=len(s_vect)
-        q_vect=zeros((self.dim,n))
-        qd_vect=zeros((self.dim,n))
-        qdd_vect=zeros((self.dim,n))
-
-        for i in range(n):
-            q_vect[:,i]=self.value(s_vect[i])
-
-        for i in range(0,n-1):
-            qd_vect[:,i]=(q_vect[:,i+1]-q_vect[:,i])/t_step
-        qd_vect[:,n-1]=(q_vect[:,n-1]-q_vect[:,n-2])/t_step
-        
-
-        for i in range(0,n-1):
-            qdd_vect[:,i]=(qd_vect[:,i+1]-qd_vect[:,i])/t_step
-        qdd_vect[:,n-1]=(qd_vect[:,n-1]-qd_vect[:,n-2])/t_step
-        
+        q_vect=self.value_vect(asarray(s_vect))
+        qd_vect=finite_difference(q_vect,t_step)
+        qdd_vect=finite_difference(qd_vect,t_step)
 
         new_traj=SampleTrajectory()
         new_traj.n_steps=n
@@ -215,11 +196,11 @@ class MintimeTrajectory():
 class SampleTrajectory(MintimeTrajectory):
     
     def __init__(self,t_vect=None,q_vect=None,qd_vect=None,qdd_vect=None):
-        if t_vect!=None:
+        if t_vect is not None:
             self.t_vect=t_vect
             self.t_step=t_vect[1]-t_vect[0]
             self.duration=t_vect[-1]-t_vect[0]
-        if q_vect!=None:
+        if q_vect is not None:
             (dim,n_steps)=shape(q_vect)
             self.q_vect=q_vect
             self.dim=dim
@@ -235,6 +216,16 @@ class SampleTrajectory(MintimeTrajectory):
             return q_vect[:,i]
         r=(s-t_vect[i-1])/(t_vect[i]-t_vect[i-1])
         return (1-r)*q_vect[:,i-1]+r*q_vect[:,i] 
+
+    def value_vect(self,s_vect):
+        t_vect=self.t_vect
+        i=searchsorted(t_vect,s_vect,side='left')
+        # i==0 returns the first sample, same as value()
+        i0=maximum(i-1,0)
+        i1=maximum(i,1)
+        r=(s_vect-t_vect[i0])/(t_vect[i1]-t_vect[i0])
+        r[i==0]=0
+        return (1-r)*self.q_vect[:,i0]+r*self.q_vect[:,i1]
        
 
 
@@ -253,21 +244,45 @@ class SplineInterpolateTrajectory(MintimeTrajectory):
             q_vect[i]=der[0]
         return q_vect 
 
+    def value_vect(self,t_vect):
+        return array([spline(t_vect) for spline in self.splines_list])
+
     def val_vel_acc_vect(self,t_vect):
-        n_steps=len(t_vect)
-        new_q_vect=zeros((self.dim,n_steps))
-        new_qd_vect=zeros((self.dim,n_steps))
-        new_qdd_vect=zeros((self.dim,n_steps))
-        for i in range(self.dim):
-            for j in range(n_steps):
-                der=self.splines_list[i].derivatives(t_vect[j])
-                new_q_vect[i,j]=der[0]
-                new_qd_vect[i,j]=der[1]
-                new_qdd_vect[i,j]=der[2]
+        # one splev call per dof and derivative order over the whole time vector
+        new_q_vect=array([spline(t_vect) for spline in self.splines_list])
+        new_qd_vect=array([spline(t_vect,1) for spline in self.splines_list])
+        new_qdd_vect=array([spline(t_vect,2) for spline in self.splines_list])
         return [new_q_vect,new_qd_vect,new_qdd_vect]
 
  
 
+def horner_eval(coefs,i_vect,dt_vect):
+    """Evaluates the polynomials coefs[i_vect] at dt_vect
+
+    coefs -- array of shape (n_pieces,dim,order), highest degree first (poly1d convention)
+    i_vect -- piece index of each sample
+    dt_vect -- time of each sample relative to the start of its piece
+
+    Returns an array of shape (dim,n_samples)
+    """
+    c=coefs[i_vect]
+    r=array(c[:,:,0])
+    for k in range(1,coefs.shape[2]):
+        r*=dt_vect[:,newaxis]
+        r+=c[:,:,k]
+    return r.T
+
+
+def coefs_derivative(coefs):
+    """Coefficient array of the derivatives of coefs, same layout as horner_eval
+    """
+    order=coefs.shape[2]
+    if order<=1:
+        return zeros((coefs.shape[0],coefs.shape[1],1))
+    return coefs[:,:,0:-1]*arange(order-1,0,-1)
+
+
+
 class PieceWisePolyTrajectory(MintimeTrajectory):
 
     def evaluate_list(self,l,t):
@@ -284,25 +299,35 @@ class PieceWisePolyTrajectory(MintimeTrajectory):
         self.accelerations_list=map(lambda x:map(polyder,x),self.velocities_list)
         self.durations_list=durations_list
         self.duration=sum(durations_list)
+        # compact (n_pieces,dim,order) coefficient arrays, zero-padded on the
+        # high degree side since poly1d strips the leading zeros
+        order=max([len(p.coeffs) for pieces in pieces_list for p in pieces])
+        self.coefs=zeros((self.n_pieces,self.dim,order))
+        for i,pieces in enumerate(pieces_list):
+            for j,p in enumerate(pieces):
+                self.coefs[i,j,order-len(p.coeffs):]=p.coeffs
+        self.vel_coefs=coefs_derivative(self.coefs)
+        self.acc_coefs=coefs_derivative(self.vel_coefs)
+        self.t_ends=cumsum(durations_list)
+        self.t_starts=r_[0,self.t_ends[0:-1]]
 
     def find_piece(self,t):
-        t_cur=0
-        for i in range(self.n_pieces):
-            t_cur+=self.durations_list[i]
-            if t_cur>=t-1e-10:
-                return [i,t_cur-self.durations_list[i]]
-        raise NameError('t larger than total duration')
+        i=searchsorted(self.t_ends,t-1e-10,side='left')
+        if i>=self.n_pieces:
+            raise NameError('t larger than total duration')
+        return [i,self.t_starts[i]]
+
+    def find_pieces(self,t_vect):
+        i_vect=searchsorted(self.t_ends,asarray(t_vect)-1e-10,side='left')
+        if len(i_vect)>0 and i_vect.max()>=self.n_pieces:
+            raise NameError('t larger than total duration')
+        return [i_vect,t_vect-self.t_starts[i_vect]]
 
     def val_vel_acc_vect(self,t_vect):
-        n_samples=t_vect.shape[0]
-        r_val=zeros((self.dim,n_samples))
-        r_vel=zeros((self.dim,n_samples))
-        r_acc=zeros((self.dim,n_samples))
-        for i in range(n_samples):
-            [val,vel,acc]=self.val_vel_acc(t_vect[i])
-            r_val[:,i]=val
-            r_vel[:,i]=vel
-            r_acc[:,i]=acc
+        [i_vect,dt_vect]=self.find_pieces(t_vect)
+        r_val=horner_eval(self.coefs,i_vect,dt_vect)
+        r_vel=horner_eval(self.vel_coefs,i_vect,dt_vect)
+        r_acc=horner_eval(self.acc_coefs,i_vect,dt_vect)
         return [r_val,r_vel,r_acc]
 
     ########## Not mandatory ##########
@@ -326,25 +351,16 @@ class PieceWisePolyTrajectory(MintimeTrajectory):
         return [val,vel,acc]
 
     def value_vect(self,t_vect):
-        n_samples=t_vect.shape[0]
-        r=zeros((self.dim,n_samples))
-        for i in range(n_samples):
-            r[:,i]=self.value(t_vect[i])
-        return r
+        [i_vect,dt_vect]=self.find_pieces(t_vect)
+        return horner_eval(self.coefs,i_vect,dt_vect)
 
     def velocity_vect(self,t_vect):
-        n_samples=t_vect.shape[0]
-        r=zeros((self.dim,n_samples))
-        for i in range(n_samples):
-            r[:,i]=self.velocity(t_vect[i])
-        return r
+        [i_vect,dt_vect]=self.find_pieces(t_vect)
+        return horner_eval(self.vel_coefs,i_vect,dt_vect)
 
     def acceleration_vect(self,t_vect):
-        n_samples=t_vect.shape[0]
-        r=zeros((self.dim,n_samples))
-        for i in range(n_samples):
-            r[:,i]=self.acceleration(t_vect[i])
-        return r
+        [i_vect,dt_vect]=self.find_pieces(t_vect)
+        return horner_eval(self.acc_coefs,i_vect,dt_vect)
 
 
 
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Rosen Diankov <rosen.diankov@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmarks of the quaternion/pose array functions of openravepy_ext.
+
+Every function is timed for array sizes from 10 to 10^7, once allocating its result and once writing into preallocated out (and work) buffers.
+
+.. code-block:: bash
+
+  python geometrybenchmark.py --maxsize=10000000
+"""
+from openravepy.openravepy_ext import quatArrayTMult, quatMultArrayT, quatRotateArrayT, poseMultArrayT, ComputePoseArrayDistSqr
+from optparse import OptionParser
+import numpy, time
+
+def randquats(N):
+    q = numpy.random.randn(N,4)
+    q /= numpy.sqrt(numpy.sum(q**2,1))[:,numpy.newaxis]
+    return q
+
+def timeit(fn,mintime):
+    """returns the seconds per call of fn, calls it for at least mintime seconds"""
+    fn() # warm up
+    numcalls = 0
+    starttime = time.time()
+    while True:
+        fn()
+        numcalls += 1
+        elapsed = time.time()-starttime
+        if elapsed >= mintime:
+            return elapsed/numcalls
+
+def GetBenchmarks(N):
+    """returns a list of (name, allocating function, function writing into preallocated buffers)"""
+    q = randquats(1)[0]
+    pose = numpy.r_[q,numpy.random.randn(3)]
+    qarray = randquats(N)
+    transarray = numpy.random.randn(N,3)
+    posearray = numpy.c_[randquats(N),numpy.random.randn(N,3)]
+    out1 = numpy.empty(N)
+    out3 = numpy.empty((N,3))
+    out4 = numpy.empty((N,4))
+    out7 = numpy.empty((N,7))
+    return [('quatArrayTMult', lambda: quatArrayTMult(qarray,q), lambda: quatArrayTMult(qarray,q,out=out4)),
+            ('quatMultArrayT', lambda: quatMultArrayT(q,qarray), lambda: quatMultArrayT(q,qarray,out=out4)),
+            ('quatRotateArrayT', lambda: quatRotateArrayT(q,transarray), lambda: quatRotateArrayT(q,transarray,out=out3)),
+            ('poseMultArrayT', lambda: poseMultArrayT(pose,posearray), lambda: poseMultArrayT(pose,posearray,out=out7)),
+            ('ComputePoseArrayDistSqr', lambda: ComputePoseArrayDistSqr(pose,posearray,0.5), lambda: ComputePoseArrayDistSqr(pose,posearray,0.5,out=out1,work=out7))]
+
+if __name__ == "__main__":
+    parser = OptionParser(description='Micro-benchmarks of the quaternion/pose array functions')
+    parser.add_option('--maxsize', action='store', type='int', dest='maxsize',default=10000000,
+                      help='Largest array size to benchmark, the sizes go up by factors of 10 starting at 10 (default=%default).')
+    parser.add_option('--mintime', action='store', type='float', dest='mintime',default=0.2,
+                      help='Minimum time (s) to measure each function for each size (default=%default).')
+    (options, args) = parser.parse_args()
+    print '%-24s %10s %14s %14s %8s'%('function','N','alloc (s)','out (s)','speedup')
+    N = 10
+    while N <= options.maxsize:
+        for name,fnalloc,fnout in GetBenchmarks(N):
+            timealloc = timeit(fnalloc,options.mintime)
+            timeout = timeit(fnout,options.mintime)
+            print '%-24s %10d %14.4e %14.4e %8.2f'%(name,N,timealloc,timeout,timealloc/timeout)
+        N *= 10
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Rosen Diankov <rosen.diankov@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parallel accuracy and timing benchmark of the ikfast solvers.
+
+Every (robot, manipulator, iktype, freeindices) combination is a job run in its own process, so a crash or a hanging ik generation only loses that job. Each job generates or loads the ik, runs DebugIK and PerfTiming through the ikfast module and returns one record with the success, wrong-solution, no-solution and missing-solution rates and the latency percentiles. The main process appends the records as json lines to the results file as soon as they finish.
+
+The results file is also the cache of the next run: a job whose generated ik source and test options did not change since its last record is not tested again. Use --force to rerun everything.
+
+.. code-block:: bash
+
+  python ikfastbenchmark.py --robots=basic -j 8 --results=ikfastbenchmark.jsonl
+
+The results can be turned into the robot database pages with docs/build_ikdatabase.py --ikbenchmark=ikfastbenchmark.jsonl
+"""
+from openravepy import *
+from openravepy import ikfast
+from numpy import *
+from optparse import OptionParser
+from itertools import combinations
+from traceback import format_exc
+import os, sys, time, logging, multiprocessing, hashlib, json
+from Queue import Empty
+
+log = logging.getLogger('ikfastbenchmark')
+
+def GetRobotFilenames(robots):
+    """expands a comma separated list of robot groups/filenames into the robot filenames
+    """
+    robotfilenames = []
+    for robot in robots.split(','):
+        if robot == 'basic':
+            # only robots that are in defualt openrave repository
+            robotfilenames += ['robots/pumaarm.zae','robots/barrettwam.robot.xml','robots/kawada-hironx.zae','ikfastrobots/fail1.robot.xml','robots/pr2-beta-static.zae','robots/kuka-youbot.zae', 'ikfastrobots/fail3.robot.xml']
+        elif robot == 'pr2':
+            robotfilenames += ['robots/pr2-beta-static.zae']
+        elif robot == '*':
+            robotfilenames += ['robots/unimation-pumaarm.zae','robots/barrett-wam.zae','robots/pr2-beta-static.zae','robots/neuronics-katana.zae','robots/mitsubishi-pa10.zae','robots/schunk-lwa3.zae','robots/darpa-arm.zae','robots/exactdynamics-manusarmleft.zae','robots/kuka-kr5-r650.zae','robots/kuka-kr5-r850.zae','robots/kuka-kr30l16.zae','robots/tridof.robot.xml','robots/barrett-wam4.zae','robots/kawada-hironx.zae','ikfastrobots/fail1.robot.xml','ikfastrobots/fail3.robot.xml', 'ikfastrobots/fail4.robot.xml','robots/kuka-youbot.zae', 'robots/universalrobots-ur6-85-5-a.zae']
+        elif robot == 'random':
+            robotfilenames.append('random')
+        else:
+            robotfilenames.append(robot)
+    return robotfilenames
+
+def GetIkTypeFromName(iktypestr):
+    for value,type in IkParameterizationType.values.iteritems():
+        if type.name.lower() == iktypestr.lower():
+            return type
+    return None
+
+def GetIkTypes(iktypes):
+    """expands a comma separated list of ik type names, * for all
+    """
+    if iktypes == '*':
+        return [IkParameterizationType.Transform6D, IkParameterizationType.Translation3D, IkParameterizationType.Lookat3D, IkParameterizationType.TranslationDirection5D, IkParameterizationType.TranslationXYOrientation3D, IkParameterizationType.TranslationLocalGlobal6D, IkParameterizationType.TranslationZAxisAngle4D, IkParameterizationType.TranslationXAxisAngleZNorm4D]
+    return [type for type in [GetIkTypeFromName(iktype) for iktype in iktypes.split(',')] if type is not None]
+
+def CreateOptionParser(description='ikfast benchmark'):
+    """options shared by the benchmark and test_ikfast.py
+    """
+    parser = OptionParser(description=description)
+    parser.add_option('--robots', action='store', type='string', dest='robots',default='basic',
+                      help='Robot groups to test, these are predetermined. type * for all default robots. The list can be comma separated to specify multiple groups/filenames. (default=%default)')
+    parser.add_option('-j', action='store', type='int', dest='numprocesses',default='4',
+                      help='Number of processors to run this in (default=%default).')
+    parser.add_option('--timeout','-t', action='store', type='float', dest='timeout',default='600',
+                      help='Timeout for each ikfast run, this includes time for generation and performance measurement. (default=%default)')
+    parser.add_option('--perftime', action='store', type='float', dest='perftime',default='20',
+                      help='Time (s) to run performance tests of generated IK. Performance is only computed if there are no wrong solutions. (default=%default)')
+    parser.add_option('--numiktests', action='store', type='string', dest='numiktests',default='1000,1000,100',
+                      help='Number of tests for testing the generated IK for correctness. Because test times increase exponentially with number of free joints, the iktests is an array of values indexec by the number of free joints. (default=%default)')
+    parser.add_option('--maxfreejoints',action='store',type='int',dest='maxfreejoints',default=1,
+                      help='max free joints to allow, 3 or more will take too long to evaluate, and most likely will never be used in real life (default=%default)')
+    parser.add_option('--iktypes',action='store',type='string',dest='iktypes',default='Transform6D',
+                      help='IK types to test for. Can be a comma separated list of the specific names or * for all (default=%default)')
+    parser.add_option('--freeincrot',action='store',type='float',dest='freeincrot',default='0.1',
+                      help='increment of revolute free joints (default=%default)')
+    parser.add_option('--freeinctrans',action='store',type='float',dest='freeinctrans',default='0.01',
+                      help='percentage increment of the free joints, this should be scaled with robot size (default=%default)')
+    parser.add_option('--errorthreshold',action='store',type='float',dest='errorthreshold',default='0.000001',
+                      help='The error threshold between ik parameterizations defining boundary of wrong solutions (default=%default)')
+    parser.add_option('--minimumsuccess',action='store',type='float',dest='minimumsuccess',default='0.4',
+                      help='Minimum success rate required to count test as passing (default=%default)')
+    parser.add_option('--maximumnosolutions',action='store',type='float',dest='maximumnosolutions',default='0.6',
+                      help='Maximum no-solutions rate allowed before test is decalred as a failure. In other words, if IK never finds anything, it is useless. (default=%default)')
+    parser.add_option('--jenkinsbuild',action='store',type='string',dest='jenkinsbuild_url',default='http://www.openrave.org/testing/job/openrave/lastSuccessfulBuild/',
+                      help='URL for the test results published by jenkins. This URL will be used to create links from the robot pages to the test page. (default=%default)')
+    return parser
+
+def ProcessOptions(options):
+    """converts the string options of :meth:`CreateOptionParser` into lists
+    """
+    options.iktypes = GetIkTypes(options.iktypes)
+    options.robotfilenames = GetRobotFilenames(options.robots)
+    options.numiktests = [int(s) for s in options.numiktests.split(',')]
+    return options
+
+def ComputeDebugIK(ikfastproblem,robotname,iktype,numfree,numiktests,errorthreshold,chunksize=100):
+    """runs DebugIK of the ikfast module on the active manipulator of the robot
+
+    :param chunksize: the number of tests of each DebugIK call, have to split into chunks because of timeouts
+    :return: numtested, numsuccessful, solutionresults where solutionresults are the lists of the wrong, no and missing solutions. Each entry is the ik parameterization string and the list of the free values strings.
+    """
+    solutionresults = [[],[],[]]
+    numtested = 0
+    numsuccessful = 0
+    ikdof = 1+IkParameterization.GetNumberOfValuesFromType(iktype)
+    cmd = 'DebugIK robot %s threshold %f '%(robotname, errorthreshold)
+    for ichunk in range((numiktests+chunksize-1)/chunksize):
+        res = ikfastproblem.SendCommand(cmd+'numtests %d '%chunksize).split()
+        numtested += int(res[0])
+        numsuccessful += int(res[1])
+        index = 2
+        for iresults in range(3):
+            num = int(res[index])
+            index += 1
+            for i in range(num):
+                solutionresults[iresults].append([' '.join(res[index:(index+ikdof)]),res[(index+ikdof):(index+ikdof+numfree)]])
+                index += ikdof+numfree
+    return numtested,numsuccessful,solutionresults
+
+def ComputePerfTiming(ikfastproblem,filename,num,maxtime):
+    """returns the run-times (s) of the ik calls measured by PerfTiming of the ikfast module
+    """
+    return fromstring(ikfastproblem.SendCommand('PerfTiming num %d maxtime %f %s'%(num,maxtime,filename)),dtype=float64,sep=' ')*1e-9
+
+def GetJobKey(job):
+    robotfilename,manipname,iktypestr,freeindices = job
+    return '%s:%s:%s:%s'%(robotfilename,manipname,iktypestr,','.join(str(index) for index in freeindices))
+
+def EnumerateJobs(options):
+    """returns the (robotfilename, manipname, iktypestr, freeindices) of all the ik to test
+    """
+    jobs = []
+    RaveInitialize(load_all_plugins=False)
+    RaveSetDebugLevel(DebugLevel.Error) # set to error in order to avoid expected plugin loading errors
+    envlocal=Environment()
+    envlocal.StopSimulation()
+    try:
+        for robotfilename in options.robotfilenames:
+            envlocal.Reset()
+            robot = envlocal.ReadRobotURI(robotfilename,{'skipgeometry':'1'})
+            envlocal.Add(robot)
+            for iktype in options.iktypes:
+                expecteddof = IkParameterization.GetDOFFromType(iktype)
+                for manip in robot.GetManipulators():
+                    armdof = len(manip.GetArmIndices())
+                    if armdof >= expecteddof and armdof <= expecteddof+options.maxfreejoints:
+                        for freeindices in combinations(manip.GetArmIndices(),armdof-expecteddof):
+                            jobs.append((robotfilename, manip.GetName(), str(iktype), tuple(freeindices)))
+    finally:
+        envlocal.Destroy()
+        # workers are forked, so have to destroy the runtime before starting them
+        RaveDestroy()
+    return jobs
+
+def _ComputeFileDigest(filename):
+    with open(filename,'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _NewRecord(job,options):
+    robotfilename,manipname,iktypestr,freeindices = job
+    numfree = len(freeindices)
+    testoptions = (ikfast.__version__, options.errorthreshold, options.numiktests[numfree], options.freeincrot, options.freeinctrans, options.perftime, options.numperftiming)
+    return {'type':'job', 'key':GetJobKey(job), 'robotfilename':robotfilename, 'manipname':manipname, 'iktype':iktypestr, 'freeindices':list(freeindices), 'ikfastversion':ikfast.__version__, 'optionsdigest':hashlib.sha1(repr(testoptions)).hexdigest(), 'status':None, 'cached':False}
+
+def RunJob(job,options,previous=None):
+    """generates/loads the ik of the job and measures its accuracy and timing. Has to run in its own process since it initializes and destroys the openrave runtime.
+
+    :param previous: the record of the last run of this job, if the ik source and test options are the same, it is returned without testing
+    :return: the result record
+    """
+    robotfilename,manipname,iktypestr,freeindices = job
+    record = _NewRecord(job,options)
+    iktype = GetIkTypeFromName(iktypestr)
+    starttime = time.time()
+    RaveInitialize(load_all_plugins=False)
+    RaveLoadPlugin('basesamplers')
+    success = RaveLoadPlugin('ikfastsolvers')
+    assert(success)
+    RaveSetDebugLevel(DebugLevel.Error) # set to error in order to avoid expected plugin loading errors
+    env=Environment()
+    try:
+        env.StopSimulation()
+        ikfastproblem = RaveCreateModule(env,'ikfast')
+        assert(ikfastproblem is not None)
+        env.Add(ikfastproblem)
+        with env:
+            robot = env.ReadRobotURI(robotfilename,{'skipgeometry':'1'})
+            env.Add(robot)
+            manip = robot.SetActiveManipulator(manipname)
+            # set base to identity to avoid complications when reporting errors, testing that IK works under transformations is a different test
+            robot.SetTransform(dot(linalg.inv(manip.GetBase().GetTransform()),robot.GetTransform()))
+            manip=robot.SetActiveManipulator(manipname)
+            ikmodel = databases.inversekinematics.InverseKinematicsModel(robot,iktype=iktype,freeindices=freeindices)
+            freeindicesstr = ', '.join(robot.GetJointFromDOFIndex(dof).GetName()+'('+str(dof)+')' for dof in freeindices)
+            record['description'] = '%s::%s.%s free:[%s]'%(os.path.split(robotfilename)[1].split('.')[0], manipname, iktypestr,freeindicesstr)
+            record['kinematicshash'] = manip.GetInverseKinematicsStructureHash(iktype)
+            try:
+                # remove any default ik solver for the manipulator, it can get in the way loading
+                ikmodel.manip.SetIKSolver(None)
+                if not ikmodel.load():
+                    ikmodel.generate(iktype=iktype,freeindices=freeindices,forceikbuild=True)
+                    ikmodel.save()
+                    ikmodel.setrobot()
+            except ikfast.IKFastSolver.IKFeasibilityError,e:
+                # this is expected, and is normal operation
+                ikmodel.ikfeasibility = unicode(e)
+            record['compiletime'] = ikmodel.statistics.get('generationtime',0)
+            if ikmodel.ikfeasibility is not None:
+                record['status'] = 'infeasible'
+                record['error'] = unicode(ikmodel.ikfeasibility)
+                return record
+
+            sourcefilename = ikmodel.getsourcefilename(read=True)
+            record['sourcefilename'] = sourcefilename
+            record['ikdigest'] = _ComputeFileDigest(sourcefilename if len(sourcefilename) > 0 else ikmodel.getfilename(True))
+            if previous is not None and previous.get('status') in ('success','failed') and previous.get('ikdigest') == record['ikdigest'] and previous.get('optionsdigest') == record['optionsdigest']:
+                previous['cached'] = True
+                return previous
+
+            ikmodel.freeinc = ikmodel.getDefaultFreeIncrements(options.freeincrot,options.freeinctrans)
+            assert(manip.GetIkSolver().GetNumFreeParameters() == len(freeindices))
+            numtested,numsuccessful,solutionresults = ComputeDebugIK(ikfastproblem,robot.GetName(),iktype,len(freeindices),int(options.numiktests[len(freeindices)]),options.errorthreshold)
+            times = ComputePerfTiming(ikfastproblem,ikmodel.getfilename(True),options.numperftiming,options.perftime)
+        record['numtested'] = numtested
+        record['successrate'] = float(numsuccessful)/numtested
+        record['wrongrate'] = float(len(solutionresults[0]))/numtested
+        record['nosolutionrate'] = float(len(solutionresults[1]))/numtested
+        record['missingrate'] = float(len(solutionresults[2]))/numtested
+        record['wrongexamples'] = [ikparamstr for ikparamstr,freevalues in solutionresults[0][0:10]]
+        if len(times) > 0:
+            p50,p90,p99 = percentile(times,[50,90,99])
+            record['latency'] = {'mean':float(mean(times)), 'max':float(max(times)), 'p50':float(p50), 'p90':float(p90), 'p99':float(p99), 'num':len(times)}
+        else:
+            record['latency'] = None
+        if len(solutionresults[0]) == 0 and record['successrate'] > options.minimumsuccess and record['nosolutionrate'] < options.maximumnosolutions:
+            record['status'] = 'success'
+        else:
+            record['status'] = 'failed'
+        return record
+
+    finally:
+        record['duration'] = time.time()-starttime
+        env.Destroy()
+        RaveDestroy()
+
+def _RunJobProcess(queue,job,options,previous):
+    try:
+        record = RunJob(job,options,previous)
+    except Exception, e:
+        record = _NewRecord(job,options)
+        record['status'] = 'error'
+        record['error'] = format_exc()
+    queue.put(record)
+
+def ReadResults(filename):
+    """reads a results file written by :meth:`RunJobs`
+
+    :return: the options of the last run and a dictionary of the last record of every job key
+    """
+    runoptions = None
+    records = dict()
+    if os.path.exists(filename):
+        with open(filename,'r') as f:
+            for line in f:
+                if len(line.strip()) == 0:
+                    continue
+                record = json.loads(line)
+                if record['type'] == 'options':
+                    runoptions = record
+                elif record['type'] == 'job':
+                    records[record['key']] = record
+    return runoptions,records
+
+def RunJobs(jobs,options,resultsfilename,previousrecords=None):
+    """runs the jobs in at most options.numprocesses processes at a time and appends each record to the results file as it finishes
+
+    :param previousrecords: the records of the last run indexed by the job key, used to skip the jobs whose ik did not change
+    :return: the records of all the jobs
+    """
+    if previousrecords is None:
+        previousrecords = dict()
+    queue = multiprocessing.Queue()
+    pending = list(jobs)
+    running = dict() # job key -> (process, job, start time)
+    records = []
+    with open(resultsfilename,'a') as f:
+        runoptions = {'type':'options', 'time':time.time(), 'ikfastversion':ikfast.__version__, 'numiktests':options.numiktests, 'errorthreshold':options.errorthreshold, 'minimumsuccess':options.minimumsuccess, 'maximumnosolutions':options.maximumnosolutions, 'freeincrot':options.freeincrot, 'freeinctrans':options.freeinctrans, 'perftime':options.perftime, 'numperftiming':options.numperftiming, 'jenkinsbuild_url':options.jenkinsbuild_url}
+        f.write(json.dumps(runoptions)+'\n')
+        f.flush()
+        def finish(record):
+            if not record['key'] in running:
+                # record of a job that was already terminated
+                return
+            process = running.pop(record['key'])[0]
+            process.join()
+            records.append(record)
+            if not record['cached']:
+                f.write(json.dumps(record)+'\n')
+                f.flush()
+            log.info('%d/%d %s: %s%s',len(records),len(jobs),record['key'],record['status'],' (cached)' if record['cached'] else '')
+
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < options.numprocesses:
+                job = pending.pop(0)
+                key = GetJobKey(job)
+                process = multiprocessing.Process(target=_RunJobProcess,args=(queue,job,options,previousrecords.get(key)))
+                process.start()
+                running[key] = (process,job,time.time())
+            try:
+                finish(queue.get(timeout=0.5))
+                while True:
+                    finish(queue.get_nowait())
+            except Empty:
+                pass
+            for key,(process,job,starttime) in running.items():
+                if not key in running:
+                    continue
+                if not process.is_alive():
+                    # process can exit right after sending its record
+                    try:
+                        while key in running:
+                            finish(queue.get(timeout=1.0))
+                    except Empty:
+                        record = _NewRecord(job,options)
+                        record['status'] = 'crashed'
+                        record['error'] = 'process exited with code %s'%process.exitcode
+                        finish(record)
+                elif time.time()-starttime > options.timeout:
+                    process.terminate()
+                    record = _NewRecord(job,options)
+                    record['status'] = 'timeout'
+                    record['duration'] = time.time()-starttime
+                    finish(record)
+    return records
+
+if __name__ == "__main__":
+    parser = CreateOptionParser(description='Parallel accuracy and timing benchmark of the ikfast solvers')
+    parser.add_option('--results', action='store', type='string', dest='results',default='ikfastbenchmark.jsonl',
+                      help='The file the json records of the runs are appended to. It is also read to skip the jobs whose ik did not change. (default=%default)')
+    parser.add_option('--numperftiming', action='store', type='int', dest='numperftiming',default=5000,
+                      help='Number of ik calls timed by the performance tests (default=%default).')
+    parser.add_option('--force', action='store_true', dest='force',default=False,
+                      help='Run all the jobs even if the ik did not change since the last run.')
+    parser.add_option('--debug','-d', action='store', type='int',dest='debug',default=logging.INFO,
+                      help='Debug level of the benchmark log (smaller values allow more text).')
+    options = ProcessOptions(parser.parse_args()[0])
+
+    format = logging.Formatter('%(name)s: %(levelname)s %(message)s')
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(format)
+    log.addHandler(handler)
+    log.setLevel(options.debug)
+
+    previousrecords = ReadResults(options.results)[1] if not options.force else None
+    jobs = EnumerateJobs(options)
+    records = RunJobs(jobs,options,options.results,previousrecords)
+    numstatus = dict()
+    for record in records:
+        numstatus[record['status']] = numstatus.get(record['status'],0)+1
+    log.info('finished %d jobs, %d cached: %s',len(records),len([record for record in records if record['cached']]),', '.join('%s %d'%(status,num) for status,num in sorted(numstatus.iteritems())))
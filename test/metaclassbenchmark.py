@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Rosen Diankov <rosen.diankov@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Memory and time of creating many :class:`metaclass.AutoReloader` models, like a long running service that keeps creating database generators.
+
+Every mode runs in its own process so that the peak resident memory is not shared:
+
+- notracking: the default, no instance is tracked
+- tracking: OPENRAVE_TRACKINSTANCES=1, dead instances remove themselves
+- list: the previous behavior, a weakref per instance appended to a list that is never pruned
+
+.. code-block:: bash
+
+  python metaclassbenchmark.py --num=1000000 --alive=100
+"""
+import os, sys, time, weakref, resource
+from subprocess import Popen, PIPE
+from optparse import OptionParser
+
+def RunMode(mode, num, alive):
+    """creates num models keeping the last alive ones referenced, returns (seconds, number of tracked references, peak resident memory increase in kB)"""
+    from openravepy import metaclass
+    metaclass.SetInstanceTracking(mode == 'tracking')
+    class Model(metaclass.AutoReloader):
+        def __init__(self, robot=None):
+            self.robot = robot
+            self.data = None
+    if mode == 'list':
+        refs = []
+        def create():
+            model = Model()
+            refs.append(weakref.ref(model))
+            return model
+    else:
+        refs = Model.__instance_refs__
+        create = Model
+    startmem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    models = [None]*alive
+    starttime = time.time()
+    for i in xrange(num):
+        models[i%alive] = create()
+    elapsedtime = time.time()-starttime
+    return elapsedtime, len(refs), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-startmem
+
+if __name__ == "__main__":
+    parser = OptionParser(description='Memory benchmark of the AutoReloader instance tracking')
+    parser.add_option('--num', action='store', type='int', dest='num',default=1000000,
+                      help='Number of models to create (default=%default).')
+    parser.add_option('--alive', action='store', type='int', dest='alive',default=100,
+                      help='Number of the latest models that are kept alive (default=%default).')
+    parser.add_option('--mode', action='store', type='string', dest='mode',default=None,
+                      help='Run only one mode in this process: notracking, tracking, list.')
+    (options, args) = parser.parse_args()
+    if options.mode is not None:
+        print '%f %d %d'%RunMode(options.mode, options.num, options.alive)
+        sys.exit(0)
+    print '%-12s %10s %12s %12s'%('mode','time (s)','tracked','peak kB')
+    for mode in ['notracking','tracking','list']:
+        proc = Popen([sys.executable, os.path.abspath(__file__), '--mode=%s'%mode, '--num=%d'%options.num, '--alive=%d'%options.alive], stdout=PIPE)
+        elapsedtime, numtracked, peakmem = proc.communicate()[0].split()
+        print '%-12s %10.3f %12d %12d'%(mode, float(elapsedtime), int(numtracked), int(peakmem))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Rosen Diankov <rosen.diankov@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Throughput of the bulk command serialization helpers of openravepy.interfaces against the per value string concatenation they replaced.
+
+.. code-block:: bash
+
+  python serializationbenchmark.py --num=1000000
+"""
+from openravepy.interfaces import serialization
+from optparse import OptionParser
+import numpy, time
+
+if __name__ == "__main__":
+    parser = OptionParser(description='Throughput of the command serialization helpers')
+    parser.add_option('--num', action='store', type='int', dest='num',default=1000000,
+                      help='Number of values to encode and decode (default=%default).')
+    parser.add_option('--numconcat', action='store', type='int', dest='numconcat',default=100000,
+                      help='Number of values for the per value concatenation baseline (default=%default).')
+    (options, args) = parser.parse_args()
+    values = numpy.random.rand(options.num)*200-100
+    starttime = time.time()
+    data = serialization.SerializeValues(values)
+    encodetime = time.time()-starttime
+    starttime = time.time()
+    newvalues = serialization.DeserializeValues(data)
+    decodetime = time.time()-starttime
+    assert(numpy.max(abs(newvalues-values)) <= 1e-12)
+    print '%d values: encode %fs (%f Mvalues/s), decode %fs (%f Mvalues/s)'%(len(values),encodetime,len(values)*1e-6/encodetime,decodetime,len(values)*1e-6/decodetime)
+    starttime = time.time()
+    data = ''
+    for f in values[0:options.numconcat]:
+        data += '%.15e '%f
+    concattime = time.time()-starttime
+    print 'per value concatenation of %d values: %fs (%f Mvalues/s)'%(options.numconcat,concattime,options.numconcat*1e-6/concattime)
+    starttime = time.time()
+    newvalues = numpy.array([float(f) for f in data.split()])
+    print 'per value split parsing of %d values: %fs'%(options.numconcat,time.time()-starttime)
@@ -38,5 +38,181 @@ class TestDatabases(EnvironmentSetup):
             assert(out is not None)
             assert(manip.GetIkSolver() is not None)
             
+    def test_convexdecomposition_padmesh(self):
+        from openravepy.databases.convexdecomposition import ConvexDecompositionModel
+        extents = array([0.1,0.2,0.3])
+        vertices,indices = misc.ComputeBoxMesh(extents)
+        # unweld the triangles so vertices have to be merged
+        soupvertices = vertices[indices.flatten()]
+        soupindices = arange(len(soupvertices)).reshape(-1,3)
+        vertices_map = ConvexDecompositionModel.ComputeDuplicateVerticesMap(soupvertices)
+        assert(len(unique(vertices_map)) == len(unique(indices)))
+        padding = 0.01
+        newvertices,newindices = ConvexDecompositionModel.PadMesh(soupvertices,soupindices,padding,setNormalsAwayFromCenter=True)
+        assert(all(abs(newvertices) <= extents+padding+g_epsilon))
+        # every face is extruded and every one of the 18 box edges is bridged with 4 triangles touching 8 new corner vertices
+        assert(all(abs(sqrt(sum((newvertices[0:len(soupvertices)]-soupvertices)**2,1))-padding) <= g_epsilon))
+        assert(len(newvertices) == len(soupvertices)+8 and len(newindices) == len(soupindices)+4*18)
+
+    def test_convexdecomposition_duplicatevertices(self):
+        from openravepy.databases.convexdecomposition import ConvexDecompositionModel
+        def ComputeDuplicateVerticesMapSequential(vertices, rtol=1e-05, atol=1e-08):
+            # the original O(N^2) merge
+            vertices_map = arange(len(vertices))
+            for a in range(len(vertices)):
+                if vertices_map[a] == a:
+                    combine = a + 1 + flatnonzero(isclose(vertices[a], vertices[a+1:], rtol, atol).all(axis=1))
+                    vertices_map[combine] = a
+            return vertices_map
+        for itrial in range(200):
+            points = random.rand(50,3)
+            # copies perturbed around the isclose tolerance so that close pairs straddle cell boundaries
+            copies = points[random.randint(50,size=10*random.randint(1,100))]
+            vertices = r_[points, copies+random.uniform(-3e-6,3e-6,copies.shape)]
+            vertices = vertices[random.permutation(len(vertices))]*(1000 if itrial%2 else 1)
+            assert(all(ConvexDecompositionModel.ComputeDuplicateVerticesMap(vertices) == ComputeDuplicateVerticesMapSequential(vertices)))
+
+    def test_convexdecomposition_packedhulls(self):
+        from openravepy.databases.convexdecomposition import ConvexDecompositionModel, PackedConvexHulls
+        env=self.env
+        self.LoadEnv('robots/barrettwam.robot.xml')
+        robot=env.GetRobots()[0]
+        cdmodel = ConvexDecompositionModel(robot)
+        if not cdmodel.load():
+            cdmodel.autogenerate()
+        with env:
+            packedhulls = cdmodel.GetPackedConvexHulls()
+            links = robot.GetLinks()
+            for ilink,planes,hulloffsets,spheres,cylinders,aabbmin,aabbmax,spherecenter,sphereradius in packedhulls.links:
+                # unpack the planes of every hull back into the geometry frame
+                hulls = [(links[ilink].GetGeometries()[ig].GetTransform(),hull) for ig,geomhulls in cdmodel.linkgeometry[ilink] for hull in geomhulls if len(hull[2]) > 0]
+                assert(len(hulls) == len(hulloffsets))
+                for ihull,(Tgeom,hull) in enumerate(hulls):
+                    hullplanes = planes[hulloffsets[ihull]:(hulloffsets[ihull+1] if ihull+1 < len(hulloffsets) else len(planes))]
+                    assert(transdist(dot(hullplanes,Tgeom),hull[2]) <= g_epsilon*len(hull[2]))
+                    # the hull vertices are on the boundary of the packed planes and inside the bounds
+                    linkvertices = transformPoints(Tgeom,hull[0])
+                    assert(abs(numpy.max(dot(linkvertices,hullplanes[:,0:3].T)+hullplanes[:,3])) <= 1e-6)
+                    assert(all(linkvertices >= aabbmin-g_epsilon) and all(linkvertices <= aabbmax+g_epsilon))
+                    assert(all(sqrt(sum((linkvertices-spherecenter)**2,1)) <= sphereradius+g_epsilon))
+            # compare against testing every hull separately in the world frame
+            points = random.rand(5000,3)*2-1+robot.GetTransform()[0:3,3]
+            inside = zeros(len(points),bool)
+            for ilink,link in enumerate(links):
+                for ig,geomhulls in cdmodel.linkgeometry[ilink]:
+                    Tgeom = dot(link.GetTransform(),link.GetGeometries()[ig].GetTransform())
+                    for hull in geomhulls:
+                        if len(hull[2]) > 0:
+                            localpoints = transformInversePoints(Tgeom,points)
+                            inside |= numpy.all(dot(localpoints,hull[2][:,0:3].T)+hull[2][:,3] <= 0,1)
+            assert(all(packedhulls.testPointsInside(points,robot.GetLinkTransformations()) == inside))
+
+    def test_convexdecomposition_packedprimitives(self):
+        from openravepy.databases.convexdecomposition import PackedConvexHulls
+        env=self.env
+        with env:
+            body = RaveCreateKinBody(env,'')
+            body.SetName('primitives')
+            cylinder = KinBody.Link.GeometryInfo()
+            cylinder._type = KinBody.Link.GeomType.Cylinder
+            cylinder._vGeomData = [0.1,0.4] # radius, height
+            cylinder._t = matrixFromAxisAngle([pi/2,0,0])
+            box = KinBody.Link.GeometryInfo()
+            box._type = KinBody.Link.GeomType.Box
+            box._vGeomData = [0.1,0.2,0.3]
+            box._t[0:3,3] = [1,0,0]
+            body.InitFromGeometries([cylinder,box])
+            env.Add(body)
+            # a model without decomposed hulls, so the primitive geometries are used
+            class NoHullsModel(object):
+                pass
+            cdmodel = NoHullsModel()
+            cdmodel.env = env
+            cdmodel.robot = body
+            cdmodel.linkgeometry = [[] for link in body.GetLinks()]
+            packedhulls = PackedConvexHulls(cdmodel)
+            Tcylinder = cylinder._t
+            # the cylinder axis is the local z axis
+            points = array([transformPoints(Tcylinder,[[0.09,0,0]])[0], # inside the radius
+                            transformPoints(Tcylinder,[[0,0.09,0.19]])[0], # inside the radius and height
+                            transformPoints(Tcylinder,[[0.08,0.08,0]])[0], # inside the xy bounding square but outside the radius
+                            transformPoints(Tcylinder,[[0,0,0.21]])[0], # above the cap
+                            transformPoints(Tcylinder,[[0,0.19,0]])[0], # along the local y axis, outside the radius
+                            [1.09,0.19,0.29],[1.11,0,0],[1,0,-0.31]])
+            assert(all(packedhulls.testPointsInside(points) == [True,True,False,False,False,True,False,False]))
+
+    def test_linkstatistics_grabbed(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        with env:
+            lmodel=databases.linkstatistics.LinkStatisticsModel(robot)
+            if not lmodel.load():
+                lmodel.autogenerate()
+            lmodel.setRobotWeights()
+            numgrabbedstates = len(lmodel.grabbedjointspheres)
+            bodies = [body for body in env.GetBodies() if body != robot][0:2]
+            for body in bodies:
+                robot.Grab(body)
+            grabbedinfo = robot.GetGrabbedInfo()
+        # the new grabbed state is saved once the environment lock is released
+        lmodel.setRobotResolutions()
+        with env:
+            assert(len(lmodel.grabbedjointspheres) == numgrabbedstates+1)
+            # the digest does not depend on the grab order
+            assert(lmodel._GetGrabbedDigest(grabbedinfo) == lmodel._GetGrabbedDigest(grabbedinfo[::-1]))
+            lmodel.setRobotWeights()
+            assert(len(lmodel.grabbedjointspheres) == numgrabbedstates+1)
+            # the new grabbed state is saved for other processes
+            lmodel2=databases.linkstatistics.LinkStatisticsModel(robot)
+            assert(lmodel2.load())
+            digest = lmodel._GetGrabbedDigest(grabbedinfo)
+            assert(digest in lmodel2.grabbedjointspheres)
+            robot.ReleaseAllGrabbed()
+            # a different body with the same name does not reuse the grabbed state
+            env.Remove(bodies[0])
+            box = RaveCreateKinBody(env,'')
+            box.SetName(bodies[0].GetName())
+            box.InitFromBoxes(array([[0,0,0,0.01,0.02,0.03]]),True)
+            env.Add(box)
+            assert(lmodel._GetGrabbedDigest(grabbedinfo) != digest)
+
+    def test_ikcache(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        manip=robot.GetActiveManipulator()
+        ikmodel = databases.inversekinematics.InverseKinematicsModel(robot,iktype=IkParameterizationType.Transform6D)
+        if not ikmodel.load():
+            ikmodel.autogenerate()
+        ikcache = ikmodel.EnableIkCache(maxsize=2)
+        with env:
+            Tee = manip.GetTransform()
+            solution = ikmodel.FindIKSolution(Tee,IkFilterOptions.CheckEnvCollisions)
+            assert(solution is not None)
+            solution2 = ikmodel.FindIKSolution(Tee,IkFilterOptions.CheckEnvCollisions)
+            assert(transdist(solution,solution2) <= g_epsilon)
+            assert(ikcache.hits == 1 and ikcache.misses == 1)
+            # moving any body in the environment invalidates collision checked entries
+            body = [b for b in env.GetBodies() if b != robot][0]
+            T = body.GetTransform()
+            T[2,3] += 0.01
+            body.SetTransform(T)
+            ikmodel.FindIKSolution(Tee,IkFilterOptions.CheckEnvCollisions)
+            assert(ikcache.invalidations == 1 and ikcache.misses == 2)
+            # but not entries that ignore the environment
+            ikmodel.FindIKSolutions(Tee,0)
+            body.SetTransform(dot(T,matrixFromAxisAngle([0,0,0.1])))
+            ikmodel.FindIKSolutions(Tee,0)
+            assert(ikcache.hits == 2)
+            # all the solutions do not depend on the current arm values
+            armindices = manip.GetArmIndices()
+            robot.SetDOFValues(robot.GetDOFValues(armindices)+0.01,armindices)
+            ikmodel.FindIKSolutions(Tee,0)
+            assert(ikcache.hits == 3)
+            ikmodel.FindIKSolution(Tee,0)
+            assert(ikcache.evictions == 1 and len(ikcache) == 2)
+
+
 #     def test_database_paths(self):
 #         pass
@@ -56,6 +56,20 @@ def test_transformations():
         posearray0 = randpose(5)
         posearray1 = poseMultArrayT(pose0,posearray0)
         assert( sum(abs(poseMult(pose0,posearray0[0])-posearray1[0])) <= g_epsilon )
+        # preallocated outputs
+        out = zeros((len(qarray0),4))
+        assert( quatArrayTMult(qarray0,quat0,out=out) is out and sum(abs(out-qarray1)) <= g_epsilon )
+        assert( quatMultArrayT(quat0,qarray0,out=out) is out and sum(abs(out-qarray2)) <= g_epsilon )
+        out = zeros((len(X),3))
+        assert( quatRotateArrayT(quat0,X,out=out) is out and sum(abs(out-Xnew)) <= g_epsilon )
+        out = zeros((len(posearray0),7))
+        assert( poseMultArrayT(pose0,posearray0,out=out) is out and sum(abs(out-posearray1)) <= g_epsilon )
+        dists = ComputePoseArrayDistSqr(pose0,posearray0,0.5)
+        for j in range(len(posearray0)):
+            quatdist2 = min(sum((pose0[0:4]-posearray0[j][0:4])**2),sum((pose0[0:4]+posearray0[j][0:4])**2))
+            assert( abs(dists[j] - 0.5*quatdist2 - sum((pose0[4:7]-posearray0[j][4:7])**2)) <= g_epsilon )
+        out = zeros(len(posearray0))
+        assert( ComputePoseArrayDistSqr(pose0,posearray0,0.5,out=out,work=zeros((len(posearray0),7))) is out and sum(abs(out-dists)) <= g_epsilon )
         for j in range(len(posearray0)):
             poseTransformPoints(pose0,poseTransformPoints(posearray0[j],X))
             poseTransformPoints(posearray1[j],X)
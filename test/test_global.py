@@ -63,3 +63,64 @@ def test_ikparam():
     
     ikparam2 = ikparam*T
     ikparam2.GetTranslationDirection5D().pos()
+
+def test_tsp():
+    log.info('tests the vectorized ordering of misc.TSP against the greedy python ordering')
+    def pathcost(sols):
+        return sum((sols[1:]-sols[:-1])**2)
+    
+    solutions = random.rand(200,6)
+    weights = random.rand(6)+0.1
+    oldsolutions,oldindices = misc.TSP(solutions,lambda x,y: sum(weights*(x-y)**2))
+    newsolutions,newindices = misc.TSP(solutions,weights=weights)
+    assert(newindices[0] == 0 and all(sort(newindices) == arange(len(solutions))))
+    assert(transdist(newsolutions,solutions[newindices]) <= g_epsilon)
+    assert(pathcost(newsolutions*sqrt(weights)) <= pathcost(oldsolutions*sqrt(weights))+g_epsilon)
+
+def test_spacesamplerextra():
+    log.info('tests the cached rotation samples and their separation')
+    sampler = misc.SpaceSamplerExtra(usediskcache=False)
+    for level,qarray in sampler.iterSampleSO3(2):
+        assert(qarray.shape == (72*8**level,4))
+        assert(all(abs(sum(qarray**2,1)-1) <= g_epsilon))
+        assert(transdist(qarray,misc.SpaceSamplerExtra(usediskcache=False).sampleSO3(level)) <= g_epsilon)
+    qarray = sampler.sampleSO3(1)
+    neighdists = [sort(quatArrayTDist(q,qarray))[1] for q in qarray]
+    assert(abs(mean(neighdists)-sampler.getSO3Separation(1)) <= g_epsilon)
+
+def test_commandserialization():
+    log.info('tests the bulk command serialization helpers, see serializationbenchmark.py for their throughput')
+    from openravepy.interfaces import serialization
+    values = random.rand(1000)*200-100
+    newvalues = serialization.DeserializeValues(serialization.SerializeValues(values))
+    assert(len(newvalues) == len(values))
+    assert(numpy.max(abs(newvalues-values)) <= 1e-12)
+    indices = random.randint(-1000,1000,(500,3))
+    assert(all(serialization.DeserializeValues(serialization.SerializeIntegers(indices),int) == indices.flatten()))
+    assert(serialization.SerializeValues([]) == '')
+    final,rest = serialization.DeserializeLeadingValues(' %s <trajectory> 1 2 </trajectory>'%serialization.SerializeValues(values[0:7]),7)
+    assert(numpy.max(abs(final-values[0:7])) <= 1e-12 and rest == '<trajectory> 1 2 </trajectory>')
+
+def test_instancetracking():
+    log.info('tracked instances are pruned when deleted and moved to the reloaded class')
+    from openravepy import metaclass
+    wastracking = metaclass.IsInstanceTracking()
+    try:
+        metaclass.SetInstanceTracking(True)
+        namespace = {'metaclass':metaclass}
+        classsource = 'class Model(metaclass.AutoReloader):\n    version=%d\n'
+        exec(classsource%0, namespace)
+        oldclass = namespace['Model']
+        models = [oldclass() for i in range(1000)]
+        assert(len(oldclass.__instance_refs__) == 1000)
+        del models[10:]
+        assert(len(oldclass.__instance_refs__) == 10)
+        exec(classsource%1, namespace)
+        newclass = namespace['Model']
+        assert(all([model.version == 1 for model in models]))
+        assert(len(newclass.__instances__()) == 10 and len(oldclass.__instance_refs__) == 0)
+        metaclass.SetInstanceTracking(False)
+        untracked = newclass()
+        assert(len(newclass.__instance_refs__) == 10)
+    finally:
+        metaclass.SetInstanceTracking(wastracking)
@@ -20,7 +20,7 @@ test_ikfast.py is being synchronized with the ikfast version, so don't try to re
 """
 from common_test_openrave import *
 from openravepy import ikfast
-from optparse import OptionParser
+from ikfastbenchmark import CreateOptionParser, ProcessOptions, ComputeDebugIK, ComputePerfTiming
 
 import time, sys, logging, multiprocessing
 #from nose.plugins import multiprocess
@@ -105,32 +105,11 @@ def robotstats(description,robotfilename,manipname, iktypestr,freeindices):
 
             ikmodel.freeinc = ikmodel.getDefaultFreeIncrements(options.freeincrot,options.freeinctrans)
             assert(manip.GetIkSolver().GetNumFreeParameters() == len(freeindices))
-            solutionresults = [[],[],[]]
-
-            numtested = 0
-            numsuccessful = 0
-            numiktests = int(options.numiktests[len(freeindices)])
-            chunksize = 100 # have to split into chunks because of timeouts
-            cmd = 'DebugIK robot %s threshold %f '%(robot.GetName(), options.errorthreshold)
-            for ichunk in range((numiktests+chunksize-1)/chunksize):
-                res = ikfastproblem.SendCommand(cmd+'numtests %d '%chunksize).split()
-                numtested += int(res[0])
-                numsuccessful += int(res[1])
-                index = 2
-                ikdof = 1+IkParameterization.GetNumberOfValuesFromType(iktype)
-                for iresults in range(3):
-                    num = int(res[index])
-                    index += 1
-                    for i in range(num):
-                        ikparam = IkParameterization(' '.join(res[index:(index+ikdof)]))
-                        index += ikdof
-                        solutionresults[iresults].append([ikparam,res[index:(index+len(freeindices))]])
-                        index += len(freeindices)
+            numtested,numsuccessful,solutionresults = ComputeDebugIK(ikfastproblem,robot.GetName(),iktype,len(freeindices),int(options.numiktests[len(freeindices)]),options.errorthreshold)
             successrate = float(numsuccessful)/numtested
             nosolutions = float(len(solutionresults[1]))/numtested
             wrongrate = float(len(solutionresults[0]))/numtested
-            resultsstr = ikfastproblem.SendCommand('PerfTiming num 5000 maxtime %f %s'%(options.perftime,ikmodel.getfilename(True)))
-            results = [numpy.double(s)*1e-9 for s in resultsstr.split()]
+            results = ComputePerfTiming(ikfastproblem,ikmodel.getfilename(True),5000,options.perftime)
             jointnames = ', '.join(robot.GetJointFromDOFIndex(dof).GetName() for dof in ikmodel.manip.GetArmIndices())
         except ikfast.IKFastSolver.IKFeasibilityError,e:
             # this is expected, and is normal operation, have to notify
@@ -162,7 +141,8 @@ def robotstats(description,robotfilename,manipname, iktypestr,freeindices):
             rows = []
             numprint = min(10,len(solutionresults[isol]))
             for index in numpy.random.permutation(len(solutionresults[isol]))[0:numprint]:
-                ikparam,freevalues = solutionresults[isol][index]
+                ikparamstr,freevalues = solutionresults[isol][index]
+                ikparam = IkParameterization(ikparamstr)
                 ikparamvalues = [str(f) for f in ikparam.GetTransform6D()[0:3,0:4].flatten()]
                 rows.append(ikparamvalues+freevalues)
             colwidths = [max([len(row[i]) for row in rows]) for i in range(len(rows[0]))]
@@ -196,65 +176,13 @@ class RunRobotStats:
             teardown_robotstats()
 
 def parseoptions(args=None):
-    parser = OptionParser(description='ikfast unit tests')
-    parser.add_option('--robots', action='store', type='string', dest='robots',default='basic',
-                      help='Robot groups to test, these are predetermined. type * for all default robots. The list can be comma separated to specify multiple groups/filenames. (default=%default)')
-    parser.add_option('-j', action='store', type='int', dest='numprocesses',default='4',
-                      help='Number of processors to run this in (default=%default).')
-    parser.add_option('--timeout','-t', action='store', type='float', dest='timeout',default='600',
-                      help='Timeout for each ikfast run, this includes time for generation and performance measurement. (default=%default)')
-    parser.add_option('--perftime', action='store', type='float', dest='perftime',default='20',
-                      help='Time (s) to run performance tests of generated IK. Performance is only computed if there are no wrong solutions. (default=%default)')
-    parser.add_option('--numiktests', action='store', type='string', dest='numiktests',default='1000,1000,100',
-                      help='Number of tests for testing the generated IK for correctness. Because test times increase exponentially with number of free joints, the iktests is an array of values indexec by the number of free joints. (default=%default)')
+    parser = CreateOptionParser(description='ikfast unit tests')
     parser.add_option('--debug','-d', action='store', type='int',dest='debug',default=logging.INFO,
                       help='Debug level for python nose (smaller values allow more text).')
-    parser.add_option('--maxfreejoints',action='store',type='int',dest='maxfreejoints',default=1,
-                      help='max free joints to allow, 3 or more will take too long to evaluate, and most likely will never be used in real life (default=%default)')
-    parser.add_option('--iktypes',action='store',type='string',dest='iktypes',default='Transform6D',
-                      help='IK types to test for. Can be a comma separated list of the specific names or * for all (default=%default)')
-    parser.add_option('--freeincrot',action='store',type='float',dest='freeincrot',default='0.1',
-                      help='increment of revolute free joints (default=%default)')
-    parser.add_option('--freeinctrans',action='store',type='float',dest='freeinctrans',default='0.01',
-                      help='percentage increment of the free joints, this should be scaled with robot size (default=%default)')
-    parser.add_option('--errorthreshold',action='store',type='float',dest='errorthreshold',default='0.000001',
-                      help='The error threshold between ik parameterizations defining boundary of wrong solutions (default=%default)')
-    parser.add_option('--minimumsuccess',action='store',type='float',dest='minimumsuccess',default='0.4',
-                      help='Minimum success rate required to count test as passing (default=%default)')
-    parser.add_option('--maximumnosolutions',action='store',type='float',dest='maximumnosolutions',default='0.6',
-                      help='Maximum no-solutions rate allowed before test is decalred as a failure. In other words, if IK never finds anything, it is useless. (default=%default)')
     parser.add_option('--outputdir',action='store',type='string',dest='outputdir',default='rst',
                       help='Directory to output the RST files used to show off the ikfast results. The root file in this directory is index.rst. (default=%default)')
-    parser.add_option('--jenkinsbuild',action='store',type='string',dest='jenkinsbuild_url',default='http://www.openrave.org/testing/job/openrave/lastSuccessfulBuild/',
-                      help='URL for the test results published by jenkins. This URL will be used to create links from the robot pages to the test page. (default=%default)')
     (options, parseargs) = parser.parse_args(args=args)
-    
-    if options.iktypes == '*':
-        options.iktypes = [IkParameterizationType.Transform6D, IkParameterizationType.Translation3D, IkParameterizationType.Lookat3D, IkParameterizationType.TranslationDirection5D, IkParameterizationType.TranslationXYOrientation3D, IkParameterizationType.TranslationLocalGlobal6D, IkParameterizationType.TranslationZAxisAngle4D, IkParameterizationType.TranslationXAxisAngleZNorm4D]
-    else:
-        iktypes = []
-        for iktype in options.iktypes.split(','):
-            for value,type in IkParameterizationType.values.iteritems():
-                if type.name.lower() == iktype.lower():
-                    iktypes.append(type)
-                    break
-        options.iktypes = iktypes
-    robots = options.robots.split(',')
-    options.robotfilenames = []
-    for robot in robots:
-        if robot == 'basic':
-            # only robots that are in defualt openrave repository
-            options.robotfilenames += ['robots/pumaarm.zae','robots/barrettwam.robot.xml','robots/kawada-hironx.zae','ikfastrobots/fail1.robot.xml','robots/pr2-beta-static.zae','robots/kuka-youbot.zae', 'ikfastrobots/fail3.robot.xml']
-        elif robot == 'pr2':
-            options.robotfilenames += ['robots/pr2-beta-static.zae']
-        elif robot == '*':
-            options.robotfilenames += ['robots/unimation-pumaarm.zae','robots/barrett-wam.zae','robots/pr2-beta-static.zae','robots/neuronics-katana.zae','robots/mitsubishi-pa10.zae','robots/schunk-lwa3.zae','robots/darpa-arm.zae','robots/exactdynamics-manusarmleft.zae','robots/kuka-kr5-r650.zae','robots/kuka-kr5-r850.zae','robots/kuka-kr30l16.zae','robots/tridof.robot.xml','robots/barrett-wam4.zae','robots/kawada-hironx.zae','ikfastrobots/fail1.robot.xml','ikfastrobots/fail3.robot.xml', 'ikfastrobots/fail4.robot.xml','robots/kuka-youbot.zae', 'robots/universalrobots-ur6-85-5-a.zae']
-        elif options.robots == 'random':
-            options.robotfilenames.append('random')
-        else:
-            options.robotfilenames.append(robot)
-    options.numiktests = [int(s) for s in options.numiktests.split(',')]
-    return options
+    return ProcessOptions(options)
 
 def test_robot_ikfast():
     global options
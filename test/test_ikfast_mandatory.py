@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from common_test_openrave import *
+import sys, ctypes, shutil, tempfile
 
 class TestIkFast(EnvironmentSetup):
     freeincrot=0.1
@@ -162,6 +163,130 @@ class TestIkFast(EnvironmentSetup):
             if expectedruntime is not None:
                 assert(meanresults<=expectedruntime)
 
+    def ImportFkFast(self):
+        # fkfast is still experimental, so it lives in the sandbox
+        sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','sandbox'))
+        try:
+            import fkfast
+        finally:
+            sys.path.pop(0)
+        return fkfast
+
+    def RunFkFast(self, robotfilename, numconfigs=100, minimumvalid=1, compilecpp=False):
+        """compares the generated forward kinematics of all the links against the ones openrave computes.
+
+        OpenRAVE does not solve the passive joints of closed loops, so across them only the joint anchors and axes of the two attached links are checked to coincide.
+
+        :param minimumvalid: minimum ratio of the random configurations whose closed loops can be assembled
+        :param compilecpp: if True, also compiles the generated C++ code and compares it against the numpy module
+        """
+        fkfast = self.ImportFkFast()
+        env=self.env
+        with env:
+            robot = env.ReadRobotURI(robotfilename,{'skipgeometry':'1'})
+            env.Add(robot)
+            # the generated transforms are relative to the first link
+            robot.SetTransform(numpy.dot(numpy.linalg.inv(robot.GetLinks()[0].GetTransform()),robot.GetTransform()))
+            # the anchors and axes of the joints in the two attached links, the robot is loaded in an assembled configuration
+            jointframes = []
+            for joint in robot.GetJoints()+robot.GetPassiveJoints():
+                links = [joint.GetFirstAttached(),joint.GetSecondAttached()]
+                if links[0] is None or links[1] is None:
+                    continue
+                localanchors = [transformInversePoints(link.GetTransform(),[joint.GetAnchor()])[0] for link in links]
+                localaxes = [numpy.dot(joint.GetAxis(0),link.GetTransform()[0:3,0:3]) for link in links]
+                ispassive = joint.GetDOFIndex() < 0 and not joint.IsMimic(0) and not joint.IsStatic()
+                jointframes.append((joint,[link.GetIndex() for link in links],localanchors,localaxes,ispassive))
+            haspassive = any([ispassive for joint,ilinks,localanchors,localaxes,ispassive in jointframes])
+            fkmodule = fkfast.GetForwardKinematicsModule(robot)
+            assert(fkmodule.numlinks == len(robot.GetLinks()))
+            assert(fkfast.GetForwardKinematicsModule(robot) is fkmodule)
+            lower,upper = robot.GetDOFLimits()
+            lower = numpy.maximum(lower,-numpy.pi)
+            upper = numpy.minimum(upper,numpy.pi)
+            dofvalues = lower+numpy.random.rand(numconfigs,robot.GetDOF())*(upper-lower)
+            starttime = time.time()
+            Tlinks = fkmodule.ComputeLinkTransforms(dofvalues)
+            batchtime = time.time()-starttime
+            assert(Tlinks.shape == (numconfigs,len(robot.GetLinks()),4,4))
+            # the closed loops of some configurations cannot be assembled, all their transforms are NaN
+            valid = numpy.all(numpy.isfinite(Tlinks.reshape(numconfigs,-1)),1)
+            assert(numpy.all(numpy.isnan(Tlinks[~valid])))
+            assert(numpy.sum(valid) >= minimumvalid*numconfigs)
+            starttime = time.time()
+            for i,values in enumerate(dofvalues):
+                if not valid[i]:
+                    continue
+                robot.SetDOFValues(values)
+                Texpected = robot.GetLinkTransformations()
+                # ikfast rounds the constant transforms of the links to its precision
+                if not haspassive:
+                    assert(transdist(Tlinks[i],Texpected) <= 1e-5*len(Texpected))
+                for joint,(ilink0,ilink1),localanchors,localaxes,ispassive in jointframes:
+                    T0 = Tlinks[i][ilink0]
+                    T1 = Tlinks[i][ilink1]
+                    if ispassive:
+                        assert(numpy.linalg.norm(transformPoints(T0,[localanchors[0]])-transformPoints(T1,[localanchors[1]])) <= 1e-5)
+                        assert(numpy.linalg.norm(numpy.dot(T0[0:3,0:3],localaxes[0])-numpy.dot(T1[0:3,0:3],localaxes[1])) <= 1e-5)
+                    else:
+                        # the values of the dof and mimic joints are known, so the links move relative to each other like in openrave
+                        Trelative = numpy.dot(numpy.linalg.inv(T0),T1)
+                        Texpectedrelative = numpy.dot(numpy.linalg.inv(Texpected[ilink0]),Texpected[ilink1])
+                        assert(transdist(Trelative,Texpectedrelative) <= 1e-5)
+            settime = time.time()-starttime
+            if valid[0]:
+                assert(transdist(fkmodule.ComputeLinkTransforms(dofvalues[0]),Tlinks[0]) <= g_epsilon)
+            self.log.info('fkfast %s: %d configurations in %fs, SetDOFValues takes %fs',robotfilename,numconfigs,batchtime,settime)
+            if compilecpp:
+                # the C++ source has to compile and agree with the numpy module on the transforms and on which configurations can be assembled
+                fklibrary = self.CompileFkFast(fkfast.GetFilename(robot.GetKinematicsGeometryHash(),'cpp',read=True))
+                assert(fklibrary.GetNumLinks() == len(robot.GetLinks()) and fklibrary.GetNumJoints() == robot.GetDOF())
+                ctransforms = numpy.zeros(numconfigs*len(robot.GetLinks())*12)
+                numcomputed = fklibrary.ComputeLinkTransformsBatch(numconfigs,numpy.ascontiguousarray(dofvalues,numpy.float64).ctypes.data_as(ctypes.c_void_p),ctransforms.ctypes.data_as(ctypes.c_void_p))
+                ctransforms = ctransforms.reshape(numconfigs,len(robot.GetLinks()),3,4)
+                assert(numcomputed == numpy.sum(valid))
+                assert(numpy.all(numpy.isnan(ctransforms[~valid])))
+                assert(numpy.max(abs(ctransforms[valid]-Tlinks[valid][:,:,0:3,:])) <= 1e-8)
+            env.Remove(robot)
+
+    def CompileFkFast(self, sourcefilename):
+        """compiles the C++ forward kinematics generated by fkfast into a shared object and loads it with ctypes
+        """
+        from openravepy.databases.inversekinematics import InverseKinematicsModel
+        from pkg_resources import resource_filename
+        compiler,compile_flags = InverseKinematicsModel.getcompiler()
+        builddir = tempfile.mkdtemp()
+        try:
+            platformsourcefilename = os.path.join(builddir,'fkfast.cpp')
+            shutil.copyfile(sourcefilename,platformsourcefilename)
+            objectfiles = compiler.compile(sources=[platformsourcefilename],macros=[('IKFAST_CLIBRARY',1),('IKFAST_NO_MAIN',1)],include_dirs=[os.path.dirname(resource_filename('openravepy','ikfast.h'))],extra_postargs=compile_flags,output_dir=builddir)
+            output_filename = os.path.join(builddir,compiler.shared_object_filename(basename='fkfast'))
+            compiler.link_shared_object(objectfiles,output_filename=output_filename)
+            fklibrary = ctypes.CDLL(output_filename)
+        finally:
+            shutil.rmtree(builddir)
+        fklibrary.ComputeLinkTransformsBatch.restype = ctypes.c_int
+        fklibrary.ComputeLinkTransformsBatch.argtypes = [ctypes.c_int,ctypes.c_void_p,ctypes.c_void_p]
+        return fklibrary
+
+    def test_fkfast(self):
+        for robotfilename in ['ikfastrobots/testik0.zae','ikfastrobots/fail1.dae','ikfastrobots/fail3.robot.xml']:
+            self.RunFkFast(robotfilename)
+
+    def test_fkfast_closedloop(self):
+        # the passive four-bar loop is solved by fkfast, about 60% of the crank angles can be assembled. Also has mimic joints depending on mimic joints.
+        self.RunFkFast('testdata/fourbar.robot.xml',minimumvalid=0.4,compilecpp=True)
+        self.RunFkFast('ikfastrobots/testik0.zae',compilecpp=True)
+
+    def test_fkfast_mimicdefinitions(self):
+        # the bucket linkage mimic equations use fparser definitions and polyroots6, which cannot be converted to sympy
+        fkfast = self.ImportFkFast()
+        env=self.env
+        with env:
+            robot = env.ReadRobotURI('testdata/arm_bucket_assy_Amimic.robot.xml',{'skipgeometry':'1'})
+            env.Add(robot)
+            assert_raises(fkfast.ikfast.IKFastSolver.CannotSolveError,fkfast.FKFastSolver(robot).SolveFK)
+
     def test_testik0(self):
         self.RunIkFast('ikfastrobots/testik0.zae','arm', IkParameterizationType.Transform6D, expectedruntime=45e-6,minimumsuccess=1)
     def test_fail1(self):
@@ -166,6 +166,36 @@ class TestIkSolver(EnvironmentSetup):
             ikreturn = solver.Solve(ikparam2,None, IkFilterOptions.CheckEnvCollisions)
             assert( ikreturn.GetAction() in expectedactions)
         
+    def test_computeikbatch(self):
+        env=self.env
+        self.LoadEnv('data/lab1.env.xml')
+        robot=env.GetRobots()[0]
+        ikmodel = databases.inversekinematics.InverseKinematicsModel(robot,IkParameterization.Type.Transform6D)
+        if not ikmodel.load():
+            ikmodel.autogenerate()
+
+        with env:
+            manip = ikmodel.manip
+            armindices = list(manip.GetArmIndices())
+            lower,upper = robot.GetDOFLimits(armindices)
+            configs = lower+random.rand(100,len(armindices))*(upper-lower)
+            # ComputeIkBatch takes the raw poses of the ik chain
+            Tbaseinv = linalg.inv(manip.GetBase().GetTransform())
+            Ttoolinv = linalg.inv(manip.GetLocalToolTransform())
+            rawposes = []
+            for config in configs:
+                robot.SetDOFValues(config,armindices)
+                rawposes.append(dot(Tbaseinv,dot(manip.GetTransform(),Ttoolinv)))
+            rawposes = array(rawposes)
+            freevalues = configs[:,[armindices.index(index) for index in ikmodel.freeindices]]
+            solutions,offsets = ikmodel.ComputeIkBatch(rawposes[:,0:3,3],rawposes[:,0:3,0:3],freevalues,maxsolutions=10)
+            assert(len(offsets) == len(configs)+1 and offsets[-1] == len(solutions))
+            for i,config in enumerate(configs):
+                posesolutions = solutions[offsets[i]:offsets[i+1]]
+                assert(len(posesolutions) > 0)
+                anglediffs = abs(mod(posesolutions-config+pi,2*pi)-pi)
+                assert(numpy.min(numpy.max(anglediffs,1)) <= 1e-5)
+
     def test_customikvalues(self):
         env=self.env
         self.LoadEnv('data/lab1.env.xml')
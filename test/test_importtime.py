@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 Rosen Diankov <rosen.diankov@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the startup time of openravepy in a fresh interpreter, the output mimics python -X importtime (which python 2 does not have).
+
+.. code-block:: bash
+
+  python test_importtime.py openravepy.databases.inversekinematics
+  OPENRAVE_LAZYIMPORT=0 python test_importtime.py
+"""
+import os, sys, json
+from subprocess import Popen, PIPE
+from optparse import OptionParser
+
+# run in the child interpreter, wraps __import__ to accumulate the time spent loading each new module
+_importtimescript = """
+import sys, time, json, __builtin__
+_import = __builtin__.__import__
+_stack = [0.0]
+_timings = []
+def _timedimport(name, globals=None, locals=None, fromlist=None, level=-1):
+    before = set(sys.modules.keys())
+    _stack.append(0.0)
+    starttime = time.time()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        cumulative = time.time()-starttime
+        childtime = _stack.pop()
+        _stack[-1] += cumulative
+        newmodules = [m for m in sys.modules.keys() if not m in before and sys.modules[m] is not None]
+        if len(newmodules) > 0:
+            # name the entry after the requested module, relative imports and fromlist submodules are only known by their suffix
+            requested = [name] + [name+'.'+f for f in (fromlist or ()) if f != '*'] + [f for f in (fromlist or ()) if f != '*']
+            matches = [m for m in newmodules if any([m == r or m.endswith('.'+r) for r in requested if len(r) > 0])]
+            _timings.append((cumulative-childtime, cumulative, len(_stack)-1, sorted(matches or newmodules, key=len)[0]))
+__builtin__.__import__ = _timedimport
+starttime = time.time()
+for modulename in sys.argv[1:]:
+    __import__(modulename)
+totaltime = time.time()-starttime
+__builtin__.__import__ = _import
+print json.dumps({'timings':_timings, 'totaltime':totaltime, 'modules':sorted(sys.modules.keys())})
+"""
+
+def MeasureImportTime(modulenames=('openravepy',), lazyimport=True):
+    """imports the modules in a new interpreter
+
+    :return: (timings, totaltime, loaded module names). timings is a list of (self seconds, cumulative seconds, nesting level, module name) in the order the imports finished
+    """
+    env = dict(os.environ)
+    env['OPENRAVE_LAZYIMPORT'] = '1' if lazyimport else '0'
+    proc = Popen([sys.executable,'-c',_importtimescript]+list(modulenames), stdout=PIPE, env=env)
+    out = proc.communicate()[0]
+    assert(proc.returncode == 0)
+    result = json.loads(out.strip().splitlines()[-1])
+    return [tuple(timing) for timing in result['timings']], result['totaltime'], result['modules']
+
+def PrintImportTime(timings, totaltime):
+    print 'import time: self [us] | cumulative | imported package'
+    for selftime, cumulative, level, modulename in timings:
+        print 'import time: %9d | %10d | %s%s'%(selftime*1e6, cumulative*1e6, '  '*level, modulename)
+    print 'total: %fs'%totaltime
+
+def test_lazyimport():
+    timings, totaltime, modules = MeasureImportTime(['openravepy'], lazyimport=True)
+    for modulename in ['openravepy.databases.inversekinematics', 'openravepy.databases.inversereachability', 'openravepy.interfaces.Grasper', 'scipy', 'h5py']:
+        assert(not modulename in modules)
+    assert(not any([modulename.startswith('openravepy.examples.') for modulename in modules]))
+    # the submodules are still reachable as attributes
+    timings, totaltime, modules = MeasureImportTime(['openravepy', 'openravepy.databases.inversekinematics'], lazyimport=True)
+    assert('openravepy.databases.inversekinematics' in modules)
+
+def test_eagerimport():
+    lazytimings, lazytotaltime, lazymodules = MeasureImportTime(['openravepy.databases'], lazyimport=True)
+    timings, totaltime, modules = MeasureImportTime(['openravepy.databases'], lazyimport=False)
+    assert('openravepy.databases.inversekinematics' in modules and 'openravepy.databases.inversereachability' in modules)
+    assert(set(lazymodules) < set(modules))
+
+if __name__ == "__main__":
+    parser = OptionParser(description='Prints the time to import openravepy modules in a new interpreter.', usage='%prog [options] [modules]')
+    parser.add_option('--sort', action='store_true', dest='sort', default=False,
+                      help='Sort by self time instead of import order.')
+    (options, args) = parser.parse_args()
+    timings, totaltime, modules = MeasureImportTime(args if len(args) > 0 else ['openravepy'], lazyimport=os.environ.get('OPENRAVE_LAZYIMPORT','1') != '0')
+    if options.sort:
+        timings.sort(key=lambda timing: -timing[0])
+    PrintImportTime(timings, totaltime)